@@ -0,0 +1,400 @@
+from __future__ import annotations
+
+import copy
+import math
+from collections.abc import MutableMapping
+from typing import Any, Callable, Iterator, Optional
+
+import numpy as np
+
+from Desim.Core import Event, SimModule, SimTime
+from Desim.memory.Memory import ChunkMemory, ChunkMemoryPort, ChunkPacket
+from Desim.module.FIFO import DelayFIFO
+
+from NeutronSim.Config import MemoryConfig
+from NeutronSim.Utils import get_sim_cycle
+
+"""
+用 numpy 数组保存状态的 chunk memory, 接口与 Desim 的 ChunkMemory / ChunkMemoryPort 一致
+每个地址保存写入次数 (引用计数, 大于 0 表示有 tag), 以及 chunk 的元素个数 / batch / 元素字节数
+payload 只有不为 None 的时候才保存在字典中, 只关心时序的仿真不会占用额外的内存
+等待 tag 的 event 只在有人等待的时候创建
+port 支持 burst 访问, 每个 chunk 的读写时间以及 tag 的变化与逐个 chunk 访问相同, 只是省去了中间的等待
+"""
+
+
+class MemoryTagView(MutableMapping):
+    """
+    兼容 ChunkMemory.memory_tag 的字典视图, 地址 -> 写入次数, 只包含有 tag 的地址
+    """
+
+    def __init__(self,memory:ArrayChunkMemory):
+        self.memory = memory
+
+    def __getitem__(self,addr:int)->int:
+        if addr < 0 or addr >= self.memory.size or self.memory.write_count[addr] == 0:
+            raise KeyError(addr)
+        return int(self.memory.write_count[addr])
+
+    def __setitem__(self,addr:int,write_count:int):
+        self.memory.ensure_size(addr+1)
+        self.memory.write_count[addr] = write_count
+        # 与 store / clear 一样唤醒等待这个地址的读写
+        self.memory.notify_change(addr)
+
+    def __delitem__(self,addr:int):
+        if self[addr]:
+            self.memory.clear(addr)
+
+    def __iter__(self)->Iterator[int]:
+        return iter(np.flatnonzero(self.memory.write_count).tolist())
+
+    def __len__(self)->int:
+        return int(np.count_nonzero(self.memory.write_count))
+
+    def __repr__(self)->str:
+        return repr(dict(self))
+
+
+class ArrayChunkMemory:
+    def __init__(self,bandwidth:int,size:int=1<<16,max_burst_chunk:int=8):
+        self.bandwidth = bandwidth
+        self.max_burst_chunk = max_burst_chunk
+
+        self.write_count:np.ndarray = np.zeros(size,dtype=np.uint32)
+        self.num_elements:np.ndarray = np.zeros(size,dtype=np.int32)
+        self.batch_size:np.ndarray = np.zeros(size,dtype=np.int32)
+        self.element_bytes:np.ndarray = np.zeros(size,dtype=np.uint8)
+
+        self.payload_dict:dict[int,Any] = {}
+        # 地址 -> 等待这个地址状态变化的 event
+        self.wait_event_dict:dict[int,Event] = {}
+
+    @property
+    def size(self)->int:
+        return len(self.write_count)
+
+    @property
+    def memory_tag(self)->MemoryTagView:
+        return MemoryTagView(self)
+
+    def ensure_size(self,stop:int):
+        if stop <= self.size:
+            return
+        new_size = max(stop,self.size*2)
+        for name in ['write_count','num_elements','batch_size','element_bytes']:
+            array = getattr(self,name)
+            new_array = np.zeros(new_size,dtype=array.dtype)
+            new_array[:len(array)] = array
+            setattr(self,name,new_array)
+
+    def get_access_latency(self,num_bytes:int)->int:
+        return math.ceil(num_bytes / self.bandwidth)
+
+    def wait_change(self,addr:int):
+        event = self.wait_event_dict.get(addr)
+        if event is None:
+            event = Event()
+            self.wait_event_dict[addr] = event
+        SimModule.wait(event)
+
+    def notify_change(self,addr:int):
+        event = self.wait_event_dict.pop(addr,None)
+        if event is not None:
+            event.notify(SimTime(0))
+
+    def store(self,addr:int,data:Any,num_elements:int,batch_size:int,element_bytes:int):
+        self.ensure_size(addr+1)
+        self.write_count[addr] += 1
+        self.num_elements[addr] = num_elements
+        self.batch_size[addr] = batch_size
+        self.element_bytes[addr] = element_bytes
+        if data is not None:
+            self.payload_dict[addr] = data
+        self.notify_change(addr)
+
+    def clear(self,addr:int):
+        self.write_count[addr] = 0
+        self.payload_dict.pop(addr,None)
+        self.notify_change(addr)
+
+    def notify_range(self,start:int,stop:int):
+        if self.wait_event_dict:
+            for addr in range(start,stop):
+                self.notify_change(addr)
+
+    def store_range(self,start:int,data_list:list,num_elements:int,batch_size:int,element_bytes:int):
+        stop = start + len(data_list)
+        self.ensure_size(stop)
+        self.write_count[start:stop] += 1
+        self.num_elements[start:stop] = num_elements
+        self.batch_size[start:stop] = batch_size
+        self.element_bytes[start:stop] = element_bytes
+        for i,data in enumerate(data_list):
+            if data is not None:
+                self.payload_dict[start+i] = data
+        self.notify_range(start,stop)
+
+    def clear_range(self,start:int,stop:int):
+        self.free_range(start,stop)
+        self.notify_range(start,stop)
+
+    def direct_write(self,addr:int,data:Any,check_write_tag:bool=False,
+                     num_elements:int=0,num_batch_size:int=0,element_bytes:int=0):
+        """
+        不经过 port, 没有时间开销, 用于仿真开始之前写入数据
+        """
+        self.ensure_size(addr+1)
+        if check_write_tag and self.write_count[addr] > 0:
+            raise ValueError(f'address {addr} already has a tag')
+        self.store(addr,data,num_elements,num_batch_size,element_bytes)
+
+    # 以下是按地址范围的向量化操作, 不经过 port, 没有时间开销
+    def init_range(self,start:int,stop:int,num_elements:int,batch_size:int,element_bytes:int,
+                   write_count:int=1):
+        self.ensure_size(stop)
+        self.write_count[start:stop] = write_count
+        self.num_elements[start:stop] = num_elements
+        self.batch_size[start:stop] = batch_size
+        self.element_bytes[start:stop] = element_bytes
+
+    def free_range(self,start:int,stop:int):
+        self.ensure_size(stop)
+        self.write_count[start:stop] = 0
+        for addr in [addr for addr in self.payload_dict if start <= addr < stop]:
+            del self.payload_dict[addr]
+
+    def get_valid_range(self,start:int,stop:int)->np.ndarray:
+        self.ensure_size(stop)
+        return self.write_count[start:stop] > 0
+
+    def get_write_count_range(self,start:int,stop:int)->np.ndarray:
+        self.ensure_size(stop)
+        return self.write_count[start:stop].copy()
+
+    def get_bytes_range(self,start:int,stop:int)->np.ndarray:
+        self.ensure_size(stop)
+        return (self.num_elements[start:stop].astype(np.int64) * self.batch_size[start:stop]
+                * self.element_bytes[start:stop])
+
+    def get_valid_num(self)->int:
+        return int(np.count_nonzero(self.write_count))
+
+
+class ArrayChunkMemoryPort:
+    """
+    读取的时候等待写入次数达到 count, free 之后清除 tag
+    check_write_tag 的写入需要等待之前的数据被 free, 否则直接累加写入次数 (例如 reduce buffer)
+    每次访问按照 memory 的带宽等待 ceil(字节数 / 带宽) 的时间
+    """
+
+    def __init__(self):
+        self.memory:Optional[ArrayChunkMemory] = None
+
+    def config_chunk_memory(self,memory:ArrayChunkMemory):
+        self.memory = memory
+
+    def read(self,addr:int,count:int,free:bool,num_elements:int,batch_size:int,element_bytes:int)->Any:
+        memory = self.memory
+        memory.ensure_size(addr+1)
+        while memory.write_count[addr] < count:
+            memory.wait_change(addr)
+
+        SimModule.wait_time(SimTime(memory.get_access_latency(num_elements*batch_size*element_bytes)))
+
+        data = memory.payload_dict.get(addr)
+        if free:
+            memory.clear(addr)
+        return data
+
+    def write(self,addr:int,data:Any,check_write_tag:bool,num_elements:int,batch_size:int,element_bytes:int):
+        memory = self.memory
+        memory.ensure_size(addr+1)
+        if check_write_tag:
+            while memory.write_count[addr] > 0:
+                memory.wait_change(addr)
+
+        SimModule.wait_time(SimTime(memory.get_access_latency(num_elements*batch_size*element_bytes)))
+
+        memory.store(addr,data,num_elements,batch_size,element_bytes)
+
+    def read_burst(self,addr:int,chunk_num:int,count:int,free:bool,num_elements:int,batch_size:int,
+                   element_bytes:int,chunk_callback:Callable[[int,Any,int],None])->int:
+        """
+        从 addr 开始, 读取已经就绪的连续一段 chunk (至少一个, 最多 max_burst_chunk 个), 返回读取的个数
+        每个 chunk 在上一个 chunk 交给下游之后开始读取, 结束时间与逐个调用 read 相同,
+        通过 chunk_callback(下标, 数据, 结束时间) 交给下游
+        free 的 chunk 在各自的结束时间释放, 不需要 free 并且下游是 DelayFIFO 的时候整个 burst 只等待一次
+        """
+        memory = self.memory
+        memory.ensure_size(addr+chunk_num)
+        while memory.write_count[addr] < count:
+            memory.wait_change(addr)
+
+        ready = memory.write_count[addr:addr+min(chunk_num,memory.max_burst_chunk)] >= count
+        burst_num = len(ready) if ready.all() else int(np.argmin(ready))
+
+        chunk_latency = memory.get_access_latency(num_elements*batch_size*element_bytes)
+        finish_time = get_sim_cycle()
+        for i in range(burst_num):
+            finish_time += chunk_latency
+            data = memory.payload_dict.get(addr+i)
+            if free:
+                remain_time = finish_time - get_sim_cycle()
+                if remain_time > 0:
+                    SimModule.wait_time(SimTime(remain_time))
+                memory.clear(addr+i)
+            chunk_callback(i,data,finish_time)
+            # 下游是普通 FIFO 的时候 chunk_callback 中已经等待过, 还可能因为 FIFO 满而更晚
+            finish_time = max(finish_time,get_sim_cycle())
+
+        remain_time = finish_time - get_sim_cycle()
+        if remain_time > 0:
+            SimModule.wait_time(SimTime(remain_time))
+        return burst_num
+
+    def write_burst(self,addr:int,data_list:list,check_write_tag:bool,
+                    num_elements:int,batch_size:int,element_bytes:int):
+        """
+        写入一段连续的 chunk, 与逐个调用 write 的时序相同:
+        每个 chunk 单独等待自己的地址被 free, 在各自的结束时间写入并唤醒等待的读取
+        """
+        memory = self.memory
+        memory.ensure_size(addr+len(data_list))
+        chunk_latency = memory.get_access_latency(num_elements*batch_size*element_bytes)
+        for i,data in enumerate(data_list):
+            if check_write_tag:
+                while memory.write_count[addr+i] > 0:
+                    memory.wait_change(addr+i)
+            SimModule.wait_time(SimTime(chunk_latency))
+            memory.store(addr+i,data,num_elements,batch_size,element_bytes)
+
+
+def make_chunk_memory(memory_config:MemoryConfig):
+    if memory_config.memory_model == 'array':
+        return ArrayChunkMemory(memory_config.bandwidth,memory_config.array_size,memory_config.max_burst_chunk)
+    return ChunkMemory(memory_config.bandwidth)
+
+
+def make_chunk_memory_port(memory):
+    if isinstance(memory,ArrayChunkMemory):
+        port = ArrayChunkMemoryPort()
+    else:
+        port = ChunkMemoryPort()
+    port.config_chunk_memory(memory)
+    return port
+
+
+def get_memory_state(memory)->dict[str,Any]:
+    """
+    仿真静止的时候 memory 的完整状态, 用于 checkpoint
+    ArrayChunkMemory 包括每个地址的写入次数, chunk 的形状以及 payload
+    """
+    if isinstance(memory,ArrayChunkMemory):
+        return {
+            'write_count':memory.write_count.copy(),
+            'num_elements':memory.num_elements.copy(),
+            'batch_size':memory.batch_size.copy(),
+            'element_bytes':memory.element_bytes.copy(),
+            'payload_dict':copy.deepcopy(memory.payload_dict),
+        }
+    return {'memory_tag':copy.deepcopy(dict(memory.memory_tag))}
+
+
+def set_memory_state(memory,state:dict[str,Any]):
+    """
+    恢复 get_memory_state 保存的状态, memory 需要是新构建的
+    """
+    if isinstance(memory,ArrayChunkMemory):
+        for name in ['write_count','num_elements','batch_size','element_bytes']:
+            setattr(memory,name,state[name].copy())
+        memory.payload_dict = copy.deepcopy(state['payload_dict'])
+        return
+    memory.memory_tag.update(copy.deepcopy(state['memory_tag']))
+
+
+def preload_range(memory,start:int,chunk_num:int,num_elements:int,batch_size:int,element_bytes:int):
+    """
+    仿真开始之前在一段连续的地址上写入数据, ArrayChunkMemory 一次写完整段地址
+    """
+    if isinstance(memory,ArrayChunkMemory):
+        memory.init_range(start,start+chunk_num,num_elements,batch_size,element_bytes)
+        return
+
+    for i in range(chunk_num):
+        memory.direct_write(
+            start+i,None,check_write_tag=False,
+            num_elements=num_elements,num_batch_size=batch_size,
+            element_bytes=element_bytes
+        )
+
+
+def deliver_chunk(fifo,item:Any,finish_time:int):
+    """
+    chunk 在 finish_time 传输结束, DelayFIFO 直接延迟写入, 普通 FIFO 需要先等到 finish_time
+    """
+    remain_time = finish_time - get_sim_cycle()
+    if isinstance(fifo,DelayFIFO):
+        fifo.delay_write(item,SimTime(max(remain_time,0)))
+        return
+
+    if remain_time > 0:
+        SimModule.wait_time(SimTime(remain_time))
+    fifo.write(item)
+
+
+def burst_read(port,addr:int,chunk_num:int,count:int,free:bool,num_elements:int,batch_size:int,element_bytes:int,
+               chunk_callback:Callable[[int,Any,int],None]):
+    """
+    读取 chunk_num 个连续的 chunk, chunk_callback(下标, 数据, 结束时间)
+    ArrayChunkMemory 按 burst 读取, Desim 的 ChunkMemory 逐个 chunk 读取, 结束时间就是读取返回的时间
+    """
+    if isinstance(port,ArrayChunkMemoryPort):
+        read_num = 0
+        while read_num < chunk_num:
+            base = read_num
+            read_num += port.read_burst(addr+base,chunk_num-base,count,free,num_elements,batch_size,element_bytes,
+                                        lambda i,data,finish_time: chunk_callback(base+i,data,finish_time))
+        return
+
+    for i in range(chunk_num):
+        data = port.read(addr+i,count,free,num_elements,batch_size,element_bytes)
+        chunk_callback(i,data,get_sim_cycle())
+
+
+def burst_write(port,addr:int,data_list:list,check_write_tag:bool,num_elements:int,batch_size:int,element_bytes:int):
+    if isinstance(port,ArrayChunkMemoryPort):
+        max_burst_chunk = port.memory.max_burst_chunk
+        for start in range(0,len(data_list),max_burst_chunk):
+            port.write_burst(addr+start,data_list[start:start+max_burst_chunk],check_write_tag,
+                             num_elements,batch_size,element_bytes)
+        return
+
+    for i,data in enumerate(data_list):
+        port.write(addr+i,data,check_write_tag,num_elements,batch_size,element_bytes)
+
+
+def burst_write_from_fifo(port,input_fifo,addr:int,chunk_num:int,check_write_tag:bool,
+                          get_data:Callable[[ChunkPacket],Any]):
+    """
+    从 input_fifo 中读取 chunk_num 个 packet 并写入 memory
+    ArrayChunkMemory 每次把 FIFO 中已经到达的 packet 一起写入, Desim 的 ChunkMemory 逐个写入
+    """
+    if not isinstance(port,ArrayChunkMemoryPort):
+        for i in range(chunk_num):
+            packet:ChunkPacket = input_fifo.read()
+            port.write(addr+i,get_data(packet),check_write_tag,packet.num_elements,packet.batch_size,packet.element_bytes)
+        return
+
+    max_burst_chunk = port.memory.max_burst_chunk
+    write_num = 0
+    while write_num < chunk_num:
+        # 至少等到一个 packet, 之后把已经到达的 packet 全部取出来
+        packet_list:list[ChunkPacket] = [input_fifo.read()]
+        while len(packet_list) < min(chunk_num-write_num,max_burst_chunk) and not input_fifo.is_empty():
+            packet_list.append(input_fifo.read())
+
+        packet = packet_list[0]
+        port.write_burst(addr+write_num,[get_data(packet) for packet in packet_list],check_write_tag,
+                         packet.num_elements,packet.batch_size,packet.element_bytes)
+        write_num += len(packet_list)
@@ -7,8 +7,16 @@ from typing import Literal, Optional, Union, Deque
 from Desim.Core import SimModule, SimSession
 from Desim.Core import Event
 
+from NeutronSim.ArrayMemory import make_chunk_memory, ArrayChunkMemory, burst_read, burst_write, \
+    burst_write_from_fifo, deliver_chunk
 from NeutronSim.Commands import ComputeCommand
-from NeutronSim.Config import MemoryConfig, element_bytes_dict, LinkConfig, AtomConfig
+from NeutronSim.CommandQueue import make_command_queue, share_command_source, CommandSequence, CommandStream, \
+    ListCommandSequence, IndexedCommandSequence, FilteredCommandStream, SharedDecodeSequence
+from NeutronSim.Config import MemoryConfig, element_bytes_dict, LinkConfig, AtomConfig, TopologyConfig
+from NeutronSim.Link import D2DLinkModel, LinkTransfer
+from NeutronSim.Packet import make_chunk_packet
+from NeutronSim.PerfCounter import PerfMonitor
+from NeutronSim.Utils import get_sim_cycle
 from Desim.Core import SimTime
 from Desim.memory.Memory import DepMemory, ChunkMemoryPort, ChunkPacket
 
@@ -21,6 +29,10 @@ if TYPE_CHECKING:
     from NeutronSim.Chip import Chip
 
 
+# 逐 chunk 模式下 StoreLink.input_fifo 与 store_link_to_write_fifo 的总容量
+store_link_transfer_capacity:int = 20
+
+
 class AtomInstance(SimModule):
     def __init__(self,top_module:AtomManager,
                  atom_id:int = -1,
@@ -38,24 +50,20 @@ class AtomInstance(SimModule):
                                                   l2_memory_config,
                                                   atom_config)
 
-        self.link_request_queue:deque[AtomResourceRequest] = deque()
+        # 仲裁用的资源, 由 AtomManager 构建, link 可能被多个 atom 共用
+        self.link_resource:Optional[ArbiterResource] = None
 
         # compute的资源暂时没有启用
-        self.compute_request_queue:deque[AtomResourceRequest] = deque()
-
-        self.current_link_request:Optional[AtomResourceRequest] = None
-
-        # 暂时没有启用
-        self.current_compute_request:Optional[AtomResourceRequest] = None
+        self.compute_resource:ArbiterResource = ArbiterResource()
 
 
 
 
     def link_in_use(self)->bool:
-        return self.current_link_request is not None
+        return self.link_resource.in_use()
 
     def compute_in_use(self)->bool:
-        return self.current_compute_request is not None
+        return self.compute_resource.in_use()
 
     def load_command(self,command_list:list[ComputeCommand]):
         self.atom_die.load_command(command_list)
@@ -64,115 +72,161 @@ class AtomInstance(SimModule):
         self.atom_die.config_connection(reduce_memory)
 
 
-@dataclass
+class ArbiterResource:
+    """
+    一个可以被独占的资源, 包含等待队列和当前持有该资源的请求
+    """
+    def __init__(self):
+        self.request_queue:deque[AtomResourceRequest] = deque()
+        self.current_request:Optional[AtomResourceRequest] = None
+
+    def in_use(self)->bool:
+        return self.current_request is not None
+
+
+@dataclass(eq=False)
 class AtomResourceRequest:
+    # 按照对象本身比较, 内容相同的两个请求也是不同的请求
     resource_type:Optional[Literal['link','compute']] = None  # link 仅表示单向的输入带宽,输出 link 自动控制 
     access_type:Optional[Literal['acquire','release']] = None 
     resources_id:list[int] = field(default_factory=list)
     requester_id:int = -1
     acquire_finish_event:Optional[Event] = None
 
-    # TODO 比较函数
-
 
 class AtomManager(SimModule):
 
     def __init__(self, top_module:Chip,
                  d2d_link_config:LinkConfig,
                  l2_memory_config:MemoryConfig,
-                 atom_config:AtomConfig):
+                 atom_config:AtomConfig,
+                 topology_config:TopologyConfig=TopologyConfig()):
         super().__init__()
 
         self.top_module = top_module
 
         self.d2d_link_config = d2d_link_config
         self.l2_memory_config = l2_memory_config
+        self.topology_config = topology_config
 
 
         # pending 仅表示当前周期新来的 request , 不是处于等待状态的 request
         self.pending_acquire_request_queue:deque[AtomResourceRequest] = deque()
         self.pending_release_request_queue:deque[AtomResourceRequest] = deque()
 
-        self.waiting_acquire_request_queue:deque[AtomResourceRequest] = deque()
+        # 处于等待状态的 acquire 请求, value 是到达的顺序, 删除是 O(1) 的
+        self.waiting_acquire_request_dict:dict[AtomResourceRequest,int] = dict()
+        self.acquire_request_order:int = 0
 
 
         self.atom_instance_dict:dict[int,AtomInstance]=dict()
-        for i in range(8):
-            self.atom_instance_dict[i] = AtomInstance(self, i,d2d_link_config,l2_memory_config,atom_config)
+        self.link_resource_dict:dict[int,ArbiterResource]=dict()
+        # 返回方向的 link, 与发送方向一样按照 atom_link_map 共用
+        self.store_link_dict:dict[int,StoreLink]=dict()
+        for i in range(self.topology_config.num_atoms):
+            atom_instance = AtomInstance(self, i,d2d_link_config,l2_memory_config,atom_config)
+
+            link_id = self.topology_config.get_link_id(i)
+            if link_id not in self.link_resource_dict:
+                self.link_resource_dict[link_id] = ArbiterResource()
+                self.store_link_dict[link_id] = StoreLink(link_id,d2d_link_config)
+            atom_instance.link_resource = self.link_resource_dict[link_id]
+            atom_instance.atom_die.store_link = self.store_link_dict[link_id]
+
+            self.atom_instance_dict[i] = atom_instance
+
+        # load_command 传入的全部 compute 指令, 每个 atom 的指令索引从这里构建
+        self.command_source = None
+
+        # group -> {link id: 该 link 上的 atom}
+        self.link_atom_dict_cache:dict[tuple[int,...],dict[int,list[int]]] = dict()
 
         self.update_event = Event()
 
+        # acquire 请求到达的时间, 只在打开计数器的时候记录
+        self.perf_monitor:PerfMonitor = PerfMonitor()
+        self.acquire_wait_counter = self.perf_monitor.get_wait_counter('atom_manager.link_acquire')
+        self.acquire_time_dict:dict[AtomResourceRequest,int] = dict()
+
         self.register_coroutine(self.process)
 
     def process(self):
         while True:
             SimModule.wait(self.update_event)
             # 当有新的 acquire 或者 release request到来的时候, 就更新资源分配
+            # 只有新到达的请求, 以及被释放的 atom 上的队首请求才有可能发射, 其他的请求不需要重新检查
+
+            ready_request_set:set[AtomResourceRequest] = set()
 
             # 首先处理当前 release 请求
-            for release_req in self.pending_release_request_queue:
-                for resource_id in release_req.resources_id:
-                    if release_req.resource_type == 'link':
-                        self.atom_instance_dict[resource_id].current_link_request = None 
-                    elif release_req.resource_type == 'compute':
-                        self.atom_instance_dict[resource_id].current_compute_request = None
+            while self.pending_release_request_queue:
+                release_req = self.pending_release_request_queue.popleft()
+                for resource in self.get_resource_list(release_req):
+                    resource.current_request = None
+                    if resource.request_queue:
+                        ready_request_set.add(resource.request_queue[0])
 
             # 注册 acquire 请求 
-            for acquire_req in self.pending_acquire_request_queue:
-                self.waiting_acquire_request_queue.append(acquire_req)
-                for resource_id in acquire_req.resources_id:
-                    if acquire_req.resource_type == 'link':
-                        self.atom_instance_dict[resource_id].link_request_queue.append(acquire_req) 
-                    elif acquire_req.resource_type == 'compute':
-                        self.atom_instance_dict[resource_id].compute_request_queue.append(acquire_req)
-                
-            # 从 waiting 的 queue 中取出符合标准的
-            issue_queue:Deque[AtomResourceRequest] = deque()
-            for waiting_req in self.waiting_acquire_request_queue:
-                can_issue = True
-                for resource_id in waiting_req.resources_id:
-                    atom_instance = self.atom_instance_dict[resource_id]
-                    if waiting_req.resource_type == 'link':
-                        if atom_instance.link_in_use() or \
-                                (not atom_instance.link_request_queue[0] == waiting_req):
-                            can_issue = False
-                            break
-                    elif waiting_req.resource_type == 'compute':
-                        if  atom_instance.compute_in_use() or \
-                                (not atom_instance.compute_request_queue[0] == waiting_req):
-                            can_issue = False
-                            break
-                
-                if can_issue:
-                    issue_queue.append(waiting_req)
-                    # issue
-                    
-                    for resource_id in waiting_req.resources_id:
-                        atom_instance = self.atom_instance_dict[resource_id] 
-
-                        if waiting_req.resource_type == 'link':
-                            assert atom_instance.current_link_request is None 
-                            atom_instance.current_link_request = atom_instance.link_request_queue.popleft()
-
-                        elif waiting_req.resource_type == 'compute':
-                            assert atom_instance.current_compute_request is None
-                            atom_instance.current_compute_request = atom_instance.compute_request_queue.popleft()
-
-                        # notify 
-                        waiting_req.acquire_finish_event.notify(SimTime(0))
-
-            for req in issue_queue:
-                self.waiting_acquire_request_queue.remove(req) # 不支持中间的元素的删除  emmm
-                # 释放对应的请求
+            while self.pending_acquire_request_queue:
+                acquire_req = self.pending_acquire_request_queue.popleft()
+                self.waiting_acquire_request_dict[acquire_req] = self.acquire_request_order
+                self.acquire_request_order += 1
+
+                for resource in self.get_resource_list(acquire_req):
+                    resource.request_queue.append(acquire_req)
+
+                ready_request_set.add(acquire_req)
+
+            # 按照到达的顺序检查, 与原先扫描整个 waiting queue 的发射顺序一致
+            issue_list:list[AtomResourceRequest] = []
+            for waiting_req in sorted(ready_request_set,key=self.waiting_acquire_request_dict.__getitem__):
+                if self.can_issue(waiting_req):
+                    self.issue(waiting_req)
+                    issue_list.append(waiting_req)
+
+            # 与原先的 notify 顺序保持一致: 发射时每个资源 notify 一次 SimTime(0), 全部发射之后再 notify 一次 SimTime(1)
+            for req in issue_list:
                 req.acquire_finish_event.notify(SimTime(1))
 
-            
+    def get_resource_list(self,req:AtomResourceRequest)->list[ArbiterResource]:
+        """
+        请求中的 resources_id 都是 atom id, link 需要转换为实际的 link, 共用 link 的 atom 只占用一次
+        """
+        if req.resource_type == 'link':
+            link_atom_dict = self.get_link_atom_dict(req.resources_id)
+            return [self.link_resource_dict[link_id] for link_id in link_atom_dict]
+        elif req.resource_type == 'compute':
+            return [self.atom_instance_dict[resource_id].compute_resource for resource_id in req.resources_id]
+        raise ValueError
+
+    def can_issue(self,waiting_req:AtomResourceRequest)->bool:
+        for resource in self.get_resource_list(waiting_req):
+            if resource.in_use() or (resource.request_queue[0] is not waiting_req):
+                return False
+        return True
+
+    def issue(self,waiting_req:AtomResourceRequest):
+        for resource in self.get_resource_list(waiting_req):
+            assert resource.current_request is None
+            resource.current_request = resource.request_queue.popleft()
+
+        del self.waiting_acquire_request_dict[waiting_req]
+
+        if self.acquire_wait_counter.enabled:
+            self.acquire_wait_counter.add_wait(get_sim_cycle() - self.acquire_time_dict.pop(waiting_req))
+
+        # notify 
+        for _ in waiting_req.resources_id:
+            waiting_req.acquire_finish_event.notify(SimTime(0))
 
     def handle_acquire_request(self,req:AtomResourceRequest):
         # check
         assert req.access_type == 'acquire'
         assert req.acquire_finish_event is not None 
 
+        if self.acquire_wait_counter.enabled:
+            self.acquire_time_dict[req] = get_sim_cycle()
+
         self.pending_acquire_request_queue.append(req)
         self.update_event.notify(SimTime(0))
 
@@ -182,17 +236,104 @@ class AtomManager(SimModule):
         self.pending_release_request_queue.append(req)
         self.update_event.notify(SimTime(0))
 
+    def get_link_id(self,atom_id:int)->int:
+        return self.topology_config.get_link_id(atom_id)
+
+    def get_link_atom_dict(self,group_id:list[int])->dict[int,list[int]]:
+        group_key = tuple(group_id)
+        if group_key not in self.link_atom_dict_cache:
+            link_atom_dict:dict[int,list[int]] = dict()
+            for atom_id in group_id:
+                link_atom_dict.setdefault(self.get_link_id(atom_id),[]).append(atom_id)
+            self.link_atom_dict_cache[group_key] = link_atom_dict
+        return self.link_atom_dict_cache[group_key]
+
+    def get_saved_compute_event_num(self) -> int:
+        return sum(atom_instance.atom_die.saved_wait_event_num
+                   for atom_instance in self.atom_instance_dict.values())
+
     def get_atom_instance(self,atom_id:int) -> AtomInstance:
         return self.atom_instance_dict[atom_id]
 
     def load_command(self,command_list:list[ComputeCommand]):
-        for atom_instance in self.atom_instance_dict.values():
-            atom_instance.load_command(command_list)
+        # 迭代器需要被所有的 atom 共享读取
+        command_list = share_command_source(command_list)
+        if isinstance(command_list,(list,tuple)):
+            command_list = ListCommandSequence(list(command_list))
+        self.command_source = command_list
+
+        if isinstance(command_list,CommandSequence) and not isinstance(command_list,ListCommandSequence):
+            # trace 中的指令每次读取都会解码出新的对象, 同一条指令在 group 中每个 atom 的四个 engine 之间共享
+            command_list = SharedDecodeSequence(
+                command_list,lambda command:4*sum(atom_id in self.atom_instance_dict for atom_id in command.group_id))
+
+        # 按照 group_id 为每个 atom 构建自己的指令索引, 不在 group 中的指令不会发送给这个 atom
+        for atom_id,atom_instance in self.atom_instance_dict.items():
+            atom_instance.load_command(self.build_atom_command_source(command_list,atom_id))
+
+    def build_atom_command_source(self,command_list,atom_id:int):
+        if isinstance(command_list,CommandSequence):
+            return IndexedCommandSequence(command_list,command_list.get_group_index_list(atom_id))
+        elif isinstance(command_list,CommandStream):
+            return FilteredCommandStream(command_list,lambda command:atom_id in command.group_id)
+        raise ValueError
 
     def config_connection(self,reduce_memory:ChunkMemory):
         for atom_instance in self.atom_instance_dict.values():
             atom_instance.config_connection(reduce_memory)
 
+    def config_perf_monitor(self,perf_monitor:PerfMonitor):
+        self.perf_monitor = perf_monitor
+        self.acquire_wait_counter = self.perf_monitor.get_wait_counter('atom_manager.link_acquire')
+        for atom_id,atom_instance in self.atom_instance_dict.items():
+            atom_die = atom_instance.atom_die
+            perf_monitor.register_memory(atom_die.l2_memory,f'l2-{atom_id}',self.l2_memory_config.bandwidth)
+            atom_die.perf_monitor = perf_monitor
+        for store_link in self.store_link_dict.values():
+            store_link.perf_monitor = perf_monitor
+
+
+class StoreLink(SimModule):
+    """
+    atom 返回 (store) 方向的 uci-e link
+    与发送方向一样, 共用一条 link 的 atom 依次占用这条 link
+    """
+    def __init__(self,link_id:int,d2d_link_config:LinkConfig=LinkConfig()):
+        super().__init__()
+
+        self.link_id = link_id
+        self.d2d_link_config = d2d_link_config
+
+        # 这条 link 上所有 atom 的 store read 都写入这里, 元素是 (发送的 atom die, chunk packet)
+        self.input_fifo:DelayFIFO = DelayFIFO(10, 0)
+
+        # coalesce 模式下所有 atom 共用的事务级模型
+        self.link_model:D2DLinkModel = D2DLinkModel(self.d2d_link_config)
+
+        self.perf_monitor:PerfMonitor = PerfMonitor()
+        self.perf_name:str = f'store_link.{self.link_id}'
+
+        if not self.d2d_link_config.coalesce:
+            self.register_coroutine(self.link_handler)
+
+    def link_handler(self):
+        # link 没有指令, 按照每个 chunk 统计
+        link_counter = self.perf_monitor.get_stage_counter(f'{self.perf_name}.link')
+        while True:
+            atom_die,chunk_packet = self.input_fifo.read()
+            link_counter.begin('chunk')
+
+            chunk_bytes = chunk_packet.chunk_bytes
+
+            transfer_latency = math.ceil(chunk_bytes/self.d2d_link_config.bandwidth)
+
+            SimModule.wait_time(SimTime(transfer_latency))
+            link_counter.add_busy(transfer_latency)
+            link_counter.add_bytes(chunk_bytes)
+
+            atom_die.store_link_to_write_fifo.write(chunk_packet)
+            link_counter.end()
+
 
 class AtomDie(SimModule):
     def __init__(self,top_module:AtomInstance,
@@ -210,7 +351,7 @@ class AtomDie(SimModule):
         self.l2_memory_config = l2_memory_config
         self.atom_config = atom_config
 
-        self.l2_memory:ChunkMemory = ChunkMemory(self.l2_memory_config.bandwidth)
+        self.l2_memory:ChunkMemory = make_chunk_memory(self.l2_memory_config)
         self.external_reduce_memory:Optional[ChunkMemory] = None
         
 
@@ -221,99 +362,144 @@ class AtomDie(SimModule):
         self.store_engine_write_command_queue:Optional[FIFO] = None
 
         self.fetch_to_compute_fifo:FIFO = FIFO(10)
+        if isinstance(self.l2_memory,ArrayChunkMemory):
+            # burst 读取的时候, chunk 按照各自传输结束的时间到达 compute engine
+            self.fetch_to_compute_fifo = DelayFIFO(10,0)
+
+        # fast compute 模式下省掉的 wait_time 次数
+        self.saved_wait_event_num:int = 0
 
-        self.store_read_to_link_fifo:DelayFIFO = DelayFIFO(10, 0)
+        # 计数器在各个 handler 开始运行的时候获取
+        self.perf_monitor:PerfMonitor = PerfMonitor()
+        self.perf_name:str = f'atom.{self.atom_id}'
+
+        # 返回方向的 link, 由 AtomManager 设置, 可能与其他 atom 共用
+        self.store_link:Optional[StoreLink] = None
         self.store_link_to_write_fifo:FIFO = FIFO(10)
 
+        # coalesce 模式下, store read 直接算出 link 的完成时间, 不再需要 link_handler
+        # 每条指令只向 store write 传递一个 LinkTransfer
+        if self.d2d_link_config.coalesce:
+            self.store_link_to_write_fifo = FIFO(1)
+
         # self.register_coroutine(self.process)
         self.register_coroutine(self.fetch_engine_handler)
         self.register_coroutine(self.compute_engine_handler)
 
         self.register_coroutine(self.store_engine_read_handler)
         self.register_coroutine(self.store_engine_write_handler)    
-        self.register_coroutine(self.link_handler)
 
 
 
     def fetch_engine_handler(self):
-        l2_memory_read_port = ChunkMemoryPort()
-        l2_memory_read_port.config_chunk_memory(self.l2_memory)
+        l2_memory_read_port = self.perf_monitor.make_memory_port(self.l2_memory,f'{self.perf_name}.fetch')
+        fetch_counter = self.perf_monitor.get_stage_counter(f'{self.perf_name}.fetch')
         # 这个只是从 l2 memory 中读取
         while True:
             if self.fetch_engine_command_queue.is_empty():
                 return
             
             current_command = self.fetch_engine_command_queue.read()
+            fetch_counter.begin(current_command.opcode)
 
-            # TODO check 这个指令的 atom id 是否匹配
+            # 指令已经在 AtomManager 中按照 group_id 筛选过了
 
             # 执行这一条指令
-            for i in range(current_command.src_chunk_num):
-                data = l2_memory_read_port.read(current_command.src + i, 1, current_command.src_free,
-                                                current_command.src_chunk_size, current_command.batch_size,
-                                                element_bytes_dict[current_command.src_dtype])
-
-                chunk_packet = ChunkPacket(
+            def fetch_chunk(i:int,data,finish_time:int):
+                chunk_packet = make_chunk_packet(
                     payload=data,
                     num_elements=current_command.src_chunk_size,
                     batch_size=current_command.batch_size,
                     element_bytes=element_bytes_dict[current_command.src_dtype]
                 )
 
-                self.fetch_to_compute_fifo.write(chunk_packet)
+                deliver_chunk(self.fetch_to_compute_fifo,chunk_packet,finish_time)
+
+            burst_read(l2_memory_read_port,current_command.src,current_command.src_chunk_num,1,current_command.src_free,
+                       current_command.src_chunk_size,current_command.batch_size,
+                       element_bytes_dict[current_command.src_dtype],fetch_chunk)
+
+            fetch_counter.end()
 
 
     def compute_engine_handler(self):
-        l2_memory_write_port = ChunkMemoryPort()
-        l2_memory_write_port.config_chunk_memory(self.l2_memory)
+        # 写回 l2 的时间也算在 compute engine 中
+        l2_memory_write_port = self.perf_monitor.make_memory_port(self.l2_memory,f'{self.perf_name}.compute')
+        compute_counter = self.perf_monitor.get_stage_counter(f'{self.perf_name}.compute')
         while True:
             # 获取到指令, 开始执行 
             if self.compute_engine_command_queue.is_empty():
                 return 
 
             current_command:ComputeCommand = self.compute_engine_command_queue.read()
+            compute_counter.begin(current_command.opcode)
             # 执行这一条指令 , 直接按照算力之类的计算延迟应该是可行的
 
-            for i in range(current_command.src_chunk_num):
+            if self.atom_config.fast_compute:
+                self.fast_compute(current_command)
+            else:
+                for i in range(current_command.src_chunk_num):
 
-                # 读取一次数据
-                chunk_packet = self.fetch_to_compute_fifo.read()
+                    # 读取一次数据
+                    chunk_packet = self.fetch_to_compute_fifo.read()
 
-                for j in range(current_command.dst_chunk_num):
-                    pass #  src_chunk_size * dst_chunk_size 的一个小块
+                    for j in range(current_command.dst_chunk_num):
+                        pass #  src_chunk_size * dst_chunk_size 的一个小块
 
-                    # 等待某一个延迟的时间
-                    assert current_command.batch_size <= self.atom_config.max_batch_size
+                        # 等待某一个延迟的时间
+                        assert current_command.batch_size <= self.atom_config.max_batch_size
 
-                    ops = current_command.src_chunk_size * current_command.dst_chunk_size
+                        ops = current_command.src_chunk_size * current_command.dst_chunk_size
 
-                    # TODO check here  感觉是有问题的
-                    latency = math.ceil(ops / self.atom_config.single_batch_OPS)
-                    SimModule.wait_time(SimTime(latency))
+                        # TODO check here  感觉是有问题的
+                        latency = math.ceil(ops / self.atom_config.single_batch_OPS)
+                        SimModule.wait_time(SimTime(latency))
+                        compute_counter.add_busy(latency)
 
 
             # 摆了, 就先这样吧
             # 所有计算都已经结束, 结果写入到了 acc buffer中, 等待讲acc buffer的结果写入到l2 中
             if current_command.last_acc:
                 # 要进行读出操作, 写入到 L2 中
-                for i in range(current_command.dst_chunk_num):
-                    chunk_packet = ChunkPacket(
-                        payload = None,
-                        num_elements = current_command.dst_chunk_size,
-                        batch_size = current_command.batch_size,
-                        element_bytes = 4
-                    )
+                chunk_packet = make_chunk_packet(
+                    payload = None,
+                    num_elements = current_command.dst_chunk_size,
+                    batch_size = current_command.batch_size,
+                    element_bytes = 4
+                )
+
+                burst_write(l2_memory_write_port,current_command.dst,[chunk_packet]*current_command.dst_chunk_num,True,
+                            current_command.dst_chunk_size,current_command.batch_size,4)
+
+            compute_counter.end()
 
-                    l2_memory_write_port.write(current_command.dst+i,chunk_packet,True,
-                                               current_command.dst_chunk_size,current_command.batch_size,4)
 
+    def fast_compute(self,current_command:ComputeCommand):
+        """
+        每个小块的延迟都是一样的, 每个 chunk 的 dst_chunk_num 个小块合并为一次等待
+        chunk 仍然按照逐块模型的时刻从 fifo 中读取, fetch 看到的反压不变, 完成时间与逐块等待一致
+        """
+        assert current_command.batch_size <= self.atom_config.max_batch_size
+
+        ops = current_command.src_chunk_size * current_command.dst_chunk_size
+        latency = math.ceil(ops / self.atom_config.single_batch_OPS) * current_command.dst_chunk_num
+
+        compute_counter = self.perf_monitor.get_stage_counter(f'{self.perf_name}.compute')
+        for i in range(current_command.src_chunk_num):
+            self.fetch_to_compute_fifo.read()
+
+            SimModule.wait_time(SimTime(latency))
+            compute_counter.add_busy(latency)
+            self.saved_wait_event_num += current_command.dst_chunk_num - 1
 
     def store_engine_read_handler(self):
         """
         从l2中读出,写入到 l3中,  需要走 uci-e link
         """
-        l2_memory_read_port = ChunkMemoryPort()
-        l2_memory_read_port.config_chunk_memory(self.l2_memory)
+        l2_memory_read_port = self.perf_monitor.make_memory_port(self.l2_memory,f'{self.perf_name}.store_read')
+        store_read_counter = self.perf_monitor.get_stage_counter(f'{self.perf_name}.store_read')
+        store_link = self.store_link
+        link_counter = self.perf_monitor.get_stage_counter(f'{store_link.perf_name}.link')
 
         while True:
             if self.store_engine_read_command_queue.is_empty():
@@ -325,64 +511,75 @@ class AtomDie(SimModule):
             if not current_command.last_acc:
                 continue
 
-            for i in range(current_command.dst_chunk_num):
-                data = l2_memory_read_port.read(current_command.dst + i, 1, current_command.dst_free,
-                                                current_command.dst_chunk_size, current_command.batch_size,
-                                                4)
-                
-                chunk_packet = ChunkPacket(
+            store_read_counter.begin(current_command.opcode)
+
+            link_transfer:Optional[LinkTransfer] = None
+            if self.d2d_link_config.coalesce:
+                link_transfer = LinkTransfer(store_link_transfer_capacity)
+                self.store_link_to_write_fifo.write(link_transfer)
+
+            def store_chunk(i:int,data,read_finish_time:int):
+                chunk_packet = make_chunk_packet(
                     payload=data,
                     num_elements=current_command.dst_chunk_size,
                     batch_size=current_command.batch_size,
                     element_bytes=4
                 )
-                self.store_read_to_link_fifo.delay_write(chunk_packet, SimTime(self.d2d_link_config.link_latency))
+                if self.d2d_link_config.coalesce:
+                    # 共用 link 的 atom 共用一个 link 模型, 依次占用这条 link
+                    finish_time = store_link.link_model.transfer(read_finish_time, chunk_packet.chunk_bytes)
+                    link_transfer.push(chunk_packet, finish_time)
+                    link_counter.add_busy(math.ceil(chunk_packet.chunk_bytes/self.d2d_link_config.bandwidth))
+                    link_counter.add_bytes(chunk_packet.chunk_bytes)
+                else:
+                    current_time = get_sim_cycle()
+                    store_link.input_fifo.delay_write(
+                        (self, chunk_packet), SimTime(read_finish_time - current_time + self.d2d_link_config.link_latency))
+
+            burst_read(l2_memory_read_port,current_command.dst,current_command.dst_chunk_num,1,current_command.dst_free,
+                       current_command.dst_chunk_size,current_command.batch_size,4,store_chunk)
+
+            store_read_counter.end()
 
             
-    def link_handler(self):
-        while True:
-            chunk_packet:ChunkPacket = self.store_read_to_link_fifo.read()
-
-            chunk_bytes = chunk_packet.chunk_bytes
-
-            transfer_latency = math.ceil(chunk_bytes/self.d2d_link_config.bandwidth)
-
-            SimModule.wait_time(SimTime(transfer_latency))
-
-            self.store_link_to_write_fifo.write(chunk_packet)
-
-
-
-
     def store_engine_write_handler(self):
         """
         接收 uci-e link 传来的数据, 然后写入到 l3 中
         """
         
-        reduce_memory_write_port = ChunkMemoryPort()
-        reduce_memory_write_port.config_chunk_memory(self.external_reduce_memory)
+        reduce_memory_write_port = self.perf_monitor.make_memory_port(self.external_reduce_memory,
+                                                                      f'{self.perf_name}.store_write')
+        store_write_counter = self.perf_monitor.get_stage_counter(f'{self.perf_name}.store_write')
 
         while True:
             if self.store_engine_write_command_queue.is_empty():
                 return
             current_command:ComputeCommand = self.store_engine_write_command_queue.read()
+            store_write_counter.begin(current_command.opcode)
 
             # 写 reduce memory  
             # 需要计算复杂的地址
             reduce_addr = current_command.reddst + current_command.redid[self.atom_id]*current_command.dst_chunk_num
-            for i in range(current_command.dst_chunk_num):
-                chunk_packet = self.store_link_to_write_fifo.read()
+            input_fifo = self.store_link_to_write_fifo
+            if self.d2d_link_config.coalesce:
+                input_fifo = input_fifo.read()
+
+            # reduce buffer 中保存的是整个 packet
+            burst_write_from_fifo(reduce_memory_write_port,input_fifo,
+                                  reduce_addr,current_command.dst_chunk_num,False,lambda chunk_packet:chunk_packet)
 
-                reduce_memory_write_port.write(reduce_addr+i,chunk_packet,False,
-                                               current_command.dst_chunk_size,current_command.batch_size,4)
+            store_write_counter.end()
 
 
     def load_command(self,command_list:list[ComputeCommand]):
-        command_size = len(command_list)
-        self.fetch_engine_command_queue = FIFO(command_size,command_size,command_list)
-        self.compute_engine_command_queue = FIFO(command_size,command_size,command_list)
-        self.store_engine_read_command_queue = FIFO(command_size,command_size,command_list)
-        self.store_engine_write_command_queue = FIFO(command_size,command_size,command_list)
+        # 四个 engine 通过各自的游标读取同一份指令, 不会复制
+        command_list = share_command_source(command_list)
+        if isinstance(command_list,(list,tuple)):
+            command_list = ListCommandSequence(list(command_list))
+        self.fetch_engine_command_queue = make_command_queue(command_list)
+        self.compute_engine_command_queue = make_command_queue(command_list)
+        self.store_engine_read_command_queue = make_command_queue(command_list)
+        self.store_engine_write_command_queue = make_command_queue(command_list)
 
 
     def config_connection(self,reduce_memory:ChunkMemory):
@@ -0,0 +1,207 @@
+from __future__ import annotations
+
+import pickle
+from dataclasses import dataclass, field
+from typing import Any
+
+from Desim.Core import SimSession
+
+from NeutronSim.ArrayMemory import get_memory_state, set_memory_state
+from NeutronSim.Chip import Chip
+from NeutronSim.CommandQueue import CommandSequence
+from NeutronSim.Commands import SendCommand, ReceiveBaseCommand, ComputeCommand
+from NeutronSim.Config import LinkConfig, MemoryConfig, AtomConfig, TopologyConfig
+from NeutronSim.ReceiveEngine import ReceiveEngineConfig
+from NeutronSim.Utils import get_sim_cycle
+
+"""
+单个 chip 的 checkpoint, 用于跳过已经仿真过的前几层
+协程的栈不能保存, 所以只在静止的时刻保存状态:
+CheckpointCut 给出 send / receive / compute 三个队列的切分位置 (例如某一层的结束), 每个 engine 读到切分位置之后
+不再读取新的指令, 已经读取的指令继续执行到结束. compute 指令按照 group_id 分到各个 atom, 每个 atom 的四个 engine
+都停在这个 atom 在切分位置之前的最后一条指令之后, 所以所有队列停在同一个指令边界上
+此时 FIFO / link 的申请队列 / 流水线中都没有数据, 只需要保存 memory 的完整状态, 剩下的指令以及当前的时间
+切分位置之前的指令全部结束之后才会开始之后的指令, 所以恢复之后的完成时间会略晚于不中断的仿真
+"""
+
+
+class CheckpointError(Exception):
+    pass
+
+
+@dataclass
+class CheckpointCut:
+    # 三个队列中切分位置之前的指令数量
+    send_command_num:int = 0
+    receive_command_num:int = 0
+    compute_command_num:int = 0
+
+
+class GatedCommandQueue:
+    """
+    包装 engine 的指令队列, 读取 limit 条指令之后 engine 会认为指令已经读完
+    stopped 表示 engine 已经结束了上一条指令, 并且不会再读取新的指令
+    """
+
+    def __init__(self,command_queue,limit:int):
+        self.command_queue = command_queue
+        self.limit = limit
+
+        self.read_num:int = 0
+        self.stopped:bool = False
+
+    def is_empty(self)->bool:
+        if self.read_num >= self.limit or self.command_queue.is_empty():
+            self.stopped = True
+            return True
+        self.stopped = False
+        return False
+
+    def read(self)->Any:
+        self.read_num += 1
+        self.stopped = False
+        return self.command_queue.read()
+
+    def reached(self)->bool:
+        return self.stopped and self.read_num == self.limit
+
+    def drain(self)->list:
+        # 取出剩下的所有指令, 只在仿真结束之后调用
+        command_list = []
+        while not self.command_queue.is_empty():
+            command_list.append(self.command_queue.read())
+        return command_list
+
+
+@dataclass
+class ChipCheckpoint:
+    time_offset:int
+
+    d2d_link_config:LinkConfig
+    l2_memory_config:MemoryConfig
+    l3_memory_config:MemoryConfig
+    reduce_memory_config:MemoryConfig
+    atom_config:AtomConfig
+    topology_config:TopologyConfig
+    receive_engine_config:ReceiveEngineConfig
+
+    # get_memory_state 的结果, ArrayChunkMemory 的 chunk 形状以及 payload 也一起保存
+    l3_memory_state:dict = field(default_factory=dict)
+    reduce_memory_state:dict = field(default_factory=dict)
+    l2_memory_state_dict:dict[int,dict] = field(default_factory=dict)
+
+    send_command_list:list[SendCommand] = field(default_factory=list)
+    receive_command_list:list[ReceiveBaseCommand] = field(default_factory=list)
+    compute_command_list:list[ComputeCommand] = field(default_factory=list)
+
+    def save(self,path:str):
+        """
+        保存的只是切分位置上静止的状态, 有以下限制:
+        - 不保存 FIFO 中的数据以及还没有发生的事件, 所以只能在所有 engine 都停在指令之间的时候保存
+        - 切分位置是三个队列中的指令数, 而不是某个仿真时间, 切分位置之前的指令全部结束之后才开始之后的指令
+        - Desim 的 ChunkMemory 只保存 memory_tag, ArrayChunkMemory 才会保存 chunk 的形状以及 payload
+        """
+        with open(path,'wb') as f:
+            pickle.dump(self,f,protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path:str)->ChipCheckpoint:
+        with open(path,'rb') as f:
+            return pickle.load(f)
+
+    def restore(self)->Chip:
+        """
+        需要先 SimSession.reset() / SimSession.init(), 恢复之后的仿真时间从 0 开始, 加上 time_offset 才是实际的时间
+        修改 config 之后再恢复 (dataclasses.replace) 可以从同一个 checkpoint 分出多个不同的后续仿真,
+        memory_model 需要与保存的时候相同
+        """
+        chip = Chip(self.d2d_link_config,self.l2_memory_config,self.l3_memory_config,self.reduce_memory_config,
+                    self.atom_config,self.topology_config,self.receive_engine_config)
+
+        set_memory_state(chip.l3_memory,self.l3_memory_state)
+        set_memory_state(chip.reduce_memory,self.reduce_memory_state)
+        for atom_id,memory_state in self.l2_memory_state_dict.items():
+            atom_die = chip.atom_manager.get_atom_instance(atom_id).atom_die
+            set_memory_state(atom_die.l2_memory,memory_state)
+
+        chip.load_command(list(self.send_command_list),list(self.receive_command_list),
+                          list(self.compute_command_list))
+
+        return chip
+
+
+def make_atom_die_gates(atom_die,limit:int)->list[GatedCommandQueue]:
+    # 四个 engine 读取同一份指令, 都在 limit 条之后停止
+    gate_list = [GatedCommandQueue(atom_die.fetch_engine_command_queue,limit),
+                 GatedCommandQueue(atom_die.compute_engine_command_queue,limit),
+                 GatedCommandQueue(atom_die.store_engine_read_command_queue,limit),
+                 GatedCommandQueue(atom_die.store_engine_write_command_queue,limit)]
+
+    (atom_die.fetch_engine_command_queue,atom_die.compute_engine_command_queue,
+     atom_die.store_engine_read_command_queue,atom_die.store_engine_write_command_queue) = gate_list
+
+    return gate_list
+
+
+def run_to_checkpoint(chip:Chip,cut:CheckpointCut)->ChipCheckpoint:
+    """
+    在 load_command 和预先写入数据之后调用, 代替 SimSession.scheduler.run()
+    compute 指令需要以 list 或者 CommandSequence 传入, 用于计算每个 atom 的切分位置
+    切分位置之前的指令依赖之后的指令的时候 (例如等待之后的 SEND 写入的数据), engine 停在指令中间, 抛出 CheckpointError
+    保存的状态的限制见 ChipCheckpoint.save: 不保存 FIFO 以及事件, 按照指令数切分, ChunkMemory 只保存 memory_tag
+    """
+    command_source = chip.atom_manager.command_source
+    if not isinstance(command_source,CommandSequence):
+        raise CheckpointError('checkpoint needs the compute commands as a list or CommandSequence')
+    send_engine = chip.send_engine
+    send_gate = GatedCommandQueue(send_engine.send_command_queue,cut.send_command_num)
+    send_engine.send_command_queue = send_gate
+    for sub_send_engine in send_engine.sub_send_engine_list:
+        sub_send_engine.external_send_command_queue = send_gate
+
+    receive_engine = chip.receive_engine
+    receive_gate = GatedCommandQueue(receive_engine.recv_command_queue,cut.receive_command_num)
+    receive_engine.recv_command_queue = receive_gate
+
+    atom_gate_dict:dict[int,list[GatedCommandQueue]] = {}
+    for atom_id,atom_instance in chip.atom_manager.atom_instance_dict.items():
+        limit = sum(1 for index in command_source.get_group_index_list(atom_id) if index < cut.compute_command_num)
+        atom_gate_dict[atom_id] = make_atom_die_gates(atom_instance.atom_die,limit)
+
+    SimSession.scheduler.run()
+
+    # 检查是否所有的 engine 都读到了切分位置, 并且停在指令之间
+    blocked_list:list[str] = []
+    for sub_send_engine in send_engine.sub_send_engine_list:
+        if sub_send_engine.current_command is not None:
+            blocked_list.append(sub_send_engine.perf_name)
+    if send_engine.pending_send_list or send_gate.read_num < send_gate.limit:
+        blocked_list.append('send_engine')
+    if receive_engine.inflight_command_list or receive_engine.pending_command is not None \
+            or not receive_gate.reached():
+        blocked_list.append(receive_engine.perf_name)
+    for atom_id,gate_list in atom_gate_dict.items():
+        if not all(gate.reached() for gate in gate_list):
+            blocked_list.append(f'atom.{atom_id}')
+    if blocked_list:
+        raise CheckpointError(f'commands before the cut wait for commands after it, blocked at {get_sim_cycle()}: '
+                              f'{", ".join(blocked_list)}')
+
+    return ChipCheckpoint(
+        time_offset=get_sim_cycle(),
+        d2d_link_config=chip.d2d_link_config,
+        l2_memory_config=chip.l2_memory_config,
+        l3_memory_config=chip.l3_memory_config,
+        reduce_memory_config=chip.reduce_memory_config,
+        atom_config=chip.atom_config,
+        topology_config=chip.topology_config,
+        receive_engine_config=chip.receive_engine_config,
+        l3_memory_state=get_memory_state(chip.l3_memory),
+        reduce_memory_state=get_memory_state(chip.reduce_memory),
+        l2_memory_state_dict={atom_id:get_memory_state(atom_instance.atom_die.l2_memory)
+                              for atom_id,atom_instance in chip.atom_manager.atom_instance_dict.items()},
+        send_command_list=send_gate.drain(),
+        receive_command_list=receive_gate.drain(),
+        compute_command_list=[command_source.decode(index)
+                              for index in range(cut.compute_command_num,len(command_source))],
+    )
@@ -1,17 +1,28 @@
+from __future__ import annotations
+from typing import Optional, TYPE_CHECKING
+
 from Desim.Core import SimModule
-from Desim.memory.Memory import ChunkMemory
 
+from NeutronSim.ArrayMemory import make_chunk_memory
 from NeutronSim.Atom import AtomManager
 from NeutronSim.Commands import ReceiveBaseCommand, SendCommand, ComputeCommand
-from NeutronSim.Config import LinkConfig, MemoryConfig, AtomConfig
-from NeutronSim.ReceiveEngine import ReceiveEngine
-from NeutronSim.SendEngine import SendEngine
+from NeutronSim.Config import LinkConfig, MemoryConfig, AtomConfig, TopologyConfig
+from NeutronSim.PerfCounter import PerfMonitor
+from NeutronSim.ReceiveEngine import ReceiveEngine, ReceiveEngineConfig
+from NeutronSim.SendEngine import SendEngine, SendEngineConfig
+
+if TYPE_CHECKING:
+    from NeutronSim.System import System
+    from NeutronSim.Trace import CommandTrace
+    from NeutronSim.Tracer import ChromeTracer
 
 
 class Chip(SimModule):
     def __init__(self,d2d_link_config:LinkConfig,
                     l2_memory_config:MemoryConfig,l3_memory_config:MemoryConfig,reduce_memory_config:MemoryConfig,
-                    atom_config:AtomConfig):
+                    atom_config:AtomConfig,
+                    topology_config:TopologyConfig=TopologyConfig(),
+                    receive_engine_config:ReceiveEngineConfig=ReceiveEngineConfig()):
         super().__init__()
 
         self.d2d_link_config = d2d_link_config
@@ -19,15 +30,24 @@ class Chip(SimModule):
         self.l3_memory_config = l3_memory_config
         self.reduce_memory_config = reduce_memory_config
         self.atom_config = atom_config
+        self.topology_config = topology_config
+        self.receive_engine_config = receive_engine_config
 
+        # 多 chip 系统中的编号, 单独使用的时候为 -1
+        self.chip_id:int = -1
+        self.external_system:Optional[System] = None
 
 
-        self.l3_memory = ChunkMemory(self.l3_memory_config.bandwidth)
-        self.reduce_memory = ChunkMemory(self.reduce_memory_config.bandwidth)
+        # memory_config.memory_model 决定使用 Desim 的 ChunkMemory 还是 ArrayChunkMemory
+        self.l3_memory = make_chunk_memory(self.l3_memory_config)
+        self.reduce_memory = make_chunk_memory(self.reduce_memory_config)
 
-        self.atom_manager:AtomManager = AtomManager(self,self.d2d_link_config,self.l2_memory_config,atom_config)
-        self.send_engine = SendEngine(self,self.d2d_link_config)
-        self.receive_engine = ReceiveEngine(self)
+        self.atom_manager:AtomManager = AtomManager(self,self.d2d_link_config,self.l2_memory_config,atom_config,
+                                                    self.topology_config)
+        self.send_engine = SendEngine(self,self.d2d_link_config,
+                                      SendEngineConfig(num_sub_engine=self.topology_config.num_sub_send_engine,
+                                                       batch_chunk_num=self.topology_config.send_batch_chunk_num))
+        self.receive_engine = ReceiveEngine(self,self.receive_engine_config)
 
 
         self.atom_manager.config_connection(self.reduce_memory)
@@ -36,9 +56,46 @@ class Chip(SimModule):
 
         self.receive_engine.config_connection(self.l3_memory,self.reduce_memory)
 
+        # 性能计数器默认关闭, 需要在仿真开始之前调用 perf_monitor.enable()
+        self.perf_monitor = PerfMonitor()
+        self.perf_monitor.register_memory(self.l3_memory,'l3',self.l3_memory_config.bandwidth)
+        self.perf_monitor.register_memory(self.reduce_memory,'reduce',self.reduce_memory_config.bandwidth)
+
+        self.atom_manager.config_perf_monitor(self.perf_monitor)
+        self.send_engine.config_perf_monitor(self.perf_monitor)
+        self.receive_engine.config_perf_monitor(self.perf_monitor)
+
 
     def load_command(self,send_command_list:list[SendCommand],receive_command_list:list[ReceiveBaseCommand],compute_command_list:list[ComputeCommand]):
+        # 也可以直接传入 trace 中的 CommandSequence, 指令在读取的时候才会解码
+        # 或者传入生成器/迭代器 (可以包装为 CommandStream 指定预读窗口), engine 运行的时候按需读取
         self.send_engine.load_command(send_command_list)
         self.receive_engine.load_command(receive_command_list)
         self.atom_manager.load_command(compute_command_list)
 
+    def load_trace(self,trace:CommandTrace):
+        self.load_command(trace.send_commands,trace.receive_commands,trace.compute_commands)
+
+
+    def get_perf_report(self)->dict:
+        """
+        仿真结束之后各个部件的 busy/stall 时间, 搬运的字节数, memory 带宽利用率以及 link 的申请等待时间
+        """
+        report = self.perf_monitor.report()
+        report['receive_overlap'] = self.receive_engine.get_overlap_report()
+        return report
+
+
+    def config_tracer(self,tracer:Optional[ChromeTracer]):
+        """
+        记录各个流水级处理每条指令的时间线, 仿真结束之后需要调用 tracer.close()
+        """
+        self.perf_monitor.config_tracer(tracer)
+
+
+    def config_inter_chip(self,chip_id:int,system:System):
+        self.chip_id = chip_id
+        self.external_system = system
+        self.perf_monitor.name = f'chip{chip_id}'
+
+        self.receive_engine.config_inter_chip(chip_id,system)
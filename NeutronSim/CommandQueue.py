@@ -0,0 +1,269 @@
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Any, Callable, Iterable, Optional, Sequence
+
+from Desim.Core import Event, SimModule, SimTime
+from Desim.module.FIFO import FIFO
+
+
+class CommandSequence(ABC):
+    """
+    按下标解码指令的序列, 指令在被读取的时候才会构建出来
+    """
+
+    @abstractmethod
+    def __len__(self)->int:
+        pass
+
+    @abstractmethod
+    def decode(self,index:int)->Any:
+        pass
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.decode(index)
+
+    def get_group_index_list(self,atom_id:int)->Sequence[int]:
+        """
+        group_id 中包含 atom_id 的指令的下标, 子类可以给出更快的实现
+        """
+        return [index for index in range(len(self)) if atom_id in self.decode(index).group_id]
+
+
+class ListCommandSequence(CommandSequence):
+    def __init__(self,command_list:list):
+        self.command_list = command_list
+
+    def __len__(self)->int:
+        return len(self.command_list)
+
+    def decode(self,index:int)->Any:
+        return self.command_list[index]
+
+    def get_group_index_list(self,atom_id:int)->Sequence[int]:
+        return [index for index,command in enumerate(self.command_list) if atom_id in command.group_id]
+
+
+class IndexedCommandSequence(CommandSequence):
+    """
+    只包含另一个序列中的部分指令, 用于构建每个 atom 自己的指令索引
+    """
+    def __init__(self,command_sequence:CommandSequence,index_list:Sequence[int]):
+        self.command_sequence = command_sequence
+        self.index_list = index_list
+
+    def __len__(self)->int:
+        return len(self.index_list)
+
+    def decode(self,index:int)->Any:
+        return self.command_sequence.decode(int(self.index_list[index]))
+
+
+class SharedDecodeSequence(CommandSequence):
+    """
+    多个读者按下标读取同一个序列的时候, 每条指令只解码一次
+    reader_num_function 给出一条指令会被读取多少次, 全部读完之后从缓存中删除, 缓存中只有正在被读取的指令
+    """
+    def __init__(self,command_sequence:CommandSequence,reader_num_function:Callable[[Any],int]):
+        self.command_sequence = command_sequence
+        self.reader_num_function = reader_num_function
+
+        # 下标 -> [指令, 还没有读取的次数]
+        self.decode_cache:dict[int,list] = {}
+
+    def __len__(self)->int:
+        return len(self.command_sequence)
+
+    def decode(self,index:int)->Any:
+        cache_item = self.decode_cache.get(index)
+        if cache_item is None:
+            command = self.command_sequence.decode(index)
+            remain_num = self.reader_num_function(command) - 1
+            if remain_num > 0:
+                self.decode_cache[index] = [command,remain_num]
+            return command
+
+        cache_item[1] -= 1
+        if cache_item[1] == 0:
+            del self.decode_cache[index]
+        return cache_item[0]
+
+    def get_group_index_list(self,atom_id:int)->Sequence[int]:
+        return self.command_sequence.get_group_index_list(atom_id)
+
+
+class ArrayCommandQueue:
+    """
+    与 FIFO 接口一致的指令队列, 只保存一个游标
+    多个队列可以共享同一个 CommandSequence, 不需要复制指令
+    """
+
+    def __init__(self,command_sequence:CommandSequence):
+        self.command_sequence = command_sequence
+        self.cursor:int = 0
+
+    def __len__(self)->int:
+        return len(self.command_sequence)
+
+    def is_empty(self)->bool:
+        return self.cursor >= len(self)
+
+    def read(self)->Any:
+        command = self.command_sequence.decode(self.cursor)
+        self.cursor += 1
+        return command
+
+
+class CommandStream:
+    """
+    从迭代器中按需读取指令, buffer 最多保存 window 条
+    多个消费者 (例如 AtomDie 中的四个 engine) 通过各自的 StreamCommandQueue 读取同一个 stream
+    所有消费者都读过的指令会被丢弃, buffer 从最慢的消费者的游标开始, 最多预读到游标之后 window 条
+    超前的消费者 (包括过滤之后跳过大量指令的消费者) 走到窗口末尾的时候等待最慢的消费者, 不会继续预读
+    """
+
+    def __init__(self,command_iterable:Iterable,window:int = 64):
+        assert window > 0
+        self.command_iterator = iter(command_iterable)
+        self.window = window
+
+        self.buffer:deque = deque()
+        # buffer[0] 在整个 stream 中的下标, 也是最慢的消费者的游标
+        self.buffer_start:int = 0
+        self.exhausted:bool = False
+
+        self.queue_list:list[StreamCommandQueue] = []
+
+        # 等待窗口前移的消费者共用一个 event, 只在有人等待的时候创建
+        self.release_event:Optional[Event] = None
+
+    def make_queue(self,command_filter:Optional[Callable[[Any],bool]] = None)->'StreamCommandQueue':
+        assert self.buffer_start == 0, 'stream 已经开始读取, 不能再添加消费者'
+        queue = StreamCommandQueue(self,command_filter)
+        self.queue_list.append(queue)
+        return queue
+
+    def in_window(self,index:int)->bool:
+        return index < self.buffer_start + self.window
+
+    def has_command(self,index:int)->bool:
+        """
+        index 需要在窗口之内, 不在 buffer 中的时候把 buffer 预读满
+        """
+        assert self.in_window(index)
+        if index < self.buffer_start + len(self.buffer):
+            return True
+
+        while not self.exhausted and len(self.buffer) < self.window:
+            try:
+                self.buffer.append(next(self.command_iterator))
+            except StopIteration:
+                self.exhausted = True
+
+        return index < self.buffer_start + len(self.buffer)
+
+    def get_command(self,index:int)->Any:
+        assert self.has_command(index)
+        return self.buffer[index - self.buffer_start]
+
+    def wait_release(self):
+        if self.release_event is None:
+            self.release_event = Event()
+        SimModule.wait(self.release_event)
+
+    def release(self):
+        # 丢弃所有消费者都已经读过的指令, 窗口前移之后唤醒等待的消费者
+        min_cursor = min(queue.cursor for queue in self.queue_list)
+        if self.buffer_start >= min_cursor:
+            return
+
+        while self.buffer_start < min_cursor and self.buffer:
+            self.buffer.popleft()
+            self.buffer_start += 1
+        self.buffer_start = min_cursor
+
+        if self.release_event is not None:
+            release_event = self.release_event
+            self.release_event = None
+            release_event.notify(SimTime(0))
+
+
+class StreamCommandQueue:
+    """
+    与 FIFO 接口一致, 从 CommandStream 中读取指令的游标
+    可以指定 command_filter, 跳过不需要的指令
+    """
+
+    def __init__(self,command_stream:CommandStream,command_filter:Optional[Callable[[Any],bool]] = None):
+        self.command_stream = command_stream
+        self.command_filter = command_filter
+        self.cursor:int = 0
+
+    def advance(self):
+        self.cursor += 1
+        # 只有最慢的消费者前进的时候窗口才会前移
+        if self.cursor - 1 == self.command_stream.buffer_start:
+            self.command_stream.release()
+
+    def skip(self)->bool:
+        """
+        停在下一条需要读取的指令上, 返回 stream 中是否还有这样的指令
+        游标走到窗口末尾的时候等待其他消费者前进
+        """
+        while True:
+            while not self.command_stream.in_window(self.cursor):
+                self.command_stream.wait_release()
+
+            if not self.command_stream.has_command(self.cursor):
+                return False
+            if self.command_filter is None or self.command_filter(self.command_stream.get_command(self.cursor)):
+                return True
+            self.advance()
+
+    def is_empty(self)->bool:
+        return not self.skip()
+
+    def read(self)->Any:
+        has_command = self.skip()
+        assert has_command
+        command = self.command_stream.get_command(self.cursor)
+        self.advance()
+        return command
+
+
+class FilteredCommandStream:
+    """
+    CommandStream 的一个视图, 从这里构建的队列只会读到满足 command_filter 的指令
+    """
+
+    def __init__(self,command_stream:CommandStream,command_filter:Callable[[Any],bool]):
+        self.command_stream = command_stream
+        self.command_filter = command_filter
+
+    def make_queue(self)->StreamCommandQueue:
+        return self.command_stream.make_queue(self.command_filter)
+
+
+def share_command_source(command_list):
+    """
+    多个队列需要读取同一份指令的时候使用
+    迭代器只能被读取一次, 需要先包装成 CommandStream, 其他类型保持不变
+    """
+    if isinstance(command_list,(list,tuple,CommandSequence,CommandStream,FilteredCommandStream)):
+        return command_list
+    return CommandStream(command_list)
+
+
+def make_command_queue(command_list):
+    """
+    普通的 list 仍然使用 FIFO, trace 中的指令使用 ArrayCommandQueue
+    生成器等迭代器按需读取, 使用 StreamCommandQueue
+    """
+    if isinstance(command_list,CommandSequence):
+        return ArrayCommandQueue(command_list)
+
+    if isinstance(command_list,(list,tuple)):
+        command_size = len(command_list)
+        return FIFO(command_size,command_size,list(command_list))
+
+    return share_command_source(command_list).make_queue()
@@ -19,6 +19,27 @@ class SendCommand:
     free:bool = False
 
 
+@dataclass
+class ChipSendCommand:
+    """
+    从本 chip 的 l3 中读取数据, 通过片间 link 写入到另一个 chip 的 l3 或者 reduce buffer 中
+    """
+    opcode:str = 'CHIP_SEND'
+
+    dst_chip:int = -1
+
+    chunk_size:int = -1
+    batch_size:int = -1
+    chunk_num:int = -1
+
+    dtype:Literal['fp16','bf16','fp32'] = ''
+
+    dst:int = -1
+    dst_loc:Literal['l3','reduce'] = 'l3'
+    src:int = -1
+    free:bool = False
+
+
 @dataclass 
 class ComputeCommand:
     opcode:Literal['COMPUTE'] = ''
@@ -83,6 +104,9 @@ class ReceiveCommand(ReceiveBaseCommand):
 
     redcount:int = 0
 
+    # 结果写入到哪个 chip 的 l3 中, -1 表示本 chip
+    dst_chip:int = -1
+
     act:Literal[0,1,2,3,4,5,6] = 0
     mul:bool  = False
 
@@ -0,0 +1,381 @@
+from __future__ import annotations
+
+import dataclasses
+import math
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Optional
+
+from NeutronSim.ArrayMemory import preload_range
+from NeutronSim.Chip import Chip
+from NeutronSim.Commands import SendCommand, ComputeCommand, ReceiveCommand, QuantCommand, ReceiveBaseCommand
+from NeutronSim.Config import element_bytes_dict
+
+"""
+把 GEMM / GEMV 的形状编译为 SEND / COMPUTE / RECEIVE (/ QUANT) 指令
+
+数据排布:
+    l3 中的激活按照 batch tile 存放, 第 m 个 tile 的第 kc 个 chunk 在 addr + m*stride + kc
+    每个 chunk 包含 chunk_size 个元素, batch 维度是这个 tile 的大小 (不超过 max_batch_size)
+切分方式 (k_split, n_split):
+    atom = k * n_split + n, K 方向的第 k 份输入通过一条 SEND 发送给第 k 行的 atom
+    第 n 列的 atom 把部分和写入 reduce buffer 中同一段地址, RECEIVE 需要等待 redcount 次写入
+K / N 方向不能整除的时候, 前面的几份多一个 chunk, 大小相同的 atom 共用一条 COMPUTE 指令
+"""
+
+
+@dataclass(frozen=True)
+class TilingStrategy:
+    k_split:int = 4
+    n_split:int = 2
+    chunk_size:int = 128
+    max_batch_size:int = 16
+
+
+@dataclass
+class MatmulOutput:
+    addr:int
+    # 相邻两个 batch tile 之间的距离, 以 chunk 为单位
+    stride:int
+    chunk_num:int
+    # 打开 quant 的时候, int8 结果的位置
+    quant_addr:int = -1
+
+
+@dataclass
+class InputRegion:
+    addr:int
+    chunk_num:int
+    chunk_size:int
+    batch_size:int
+    dtype:str
+
+
+@dataclass
+class CommandProgram:
+    send_command_list:list[SendCommand] = field(default_factory=list)
+    compute_command_list:list[ComputeCommand] = field(default_factory=list)
+    receive_command_list:list[ReceiveBaseCommand] = field(default_factory=list)
+
+    # 仿真之前需要预先写入 l3 的数据
+    input_region_list:list[InputRegion] = field(default_factory=list)
+
+    @property
+    def command_num(self)->int:
+        return len(self.send_command_list) + len(self.compute_command_list) + len(self.receive_command_list)
+
+    def load(self,chip:Chip):
+        chip.load_command(self.send_command_list,self.receive_command_list,self.compute_command_list)
+        self.preload(chip)
+
+    def preload(self,chip:Chip):
+        for region in self.input_region_list:
+            preload_range(chip.l3_memory,region.addr,region.chunk_num,
+                          region.chunk_size,region.batch_size,element_bytes_dict[region.dtype])
+
+
+def split_range(total:int,num_part:int)->list[tuple[int,int]]:
+    """
+    把 total 分成 num_part 份, 返回每一份的 (offset, size), 前面的几份多一个
+    """
+    base,remain = divmod(total,num_part)
+    part_list = []
+    offset = 0
+    for i in range(num_part):
+        size = base + (1 if i < remain else 0)
+        part_list.append((offset,size))
+        offset += size
+    return part_list
+
+
+@dataclass(frozen=True)
+class TileProgram:
+    """
+    一个 batch tile 的指令, 地址都是相对的, 使用的时候再加上各自的基地址
+    send.src: 输入 (相对于这个 tile 的输入起点)   send.dst / compute.src / compute.dst: l2
+    compute.reddst / receive.src0: reduce                        receive.dst0: 输出
+    """
+    send_command_list:tuple[SendCommand,...]
+    compute_command_list:tuple[ComputeCommand,...]
+    receive_command:ReceiveCommand
+    l2_size:int
+    reduce_size:int
+
+
+@lru_cache(maxsize=None)
+def tile_matmul(k_chunk_num:int,n_chunk_num:int,batch_size:int,dtype:str,act:int,
+                strategy:TilingStrategy,num_atoms:int)->TileProgram:
+    n_split = strategy.n_split
+
+    k_part_list = split_range(k_chunk_num,strategy.k_split)
+    n_part_list = split_range(n_chunk_num,n_split)
+
+    # 没有分到数据的 atom 不参与计算
+    active_k_list = [k for k,(_,size) in enumerate(k_part_list) if size > 0]
+    active_n_list = [n for n,(_,size) in enumerate(n_part_list) if size > 0]
+
+    max_k_size = k_part_list[0][1]
+    max_n_size = n_part_list[0][1]
+    l2_src_addr = 0
+    l2_dst_addr = max_k_size
+
+    send_command_list = []
+    for k in active_k_list:
+        k_offset,k_size = k_part_list[k]
+        send_command_list.append(SendCommand(
+            opcode='SEND',
+            group_id=[k*n_split + n for n in active_n_list],
+            chunk_size=strategy.chunk_size,
+            batch_size=batch_size,
+            chunk_num=k_size,
+            dtype=dtype,
+            dst=l2_src_addr,
+            src=k_offset,
+            free=False,
+        ))
+
+    # 每个 atom 在 reduce 中的位置是 reddst + redid[atom] * dst_chunk_num
+    redid = [0]*num_atoms
+    for k in active_k_list:
+        for n in active_n_list:
+            redid[k*n_split + n] = n
+
+    # 按照 (k_size, n_size) 给 atom 分组
+    group_dict:dict[tuple[int,int],list[int]] = {}
+    for k in active_k_list:
+        for n in active_n_list:
+            group_dict.setdefault((k_part_list[k][1],n_part_list[n][1]),[]).append(k*n_split + n)
+
+    compute_command_list = []
+    for (k_size,n_size),group_id in group_dict.items():
+        # 同样大小的列是连续的, 第一列的 offset 减去 n * n_size 就是 reddst
+        first_n = group_id[0] % n_split
+        reddst = n_part_list[first_n][0] - first_n*n_size
+
+        compute_command_list.append(ComputeCommand(
+            opcode='COMPUTE',
+            group_id=group_id,
+            batch_size=batch_size,
+            dst=l2_dst_addr,
+            dst_chunk_size=strategy.chunk_size,
+            dst_chunk_num=n_size,
+            dst_free=True,
+            reddst=reddst,
+            redid=redid,
+            src=l2_src_addr,
+            src_chunk_size=strategy.chunk_size,
+            src_chunk_num=k_size,
+            src_dtype=dtype,
+            src_free=True,
+            first_acc=True,
+            last_acc=True,
+        ))
+
+    receive_command = ReceiveCommand(
+        opcode='RECEIVE_MONO',
+        chunk_size=strategy.chunk_size,
+        batch_size=batch_size,
+        chunk_num=n_chunk_num,
+        dst0=0,
+        dst0_type=dtype,
+        dst1_flag=False,
+        src0=0,
+        src0_dtype='fp32',
+        src0_loc='reduce',
+        free0=True,
+        redcount=len(active_k_list),
+        act=act,
+        mul=False,
+        add=False,
+    )
+
+    return TileProgram(tuple(send_command_list),tuple(compute_command_list),receive_command,
+                       l2_size=max_k_size + max_n_size,reduce_size=n_chunk_num)
+
+
+class RegionAllocator:
+    """
+    按顺序分配的地址空间, 释放的区域之后按 first fit 复用
+    """
+
+    def __init__(self):
+        self.top:int = 0
+        # (起始地址, 大小), 按地址排序, 相邻的区域会合并
+        self.free_list:list[tuple[int,int]] = []
+
+    def alloc(self,size:int)->int:
+        for i,(addr,free_size) in enumerate(self.free_list):
+            if free_size >= size:
+                if free_size == size:
+                    del self.free_list[i]
+                else:
+                    self.free_list[i] = (addr+size,free_size-size)
+                return addr
+        addr = self.top
+        self.top += size
+        return addr
+
+    def free(self,addr:int,size:int):
+        merge_list:list[tuple[int,int]] = []
+        for region in sorted(self.free_list + [(addr,size)]):
+            if merge_list and merge_list[-1][0] + merge_list[-1][1] == region[0]:
+                merge_list[-1] = (merge_list[-1][0],merge_list[-1][1] + region[1])
+            else:
+                merge_list.append(region)
+        self.free_list = merge_list
+
+
+class MatmulCompiler:
+    """
+    l3 按顺序分配, 不复用, 指令之间只有真实的数据依赖
+    l2 / reduce 在两层之后复用: 第 L+2 层的 COMPUTE 需要第 L+1 层的输出, 而第 L+1 层的 RECEIVE 开始读取的时候,
+    RECEIVE 流水线已经按顺序读完 (并 free) 了第 L 层所有的 reduce, 累加写入的 reduce 不会与上一次的数据混在一起
+    l2 的写入本身会等待之前的数据被 free
+    所有 atom 的 l2 使用相同的地址
+    """
+
+    # 一层使用的 l2 / reduce 在之后的第几层释放
+    reuse_layer_lag:int = 2
+
+    def __init__(self,strategy:TilingStrategy=TilingStrategy(),num_atoms:int=8,dtype:str='fp16'):
+        assert strategy.k_split * strategy.n_split <= num_atoms
+
+        self.strategy = strategy
+        self.num_atoms = num_atoms
+        self.dtype = dtype
+
+        self.l3_addr:int = 0
+        self.l2_allocator = RegionAllocator()
+        self.reduce_allocator = RegionAllocator()
+
+        # 每一层分配的 (allocator, 起始地址, 大小), 最后一个是当前层
+        self.layer_region_list:list[list[tuple[RegionAllocator,int,int]]] = [[]]
+
+        self.program = CommandProgram()
+
+    def get_chunk_num(self,num_elements:int)->int:
+        return math.ceil(num_elements / self.strategy.chunk_size)
+
+    def get_batch_tile_list(self,M:int)->list[int]:
+        max_batch_size = self.strategy.max_batch_size
+        return [min(max_batch_size,M - m) for m in range(0,M,max_batch_size)]
+
+    def alloc_l3(self,chunk_num:int)->int:
+        addr = self.l3_addr
+        self.l3_addr += chunk_num
+        return addr
+
+    def alloc_region(self,allocator:RegionAllocator,size:int)->int:
+        addr = allocator.alloc(size)
+        self.layer_region_list[-1].append((allocator,addr,size))
+        return addr
+
+    def end_layer(self):
+        """
+        当前层结束, reuse_layer_lag 层之前分配的 l2 / reduce 可以被之后的指令复用
+        """
+        self.layer_region_list.append([])
+        if len(self.layer_region_list) > self.reuse_layer_lag:
+            for allocator,addr,size in self.layer_region_list.pop(0):
+                allocator.free(addr,size)
+
+    def alloc_input(self,M:int,K:int)->MatmulOutput:
+        """
+        分配一段由外部写入的输入激活, 仿真之前通过 CommandProgram.preload 写入
+        """
+        k_chunk_num = self.get_chunk_num(K)
+        batch_tile_list = self.get_batch_tile_list(M)
+        addr = self.alloc_l3(k_chunk_num*len(batch_tile_list))
+        for m,batch_size in enumerate(batch_tile_list):
+            self.program.input_region_list.append(InputRegion(addr + m*k_chunk_num,k_chunk_num,
+                                                              self.strategy.chunk_size,batch_size,self.dtype))
+        return MatmulOutput(addr,k_chunk_num,k_chunk_num)
+
+    def lower_matmul(self,M:int,K:int,N:int,input_activation:Optional[MatmulOutput]=None,
+                     act:int=0,quant:bool=False)->MatmulOutput:
+        """
+        [M,K] x [K,N], 权重已经在 atom 中, 只需要搬运激活
+        input_activation 为空的时候新分配一段输入
+        """
+        if input_activation is None:
+            input_activation = self.alloc_input(M,K)
+
+        k_chunk_num = self.get_chunk_num(K)
+        n_chunk_num = self.get_chunk_num(N)
+        assert k_chunk_num <= input_activation.chunk_num
+
+        batch_tile_list = self.get_batch_tile_list(M)
+        output_addr = self.alloc_l3(n_chunk_num*len(batch_tile_list))
+        output = MatmulOutput(output_addr,n_chunk_num,n_chunk_num)
+
+        if quant:
+            output.quant_addr = self.alloc_l3(n_chunk_num*len(batch_tile_list))
+
+        for m,batch_size in enumerate(batch_tile_list):
+            tile = tile_matmul(k_chunk_num,n_chunk_num,batch_size,self.dtype,act,self.strategy,self.num_atoms)
+
+            input_addr = input_activation.addr + m*input_activation.stride
+            tile_output_addr = output_addr + m*n_chunk_num
+            l2_addr = self.alloc_region(self.l2_allocator,tile.l2_size)
+            reduce_addr = self.alloc_region(self.reduce_allocator,tile.reduce_size)
+
+            # 缓存的指令只需要加上基地址, replace 是浅拷贝, 其中的 list 需要复制, 不能和缓存共用
+            for command in tile.send_command_list:
+                self.program.send_command_list.append(dataclasses.replace(
+                    command,src=command.src + input_addr,dst=command.dst + l2_addr,
+                    group_id=list(command.group_id)))
+            for command in tile.compute_command_list:
+                self.program.compute_command_list.append(dataclasses.replace(
+                    command,src=command.src + l2_addr,dst=command.dst + l2_addr,
+                    reddst=command.reddst + reduce_addr,
+                    group_id=list(command.group_id),redid=list(command.redid)))
+            self.program.receive_command_list.append(dataclasses.replace(
+                tile.receive_command,src0=reduce_addr,dst0=tile_output_addr,
+                bdcst=list(tile.receive_command.bdcst)))
+
+            if quant:
+                self.program.receive_command_list.append(QuantCommand(
+                    opcode='QUANT',
+                    chunk_size=self.strategy.chunk_size,
+                    batch_size=batch_size,
+                    chunk_num=n_chunk_num,
+                    dstq=output.quant_addr + m*n_chunk_num,
+                    src=tile_output_addr,
+                    src_dtype=self.dtype,
+                    free=False,
+                    ngroup=0,
+                ))
+
+        return output
+
+    def lower_transformer_layer(self,M:int,hidden_size:int,ffn_size:int,
+                                input_activation:Optional[MatmulOutput]=None)->MatmulOutput:
+        """
+        只包含 layer 中的矩阵乘: QKV, O, FFN up, FFN down
+        attention 本身不在 atom 上计算, O 的输入直接使用 QKV 输出中 Q 的部分代替
+        """
+        qkv_output = self.lower_matmul(M,hidden_size,3*hidden_size,input_activation)
+        attention_output = MatmulOutput(qkv_output.addr,qkv_output.stride,self.get_chunk_num(hidden_size))
+        o_output = self.lower_matmul(M,hidden_size,hidden_size,attention_output)
+        up_output = self.lower_matmul(M,hidden_size,ffn_size,o_output,act=1)
+        down_output = self.lower_matmul(M,ffn_size,hidden_size,up_output)
+        self.end_layer()
+        return down_output
+
+    def lower_layer_stack(self,num_layers:int,M:int,hidden_size:int,ffn_size:int)->CommandProgram:
+        activation = None
+        for _ in range(num_layers):
+            activation = self.lower_transformer_layer(M,hidden_size,ffn_size,activation)
+        return self.program
+
+
+def compile_gemm(M:int,K:int,N:int,dtype:str='fp16',strategy:TilingStrategy=TilingStrategy(),
+                 num_atoms:int=8,act:int=0,quant:bool=False)->CommandProgram:
+    compiler = MatmulCompiler(strategy,num_atoms,dtype)
+    compiler.lower_matmul(M,K,N,act=act,quant=quant)
+    return compiler.program
+
+
+def compile_gemv(K:int,N:int,dtype:str='fp16',strategy:TilingStrategy=TilingStrategy(),
+                 num_atoms:int=8,act:int=0,quant:bool=False)->CommandProgram:
+    return compile_gemm(1,K,N,dtype,strategy,num_atoms,act,quant)
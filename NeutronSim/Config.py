@@ -1,16 +1,22 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import Literal
 
 
 @dataclass
 class LinkConfig:
     bandwidth: int = 16 # Byte/ns
     link_latency:int = 100 # ns
+    coalesce:bool = False # 事务级模型, 连续的 chunk 直接算出完成时间, 不再逐 chunk 仿真 link
 
 
 @dataclass
 class MemoryConfig:
     block_size:int = 128 # byte
     bandwidth:int = 16 # Byte/ns
+    # 'chunk' 使用 Desim 的 ChunkMemory, 'array' 使用 ArrayChunkMemory, 状态保存在 numpy 数组中
+    memory_model:Literal['chunk','array'] = 'chunk'
+    array_size:int = 1<<16 # array 模型初始的地址数量, 访问更大的地址时自动扩展
+    max_burst_chunk:int = 8 # array 模型一次 burst 最多传输的 chunk 数, 不超过下游 FIFO 的容量
 
 
 @dataclass
@@ -18,6 +24,20 @@ class AtomConfig:
     # TODO 目前 这个貌似会有点问题
     single_batch_OPS:int = 8192
     max_batch_size:int = 16
+    fast_compute:bool = False # 按取到的 chunk 合并计算延迟, 不再逐个小块等待
+
+
+@dataclass
+class TopologyConfig:
+    num_atoms:int = 8
+    num_sub_send_engine:int = 4
+    # 大于 0 的时候 SEND 指令按照这个 chunk 数拆分为多个 batch, 分给不同的 sub send engine, 0 表示不拆分
+    send_batch_chunk_num:int = 0
+    # atom id -> link id, 多个 atom 可以共用一条 link, 没有给出的 atom 独占一条和自己 id 相同的 link
+    atom_link_map:dict[int,int] = field(default_factory=dict)
+
+    def get_link_id(self,atom_id:int)->int:
+        return self.atom_link_map.get(atom_id,atom_id)
 
 
 element_bytes_dict = {
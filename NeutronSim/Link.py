@@ -0,0 +1,138 @@
+import math
+from collections import deque
+from dataclasses import dataclass
+from typing import Literal, Optional
+
+from Desim.Core import Event, SimModule, SimTime
+from Desim.memory.Memory import ChunkPacket
+
+from NeutronSim.Config import LinkConfig
+from NeutronSim.Utils import get_sim_cycle
+
+
+class D2DLinkModel:
+    """
+    uci-e link 的事务级模型
+    只记录链路下一次空闲的时间, 每个 chunk 的完成时间直接算出来, 不再为每个 chunk 产生仿真事件
+    每条 link 只有一个 atom, 并且接收端跟得上 link 的时候 (写入的地址不需要等待 free), 与逐 chunk 的模型完全一致
+    以下两种情况与逐 chunk 的模型不同:
+    1. 多个 atom 共用一条 store link 的时候, 按照调用 transfer 的顺序占用 link, 逐 chunk 的模型按照 chunk 到达 link 的顺序,
+       同一个 chunk 最多相差其他 atom 在这条 link 上排在它前面的 chunk 的传输时间
+    2. 接收端写入的时候需要等待 (例如 l2 的地址还没有 free), 逐 chunk 的模型中 link 两侧 FIFO 填满之后 link 停止传输,
+       这里 link 不会停止, 只有发送端在 LinkTransfer 中积压 capacity 个 chunk 之后才会等待, 完成时间可能更早,
+       最多相差接收端等待的时间
+    """
+
+    def __init__(self,d2d_link_config:LinkConfig):
+        self.d2d_link_config = d2d_link_config
+
+        self.link_free_time:int = 0
+
+    def transfer_latency(self,chunk_bytes:int)->int:
+        return math.ceil(chunk_bytes / self.d2d_link_config.bandwidth)
+
+    def transfer(self,send_time:int,chunk_bytes:int)->int:
+        """
+        chunk 在 send_time 被发送, 返回 chunk 完全到达对端的时间
+        """
+        arrive_time = send_time + self.d2d_link_config.link_latency
+        finish_time = max(arrive_time, self.link_free_time) + self.transfer_latency(chunk_bytes)
+        self.link_free_time = finish_time
+        return finish_time
+
+
+class LinkTransfer:
+    """
+    coalesce 模式下, 一条指令在一条 link 上发往一个目的地的全部 chunk
+    整条指令只通过 FIFO 传递一次, 发送端每读出一个 chunk 就连同它到达对端的时间追加到这里
+    接收端按照 FIFO 的方式读取, 只有追上发送端, 或者发送端超前 capacity 个 chunk 的时候才需要等待事件
+    capacity 对应逐 chunk 模式下 link 两侧 FIFO 的总容量
+    接收端读取一个还没有到达的 chunk 的时候仍然要等待一次, link 比接收端慢的时候每个 chunk 都会等待,
+    省掉的只是 link 流水级本身的事件
+    """
+
+    def __init__(self,capacity:int):
+        self.capacity = capacity
+
+        # (chunk packet, 到达对端的时间)
+        self.chunk_queue:deque[tuple[ChunkPacket,int]] = deque()
+
+        self.push_event = Event()
+        self.read_event = Event()
+        # 只有对方在等待的时候才需要 notify
+        self.read_waiting:bool = False
+        self.push_waiting:bool = False
+
+    def push(self,chunk_packet:ChunkPacket,arrive_time:int):
+        while len(self.chunk_queue) >= self.capacity:
+            self.push_waiting = True
+            SimModule.wait(self.read_event)
+
+        self.chunk_queue.append((chunk_packet,arrive_time))
+        if self.read_waiting:
+            self.read_waiting = False
+            self.push_event.notify(SimTime(0))
+
+    def is_empty(self)->bool:
+        return not self.chunk_queue or self.chunk_queue[0][1] > get_sim_cycle()
+
+    def read(self)->ChunkPacket:
+        while not self.chunk_queue:
+            self.read_waiting = True
+            SimModule.wait(self.push_event)
+
+        chunk_packet,arrive_time = self.chunk_queue[0]
+        remain_time = arrive_time - get_sim_cycle()
+        if remain_time > 0:
+            SimModule.wait_time(SimTime(remain_time))
+
+        # chunk 到达之后才释放位置
+        self.chunk_queue.popleft()
+        if self.push_waiting:
+            self.push_waiting = False
+            self.read_event.notify(SimTime(0))
+        return chunk_packet
+
+
+class RemoteWriteAck:
+    """
+    写到其他 chip 上的一条指令的确认
+    目的 chip 写完全部 chunk 之后, 确认再经过 ack_latency 回到发送方, 发送方在此之前不能退休这条指令
+    """
+
+    def __init__(self,chunk_num:int,ack_latency:int):
+        self.remain_num = chunk_num
+        self.ack_latency = ack_latency
+
+        self.ack_event = Event()
+        # 确认回到发送方的时间, 全部写完之前为 None
+        self.ack_time:Optional[int] = None
+
+    def chunk_written(self):
+        self.remain_num -= 1
+        if self.remain_num == 0:
+            self.ack_time = get_sim_cycle() + self.ack_latency
+            self.ack_event.notify(SimTime(self.ack_latency))
+
+    def wait(self):
+        if self.remain_num <= 0 and self.ack_time is None:
+            return
+        if self.ack_time is None:
+            SimModule.wait(self.ack_event)
+            return
+        remain_time = self.ack_time - get_sim_cycle()
+        if remain_time > 0:
+            SimModule.wait_time(SimTime(remain_time))
+
+
+@dataclass
+class InterChipPacket:
+    """
+    在片间 link 上传输的数据包, 带有最终写入的位置
+    """
+    dst_chip:int
+    dst_loc:Literal['l3','reduce']
+    dst_addr:int
+    chunk_packet:ChunkPacket
+    # 需要确认的远程写入, 写入目的 chip 之后通知发送方
+    ack:Optional[RemoteWriteAck] = None
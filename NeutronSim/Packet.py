@@ -0,0 +1,38 @@
+from __future__ import annotations
+
+from typing import Any
+
+from Desim.memory.Memory import ChunkPacket
+
+"""
+只关心时序的仿真中, chunk packet 的 payload 一般都是 None
+这样的 packet 只由 (num_elements, batch_size, element_bytes) 决定, 同样形状的 packet 共用一个对象
+packet 构建之后不会被修改, 所以共用是安全的
+"""
+
+flyweight_enabled:bool = True
+
+flyweight_packet_dict:dict[tuple[int,int,int],ChunkPacket] = {}
+
+
+def set_flyweight_enabled(enabled:bool):
+    # 只用于 benchmark 对比
+    global flyweight_enabled
+    flyweight_enabled = enabled
+
+
+def is_timing_only(payload:Any)->bool:
+    # payload 为 None, 或者是一个本身不带数据的 packet (例如 reduce buffer 中保存的 packet)
+    return payload is None or (isinstance(payload,ChunkPacket) and payload.payload is None)
+
+
+def make_chunk_packet(payload:Any,num_elements:int,batch_size:int,element_bytes:int)->ChunkPacket:
+    if not flyweight_enabled or not is_timing_only(payload):
+        return ChunkPacket(payload,num_elements,batch_size,element_bytes)
+
+    key = (num_elements,batch_size,element_bytes)
+    packet = flyweight_packet_dict.get(key)
+    if packet is None:
+        packet = ChunkPacket(None,num_elements,batch_size,element_bytes)
+        flyweight_packet_dict[key] = packet
+    return packet
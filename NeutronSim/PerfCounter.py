@@ -0,0 +1,298 @@
+from __future__ import annotations
+
+import math
+from typing import Any, Optional, TYPE_CHECKING
+
+from Desim.memory.Memory import ChunkMemoryPort
+
+from NeutronSim.ArrayMemory import ArrayChunkMemory, ArrayChunkMemoryPort
+from NeutronSim.Utils import get_sim_cycle
+
+if TYPE_CHECKING:
+    from NeutronSim.Tracer import ChromeTracer
+
+"""
+各个部件的性能计数器
+计数器默认关闭, 关闭的时候每次记录只有一次 enabled 的判断
+仿真结束之后通过 PerfMonitor.report 得到结构化的统计结果
+"""
+
+
+class StageCounter:
+    """
+    一个流水级或者 engine 的计数器
+    active: 从开始处理一条指令到处理结束的时间
+    busy: 其中真正在工作的时间, 包括计算/link 传输的延迟以及访存占用的带宽时间
+    stall: active - busy, 等待输入数据, 等待输出 fifo 以及等待 memory 中的数据就绪
+    配置了 tracer 的时候, 每次 begin/end 会记录为时间线上的一个事件
+    """
+    __slots__ = ('name','enabled','command_num','active_time','busy_time','bytes','begin_time','begin_label',
+                 'tracer','trace_track')
+
+    def __init__(self,name:str,enabled:bool=False):
+        self.name = name
+        self.enabled = enabled
+
+        self.command_num:int = 0
+        self.active_time:int = 0
+        self.busy_time:int = 0
+        self.bytes:int = 0
+
+        self.begin_time:int = 0
+        self.begin_label:Optional[str] = None
+
+        self.tracer:Optional[ChromeTracer] = None
+        self.trace_track:tuple[int,int] = (0,0)
+
+    def begin(self,label:Optional[str]=None):
+        if self.enabled:
+            self.begin_time = get_sim_cycle()
+            self.begin_label = label
+
+    def end(self):
+        if self.enabled:
+            end_time = get_sim_cycle()
+            self.active_time += end_time - self.begin_time
+            self.command_num += 1
+
+            if self.tracer is not None:
+                self.tracer.add_complete_event(self.begin_label or self.name,self.trace_track,self.begin_time,end_time)
+
+    def add_command(self,begin_time:int,label:Optional[str]=None):
+        """
+        多条指令同时执行的时候, 开始时间由调用者记录, 指令结束的时候调用
+        """
+        if self.enabled:
+            self.begin_time = begin_time
+            self.begin_label = label
+            self.end()
+
+    def add_busy(self,latency:int):
+        if self.enabled:
+            self.busy_time += latency
+
+    def add_bytes(self,num_bytes:int):
+        if self.enabled:
+            self.bytes += num_bytes
+
+    def report(self,sim_time:int)->dict[str,Any]:
+        return {
+            'command_num':self.command_num,
+            'active_time':self.active_time,
+            'busy_time':self.busy_time,
+            'stall_time':max(self.active_time - self.busy_time,0),
+            'bytes':self.bytes,
+            'utilization':self.busy_time / sim_time if sim_time > 0 else 0.0,
+        }
+
+
+class MemoryCounter:
+    """
+    一块 memory 上所有 port 的访存统计, 带宽利用率 = 访存字节数 / (带宽 * 仿真时间)
+    """
+    __slots__ = ('name','enabled','bandwidth','read_bytes','write_bytes')
+
+    def __init__(self,name:str,bandwidth:int,enabled:bool=False):
+        self.name = name
+        self.enabled = enabled
+        self.bandwidth = bandwidth
+
+        self.read_bytes:int = 0
+        self.write_bytes:int = 0
+
+    def report(self,sim_time:int)->dict[str,Any]:
+        total_bytes = self.read_bytes + self.write_bytes
+        return {
+            'read_bytes':self.read_bytes,
+            'write_bytes':self.write_bytes,
+            'bandwidth':self.bandwidth,
+            'utilization':total_bytes / (self.bandwidth * sim_time) if sim_time > 0 else 0.0,
+        }
+
+
+class WaitCounter:
+    """
+    请求的等待时间, 用于统计 AtomManager 中 link 资源的申请
+    """
+    __slots__ = ('name','enabled','request_num','total_wait_time','max_wait_time')
+
+    def __init__(self,name:str,enabled:bool=False):
+        self.name = name
+        self.enabled = enabled
+
+        self.request_num:int = 0
+        self.total_wait_time:int = 0
+        self.max_wait_time:int = 0
+
+    def add_wait(self,wait_time:int):
+        if self.enabled:
+            self.request_num += 1
+            self.total_wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time,wait_time)
+
+    def report(self,sim_time:int)->dict[str,Any]:
+        return {
+            'request_num':self.request_num,
+            'total_wait_time':self.total_wait_time,
+            'max_wait_time':self.max_wait_time,
+            'avg_wait_time':self.total_wait_time / self.request_num if self.request_num else 0.0,
+        }
+
+
+class CountedPortMixin:
+    """
+    会记录访存字节数的 port
+    每次访存按照 memory 的带宽算出占用的时间, 记为所属流水级的 busy 时间
+    """
+
+    def __init__(self):
+        super().__init__()
+
+        self.memory_counter:Optional[MemoryCounter] = None
+        self.stage_counter:Optional[StageCounter] = None
+
+    def config_counter(self,memory_counter:Optional[MemoryCounter],stage_counter:Optional[StageCounter]=None):
+        self.memory_counter = memory_counter
+        self.stage_counter = stage_counter
+
+    def count(self,num_bytes:int,is_write:bool):
+        memory_counter = self.memory_counter
+        if memory_counter is None or not memory_counter.enabled:
+            return
+
+        if is_write:
+            memory_counter.write_bytes += num_bytes
+        else:
+            memory_counter.read_bytes += num_bytes
+
+        if self.stage_counter is not None:
+            self.stage_counter.add_bytes(num_bytes)
+            self.stage_counter.add_busy(math.ceil(num_bytes / memory_counter.bandwidth))
+
+    def read(self,addr,count,free,num_elements,batch_size,element_bytes):
+        data = super().read(addr,count,free,num_elements,batch_size,element_bytes)
+        self.count(num_elements*batch_size*element_bytes,False)
+        return data
+
+    def write(self,addr,data,check_write_tag,num_elements,batch_size,element_bytes):
+        super().write(addr,data,check_write_tag,num_elements,batch_size,element_bytes)
+        self.count(num_elements*batch_size*element_bytes,True)
+
+
+class CountedChunkMemoryPort(CountedPortMixin,ChunkMemoryPort):
+    pass
+
+
+class CountedArrayChunkMemoryPort(CountedPortMixin,ArrayChunkMemoryPort):
+    def read_burst(self,addr,chunk_num,count,free,num_elements,batch_size,element_bytes,chunk_callback):
+        burst_num = super().read_burst(addr,chunk_num,count,free,num_elements,batch_size,element_bytes,chunk_callback)
+        # 与逐个 chunk 读写一样按 chunk 计数, busy 时间相同
+        for _ in range(burst_num):
+            self.count(num_elements*batch_size*element_bytes,False)
+        return burst_num
+
+    def write_burst(self,addr,data_list,check_write_tag,num_elements,batch_size,element_bytes):
+        super().write_burst(addr,data_list,check_write_tag,num_elements,batch_size,element_bytes)
+        for _ in data_list:
+            self.count(num_elements*batch_size*element_bytes,True)
+
+
+def make_counted_memory_port(memory)->CountedPortMixin:
+    if isinstance(memory,ArrayChunkMemory):
+        port = CountedArrayChunkMemoryPort()
+    else:
+        port = CountedChunkMemoryPort()
+    port.config_chunk_memory(memory)
+    return port
+
+
+class PerfMonitor:
+    """
+    一个 chip 上所有计数器的集合, 计数器按照名字创建, 同名的计数器会被共用
+    流水级计数器的名字是 '部件.流水级', 例如 'atom.3.fetch', 在时间线上对应 process 和 thread
+    """
+
+    def __init__(self,enabled:bool=False):
+        self.enabled = enabled
+
+        # 多 chip 系统中用于区分不同 chip 的时间线
+        self.name:str = ''
+        self.tracer:Optional[ChromeTracer] = None
+
+        self.stage_counter_dict:dict[str,StageCounter] = {}
+        self.memory_counter_dict:dict[str,MemoryCounter] = {}
+        self.wait_counter_dict:dict[str,WaitCounter] = {}
+
+        # id(memory) -> memory 的名字, 通过 memory 对象找到对应的计数器
+        self.memory_name_dict:dict[int,str] = {}
+
+    def enable(self,enabled:bool=True):
+        """
+        需要在 scheduler.run() 之前调用, 之后创建的计数器也会被打开
+        """
+        self.enabled = enabled
+        for counter_dict in (self.stage_counter_dict,self.memory_counter_dict,self.wait_counter_dict):
+            for counter in counter_dict.values():
+                counter.enabled = enabled
+
+    def config_tracer(self,tracer:Optional[ChromeTracer]):
+        """
+        时间线依赖流水级计数器的 begin/end, 配置 tracer 的同时会打开计数器
+        """
+        self.tracer = tracer
+        if tracer is not None:
+            self.enable()
+        for counter in self.stage_counter_dict.values():
+            self.config_counter_tracer(counter)
+
+    def config_counter_tracer(self,counter:StageCounter):
+        counter.tracer = self.tracer
+        if self.tracer is not None:
+            process_name,_,thread_name = counter.name.rpartition('.')
+            if self.name:
+                process_name = f'{self.name}.{process_name}' if process_name else self.name
+            counter.trace_track = self.tracer.get_track(process_name,thread_name)
+
+    def get_stage_counter(self,name:str)->StageCounter:
+        if name not in self.stage_counter_dict:
+            counter = StageCounter(name,self.enabled)
+            self.config_counter_tracer(counter)
+            self.stage_counter_dict[name] = counter
+        return self.stage_counter_dict[name]
+
+    def register_memory(self,memory,name:str,bandwidth:int)->MemoryCounter:
+        self.memory_counter_dict[name] = MemoryCounter(name,bandwidth,self.enabled)
+        self.memory_name_dict[id(memory)] = name
+        return self.memory_counter_dict[name]
+
+    def get_memory_counter(self,memory)->Optional[MemoryCounter]:
+        name = self.memory_name_dict.get(id(memory))
+        return self.memory_counter_dict.get(name) if name is not None else None
+
+    def get_wait_counter(self,name:str)->WaitCounter:
+        if name not in self.wait_counter_dict:
+            self.wait_counter_dict[name] = WaitCounter(name,self.enabled)
+        return self.wait_counter_dict[name]
+
+    def make_memory_port(self,memory,stage_name:Optional[str]=None)->CountedPortMixin:
+        """
+        构建访问 memory 的 port, 没有注册过的 memory 不会被统计
+        """
+        port = make_counted_memory_port(memory)
+        self.config_memory_port(port,memory,stage_name)
+        return port
+
+    def config_memory_port(self,port:CountedPortMixin,memory,stage_name:Optional[str]=None):
+        port.config_counter(self.get_memory_counter(memory),
+                            self.get_stage_counter(stage_name) if stage_name is not None else None)
+
+    def report(self,sim_time:Optional[int]=None)->dict[str,Any]:
+        if sim_time is None:
+            sim_time = get_sim_cycle()
+
+        return {
+            'sim_time':sim_time,
+            'stage':{name:counter.report(sim_time) for name,counter in sorted(self.stage_counter_dict.items())},
+            'memory':{name:counter.report(sim_time) for name,counter in sorted(self.memory_counter_dict.items())},
+            'wait':{name:counter.report(sim_time) for name,counter in sorted(self.wait_counter_dict.items())},
+        }
@@ -0,0 +1,99 @@
+from typing import Callable, Optional, TypeAlias, Any
+
+from Desim.module.FIFO import FIFO
+from Desim.module.Pipeline import PipeGraph, PipeStage
+
+from NeutronSim.PerfCounter import StageCounter
+from NeutronSim.Utils import get_sim_cycle
+
+PipeArg:TypeAlias = Optional[dict[str,FIFO]]
+TemplateHandler:TypeAlias = Callable[[Any,PipeArg,PipeArg],Any]
+
+
+class PipeTemplate:
+    """
+    常驻的流水线模板
+    流水线只在第一次使用的时候构建一次, 之后每条指令作为 token 发送给所有的流水级
+    每个流水级按照 token 的顺序依次处理指令, sink 流水级处理完之后向自己的 finish fifo 写入该指令
+    """
+
+    def __init__(self,token_fifo_size:int=1):
+        self.pipe_graph = PipeGraph()
+
+        self.token_fifo_size = token_fifo_size
+        self.token_fifo_dict:dict[str,FIFO] = {}
+
+        self.sink_stage_names:list[str] = []
+        self.finish_fifo_dict:dict[str,FIFO] = {}
+
+        # id(command) -> 最后一个 sink 处理完这条指令的时间
+        self.finish_time_dict:dict[int,int] = {}
+        self.last_finish_time:int = 0
+
+        self.started:bool = False
+
+    def add_stage(self,handler:TemplateHandler,name:str,is_sink:bool=False,perf_counter:Optional[StageCounter]=None):
+        token_fifo = FIFO(self.token_fifo_size)
+        self.token_fifo_dict[name] = token_fifo
+
+        if is_sink:
+            self.sink_stage_names.append(name)
+            self.finish_fifo_dict[name] = FIFO(self.token_fifo_size)
+        finish_fifo = self.finish_fifo_dict.get(name)
+
+        def stage_handler(input_fifo_map:PipeArg,output_fifo_map:PipeArg)->bool:
+            # 流水级常驻, 不断地读取新的指令
+            while True:
+                command = token_fifo.read()
+                if command is None:
+                    # 流水线被关闭
+                    return False
+                if perf_counter is not None:
+                    perf_counter.begin(command.opcode)
+                handler(command,input_fifo_map,output_fifo_map)
+                if perf_counter is not None:
+                    perf_counter.end()
+                if finish_fifo is not None:
+                    finish_time = get_sim_cycle()
+                    self.finish_time_dict[id(command)] = max(self.finish_time_dict.get(id(command),0),finish_time)
+                    finish_fifo.write(command)
+
+        self.pipe_graph.add_stage(PipeStage.dynamic_create(stage_handler),name)
+
+    def add_edge(self,src_name:str,dst_name:str,fifo_name:str,fifo_size:int,init_size:int=0):
+        self.pipe_graph.add_edge(src_name,dst_name,fifo_name,fifo_size,init_size)
+
+    def add_edge_with_fifo(self,src_name:str,dst_name:str,fifo_name:str,fifo:FIFO):
+        self.pipe_graph.add_edge_with_fifo(src_name,dst_name,fifo_name,fifo)
+
+    def build(self):
+        self.pipe_graph.build_graph()
+        self.pipe_graph.config_sink_stage_names(self.sink_stage_names)
+
+    def issue(self,command):
+        # 第一次使用的时候才启动流水线
+        if not self.started:
+            self.pipe_graph.start_pipe_graph()
+            self.started = True
+
+        for token_fifo in self.token_fifo_dict.values():
+            token_fifo.write(command)
+
+    def close(self):
+        """
+        所有指令都已经结束之后调用, 流水级读到 None 之后退出, 流水线可以被回收
+        """
+        if self.started:
+            for token_fifo in self.token_fifo_dict.values():
+                token_fifo.write(None)
+            self.started = False
+
+    def wait_finish(self):
+        """
+        等待最早发射的一条指令执行结束
+        """
+        command = None
+        for finish_fifo in self.finish_fifo_dict.values():
+            command = finish_fifo.read()
+        self.last_finish_time = self.finish_time_dict.pop(id(command),get_sim_cycle())
+        return command
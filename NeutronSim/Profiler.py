@@ -0,0 +1,192 @@
+from __future__ import annotations
+
+import os
+import time
+from typing import Any, Optional
+
+from Desim.Core import SimSession
+
+from NeutronSim.Utils import get_sim_cycle
+
+"""
+仿真器自身的性能分析
+Desim 中每个 coroutine 运行在一个 greenlet 中, 通过 greenlet.settrace 记录每次切换
+两次切换之间的墙钟时间记在切出的 greenlet 上, 切入的次数就是这个 coroutine 被唤醒的次数
+greenlet 按照栈中最外层的 NeutronSim 函数命名, 流水级按照实际的 handler 命名
+"""
+
+package_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def describe_module(module)->str:
+    name = type(module).__name__
+    for id_attr in ('atom_id','sub_send_engine_id','chip_id'):
+        module_id = getattr(module,id_attr,None)
+        if module_id is not None and module_id >= 0:
+            return f'{name}[{module_id}]'
+    return name
+
+
+def describe_handler(handler)->str:
+    # 绑定方法直接使用所属的对象, helper 返回的闭包从闭包变量中找到 self
+    owner = getattr(handler,'__self__',None)
+    if owner is None and getattr(handler,'__closure__',None):
+        for cell in handler.__closure__:
+            try:
+                value = cell.cell_contents
+            except ValueError:
+                continue
+            if hasattr(value,'register_coroutine'):
+                owner = value
+                break
+
+    handler_name = handler.__name__
+    if owner is None:
+        return handler_name
+    return f'{describe_module(owner)}.{handler_name}'
+
+
+def describe_frame(frame)->Optional[str]:
+    """
+    从栈顶向下找到最外层的 NeutronSim 函数, 作为这个 greenlet 的名字
+    """
+    outer_frame = None
+    while frame is not None:
+        if frame.f_code.co_filename.startswith(package_dir):
+            outer_frame = frame
+        frame = frame.f_back
+
+    if outer_frame is None:
+        return None
+
+    # PipeTemplate 的流水级外壳, 实际的工作在 handler 中
+    if outer_frame.f_code.co_name == 'stage_handler' and 'handler' in outer_frame.f_locals:
+        return describe_handler(outer_frame.f_locals['handler'])
+
+    module = outer_frame.f_locals.get('self')
+    if module is None:
+        return outer_frame.f_code.co_name
+    return f'{describe_module(module)}.{outer_frame.f_code.co_name}'
+
+
+class SimProfiler:
+    """
+    使用方法:
+        profiler = SimProfiler()
+        profiler.run()                  # 代替 SimSession.scheduler.run()
+        print(profiler.format_report())
+    """
+
+    def __init__(self):
+        # greenlet -> [墙钟时间, 被唤醒次数]
+        self.greenlet_stat_dict:dict[Any,list] = {}
+        # greenlet -> 名字, 需要在 greenlet 挂起的时候才能从栈中得到
+        self.greenlet_name_dict:dict[Any,str] = {}
+
+        self.last_switch_time:float = 0.0
+        self.previous_trace_function = None
+
+        self.wall_time:float = 0.0
+        self.sim_time:int = 0
+
+    def trace_function(self,event:str,args):
+        if event not in ('switch','throw'):
+            return
+
+        origin,target = args
+        now = time.perf_counter()
+
+        origin_stat = self.greenlet_stat_dict.get(origin)
+        if origin_stat is None:
+            origin_stat = self.greenlet_stat_dict[origin] = [0.0,0]
+        origin_stat[0] += now - self.last_switch_time
+
+        target_stat = self.greenlet_stat_dict.get(target)
+        if target_stat is None:
+            target_stat = self.greenlet_stat_dict[target] = [0.0,0]
+        target_stat[1] += 1
+
+        if target not in self.greenlet_name_dict:
+            self.resolve_name(target)
+
+        self.last_switch_time = time.perf_counter()
+
+    def resolve_name(self,target):
+        if target.parent is None:
+            self.greenlet_name_dict[target] = 'scheduler'
+            return
+
+        name = None
+        if target.gr_frame is not None:
+            name = describe_frame(target.gr_frame)
+        elif getattr(target,'run',None) is not None:
+            # 还没有开始运行, 先用入口函数的名字, 不能确定的话等下一次切入的时候再看
+            run = target.run
+            if hasattr(run,'__self__') and hasattr(run.__self__,'register_coroutine'):
+                name = describe_handler(run)
+
+        if name is not None:
+            self.greenlet_name_dict[target] = name
+
+    def start(self):
+        try:
+            import greenlet
+        except ImportError as e:
+            raise ImportError('SimProfiler 需要 greenlet') from e
+
+        self.previous_trace_function = greenlet.settrace(self.trace_function)
+        self.last_switch_time = time.perf_counter()
+
+    def stop(self):
+        import greenlet
+        greenlet.settrace(self.previous_trace_function)
+        self.previous_trace_function = None
+
+        # 最后一段时间记在当前的 greenlet 上
+        current = greenlet.getcurrent()
+        current_stat = self.greenlet_stat_dict.setdefault(current,[0.0,0])
+        current_stat[0] += time.perf_counter() - self.last_switch_time
+        if current not in self.greenlet_name_dict:
+            self.greenlet_name_dict[current] = 'scheduler' if current.parent is None else 'main'
+
+    def run(self)->dict[str,Any]:
+        start_time = time.perf_counter()
+        self.start()
+        try:
+            SimSession.scheduler.run()
+        finally:
+            self.stop()
+        self.wall_time = time.perf_counter() - start_time
+        self.sim_time = get_sim_cycle()
+        return self.report()
+
+    def report(self)->dict[str,Any]:
+        coroutine_dict:dict[str,dict[str,Any]] = {}
+        for greenlet_obj,(wall_time,resume_num) in self.greenlet_stat_dict.items():
+            name = self.greenlet_name_dict.get(greenlet_obj,'unknown')
+            stat = coroutine_dict.setdefault(name,{'wall_time':0.0,'resume_num':0,'greenlet_num':0})
+            stat['wall_time'] += wall_time
+            stat['resume_num'] += resume_num
+            stat['greenlet_num'] += 1
+
+        for stat in coroutine_dict.values():
+            stat['wall_time_ratio'] = stat['wall_time'] / self.wall_time if self.wall_time > 0 else 0.0
+
+        return {
+            'wall_time':self.wall_time,
+            'sim_time':self.sim_time,
+            'sim_ns_per_wall_s':self.sim_time / self.wall_time if self.wall_time > 0 else 0.0,
+            'resume_num':sum(stat['resume_num'] for stat in coroutine_dict.values()),
+            'coroutine':dict(sorted(coroutine_dict.items(),key=lambda item:item[1]['wall_time'],reverse=True)),
+        }
+
+    def format_report(self,top:int=20)->str:
+        report = self.report()
+        line_list = [
+            f"wall time {report['wall_time']:.3f} s, sim time {report['sim_time']} ns, "
+            f"{report['sim_ns_per_wall_s']:.1f} sim ns / wall s, {report['resume_num']} resumes",
+            f"{'coroutine':<60} {'wall(s)':>10} {'ratio':>7} {'resumes':>10}",
+        ]
+        for name,stat in list(report['coroutine'].items())[:top]:
+            line_list.append(f"{name:<60} {stat['wall_time']:>10.4f} {stat['wall_time_ratio']:>7.1%} {stat['resume_num']:>10}")
+        return '\n'.join(line_list)
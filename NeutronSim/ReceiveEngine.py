@@ -1,165 +1,361 @@
-from dataclasses import dataclass
+from __future__ import annotations
+
+from collections import deque
+from dataclasses import dataclass, field
 from functools import lru_cache
 from typing import Optional, Literal, TypeAlias, TYPE_CHECKING
 
 from Desim.Core import SimModule, SimTime
-from Desim.module.FIFO import FIFO
+from Desim.module.FIFO import FIFO, DelayFIFO
 
 from NeutronSim.Commands import ReceiveCommand, ReceiveBaseCommand, QuantCommand
-from Desim.module.Pipeline import PipeGraph, PipeStage
+from NeutronSim.ArrayMemory import burst_read, burst_write_from_fifo, deliver_chunk
+from NeutronSim.CommandQueue import make_command_queue
+from NeutronSim.Packet import make_chunk_packet
+from NeutronSim.PipeTemplate import PipeTemplate
+from NeutronSim.Trace import ReceiveCommandArray
 
 from Desim.memory.Memory import ChunkMemory, ChunkPacket
 
 from NeutronSim.Config import element_bytes_dict
+from NeutronSim.Link import InterChipPacket
+from NeutronSim.PerfCounter import PerfMonitor, StageCounter
+from NeutronSim.Utils import get_sim_cycle
+from NeutronSim.VectorEngine import VectorEngine, VectorEngineConfig, VectorOpConfig
 from Desim.memory.Memory import ChunkMemoryPort
 
 if TYPE_CHECKING:
     from NeutronSim.Chip import Chip
+    from NeutronSim.System import System
 
 PipeArg:TypeAlias = Optional[dict[str,FIFO]]
 
+# read dma 编号对应的流水级名字, 用于统计
+read_dma_stage_name_dict = {0:'read_dma_0_stage',1:'read_dma_1_stage',2:'read_dma_a_stage'}
+
 
 @dataclass
 class ReceiveEngineConfig:
-    recv_engine_width:int = 10
+    # 同时在流水线中执行的指令数, 默认为 1, 逐条执行, 与原来的时序一致
+    # 大于 1 的时候没有地址依赖的指令可以重叠执行
+    recv_engine_width:int = 1
+    vector_engine_config:VectorEngineConfig = field(default_factory=VectorEngineConfig)
 
 
+AddressRange:TypeAlias = tuple[str,int,int]
 
 
+def range_overlap(range_list_a:list[AddressRange],range_list_b:list[AddressRange])->bool:
+    for loc_a,start_a,stop_a in range_list_a:
+        for loc_b,start_b,stop_b in range_list_b:
+            if loc_a == loc_b and start_a < stop_b and start_b < stop_a:
+                return True
+    return False
+
+
+def get_address_range(command:ReceiveBaseCommand,chip_id:int=-1)->tuple[list[AddressRange],list[AddressRange]]:
+    """
+    指令读写的地址范围 (loc, 起始地址, 结束地址), 写到其他 chip 的 l3 单独作为一个 loc
+    """
+    read_range_list:list[AddressRange] = []
+    write_range_list:list[AddressRange] = []
+    chunk_num = command.chunk_num
+
+    if isinstance(command, ReceiveCommand):
+        read_range_list.append((command.src0_loc,command.src0,command.src0+chunk_num))
+        if command.opcode in ['RECEIVE_BIN','RECEIVE_TRI']:
+            read_range_list.append((command.src1_loc,command.src1,command.src1+chunk_num))
+        if command.opcode == 'RECEIVE_TRI':
+            read_range_list.append(('l3',command.asrc,command.asrc+chunk_num))
+
+        dst_loc = 'l3'
+        if command.dst_chip >= 0 and command.dst_chip != chip_id:
+            dst_loc = f'l3-chip{command.dst_chip}'
+        write_range_list.append((dst_loc,command.dst0,command.dst0+chunk_num))
+        if command.dst1_flag:
+            write_range_list.append((dst_loc,command.dst1,command.dst1+chunk_num))
+    elif isinstance(command, QuantCommand):
+        read_range_list.append(('l3',command.src,command.src+chunk_num))
+        write_range_list.append(('l3',command.dstq,command.dstq+chunk_num))
+    else:
+        raise ValueError
+
+    return read_range_list,write_range_list
 
-class ReceiveEngine(SimModule):
 
-    def __init__(self,top_module):
-        super().__init__()
+@dataclass
+class InflightCommand:
+    command:ReceiveBaseCommand
+    pipe_template:PipeTemplate
+    issue_time:int
+    read_range_list:list[AddressRange]
+    write_range_list:list[AddressRange]
 
-        self.top_module = top_module
 
-        self.recv_command_queue:Optional[FIFO] = None
+@dataclass
+class OverlapStat:
+    """
+    receive 指令从第一条发射到最后一条结束的跨度
+    重叠执行的时候每条指令的延迟包含了与其他指令竞争的时间, 延迟之和不能作为串行执行的时间,
+    重叠的收益需要与 recv_engine_width=1 的仿真对比, 见 Sweep.run_overlap_gain
+    """
+    command_num:int = 0
+    latency_sum:int = 0
+    first_issue_time:int = -1
+    last_finish_time:int = 0
+    max_inflight_num:int = 0
+
+    def add_command(self,issue_time:int,finish_time:int):
+        if self.first_issue_time < 0:
+            self.first_issue_time = issue_time
+        self.command_num += 1
+        self.latency_sum += finish_time - issue_time
+        self.last_finish_time = max(self.last_finish_time,finish_time)
+
+    def get_span(self)->int:
+        return self.last_finish_time - max(self.first_issue_time,0)
+
+    def report(self)->dict:
+        return {
+            'command_num':self.command_num,
+            'latency_sum':self.latency_sum,
+            'span':self.get_span(),
+            'max_inflight_num':self.max_inflight_num,
+        }
 
-        self.current_command:Optional[ReceiveBaseCommand] = None
 
-        self.register_coroutine(self.process)
+class ReceiveEngine(SimModule):
 
-        self.external_l3_memory:Optional[ChunkMemory] = None
-        self.external_reduce_memory:Optional[ChunkMemory] = None
+    def __init__(self,top_module,receive_engine_config:ReceiveEngineConfig=ReceiveEngineConfig()):
+        super().__init__()
 
+        self.top_module = top_module
 
+        self.receive_engine_config = receive_engine_config
 
+        # act / mul / add / quant 共用一个向量单元
+        self.vector_engine = VectorEngine(self.receive_engine_config.vector_engine_config)
 
-    def load_command(self,command_list:list[ReceiveBaseCommand]):
-        command_size = len(command_list)
-        self.recv_command_queue = FIFO(command_size,command_size,command_list)
+        self.recv_command_queue:Optional[FIFO] = None
 
+        self.current_command:Optional[ReceiveBaseCommand] = None
 
-    def process(self):
-        while True:
-            if self.recv_command_queue.is_empty():
-                return
+        # 已经发射还没有结束的指令, 按照发射的顺序排列, 最多 recv_engine_width 条
+        self.inflight_command_list:deque[InflightCommand] = deque()
+        # 已经读取, 但是因为资源或者地址依赖还不能发射的指令
+        self.pending_command:Optional[ReceiveBaseCommand] = None
 
-            # 可以继续读取指令
-            self.current_command = self.recv_command_queue.read()
+        # 用于统计重叠执行带来的收益
+        self.overlap_stat:OverlapStat = OverlapStat()
+        # 每条指令结束的时间, 按照指令的顺序
+        self.finish_time_list:list[int] = []
 
-            # 资源是独占的, 可以直接进行解码, 并执行相关的计算
-            pipe_graph = PipeGraph()
+        # receive 和 quant 各一个常驻的流水线, 第一次遇到的时候构建
+        self.pipe_template_dict:dict[str,PipeTemplate] = {}
 
-            if isinstance(self.current_command, ReceiveCommand):
-                # 还是构建一个固定的流水线吧, 通过调整里面的流水级的函数实现 各种操作
+        self.register_coroutine(self.process)
 
-                if self.current_command.src0_loc == 'l3':
-                    read_dma_0_stage = PipeStage.dynamic_create(self.l3_read_dma_helper(0))
-                elif self.current_command.src0_loc == 'reduce':
-                    read_dma_0_stage = PipeStage.dynamic_create(self.reduce_read_dma_helper(0))
-                else:
-                    assert False
+        self.external_l3_memory:Optional[ChunkMemory] = None
+        self.external_reduce_memory:Optional[ChunkMemory] = None
 
-                if self.current_command.src1_loc == 'l3':
-                    read_dma_1_stage = PipeStage.dynamic_create(self.l3_read_dma_helper(1))
-                elif self.current_command.src1_loc == 'reduce':
-                    read_dma_1_stage = PipeStage.dynamic_create(self.reduce_read_dma_helper(1))
-                else:
-                    assert False
+        # 多 chip 系统中, 结果可以写到其他 chip 的 l3 中
+        self.chip_id:int = -1
+        self.external_system:Optional[System] = None
+
+        self.perf_monitor:PerfMonitor = PerfMonitor()
+        self.perf_name:str = 'receive_engine'
 
-                read_dma_a_stage = PipeStage.dynamic_create(self.l3_read_dma_helper(2))
-                act_stage = PipeStage.dynamic_create(self.act_handler)
-                mul_quant_stage = PipeStage.dynamic_create(self.mul_quant_handler)
-                add_stage = PipeStage.dynamic_create(self.add_handler)
-                fork_stage = PipeStage.dynamic_create(self.fork_handler)
 
-                write_dma_0_stage = PipeStage.dynamic_create(self.l3_write_dma_helper(0))
-                write_dma_1_stage = PipeStage.dynamic_create(self.l3_write_dma_helper(1))
 
-                pipe_graph.add_stage(read_dma_0_stage,'read_dma_0_stage')
-                pipe_graph.add_stage(read_dma_1_stage,'read_dma_1_stage')
-                pipe_graph.add_stage(read_dma_a_stage,'read_dma_a_stage')
-                pipe_graph.add_stage(act_stage,'act_stage')
-                pipe_graph.add_stage(mul_quant_stage,'mul_quant_stage')
-                pipe_graph.add_stage(add_stage,'add_stage')
-                pipe_graph.add_stage(fork_stage,'fork_stage')
-                pipe_graph.add_stage(write_dma_0_stage,'write_dma_0_stage')
-                pipe_graph.add_stage(write_dma_1_stage,'write_dma_1_stage')
+    def load_command(self,command_list:list[ReceiveBaseCommand]):
+        # 已经给出全部指令的时候在加载时检查, trace 直接检查 act 列, 不解码指令
+        # 其他的序列和迭代器在读取指令的时候检查
+        if isinstance(command_list,(list,tuple)):
+            for command in command_list:
+                self.check_command(command)
+        elif isinstance(command_list,ReceiveCommandArray):
+            self.vector_engine.check_act_array(command_list.get_act_array())
+        self.recv_command_queue = make_command_queue(command_list)
 
-                pipe_graph.add_edge('read_dma_0_stage','act_stage','to_act',1)
-                pipe_graph.add_edge('read_dma_1_stage','mul_quant_stage','to_mul_quant_1',1)
-                pipe_graph.add_edge('act_stage','mul_quant_stage','to_mul_quant_0',1)
-                pipe_graph.add_edge('mul_quant_stage','add_stage','to_add_0',1)
-                pipe_graph.add_edge('read_dma_a_stage','add_stage','to_add_1',1)
-                pipe_graph.add_edge('add_stage','fork_stage','to_fork',1)
-                pipe_graph.add_edge('fork_stage','write_dma_0_stage','to_write_dma_0',1)
-                pipe_graph.add_edge('fork_stage','write_dma_1_stage','to_write_dma_1',1)
+    def check_command(self,command:ReceiveBaseCommand):
+        if isinstance(command,ReceiveCommand):
+            self.vector_engine.check_act(command.act)
 
-                pipe_graph.build_graph()
-                pipe_graph.config_sink_stage_names(['write_dma_0_stage','write_dma_1_stage'])
 
+    def process(self):
+        """
+        最多 recv_engine_width 条指令同时在流水线中执行
+        与正在执行的指令存在地址依赖 (RAW / WAR / WAW) 的指令需要等待, 指令按照发射的顺序结束
+        width 为 1 的时候与逐条执行的时序一致
+        """
+        recv_engine_width = self.receive_engine_config.recv_engine_width
+        while True:
+            if self.pending_command is None and not self.recv_command_queue.is_empty():
+                self.pending_command = self.recv_command_queue.read()
+                self.check_command(self.pending_command)
 
-            elif isinstance(self.current_command, QuantCommand):
-                read_dma_0_stage = PipeStage.dynamic_create(self.l3_read_dma_helper(0))
-                mul_quant_stage = PipeStage.dynamic_create(self.mul_quant_handler)
-                fork_stage = PipeStage.dynamic_create(self.fork_handler)
+            if self.pending_command is None and not self.inflight_command_list:
+                return
 
-                write_dma_0_stage = PipeStage.dynamic_create(self.l3_write_dma_helper(0))
+            if self.pending_command is not None and len(self.inflight_command_list) < recv_engine_width \
+                    and not self.has_hazard(self.pending_command):
+                self.issue_command(self.pending_command)
+                self.pending_command = None
+                # 每个周期解码一条指令
+                SimModule.wait_time(SimTime(1))
+            else:
+                self.retire_command()
+                SimModule.wait_time(SimTime(1))
+
+    def issue_command(self,command:ReceiveBaseCommand):
+        self.current_command = command
+
+        # 流水线常驻, 指令作为 token 发送进去
+        pipe_template = self.get_pipe_template(command)
+        pipe_template.issue(command)
+
+        read_range_list,write_range_list = self.get_address_range(command)
+        self.inflight_command_list.append(InflightCommand(command,pipe_template,get_sim_cycle(),
+                                                          read_range_list,write_range_list))
+        self.overlap_stat.max_inflight_num = max(self.overlap_stat.max_inflight_num,len(self.inflight_command_list))
+
+    def retire_command(self):
+        # 最早发射的指令一定是所在流水线中最早的指令
+        inflight = self.inflight_command_list.popleft()
+        inflight.pipe_template.wait_finish()
+        finish_time = inflight.pipe_template.last_finish_time
+
+        self.overlap_stat.add_command(inflight.issue_time,finish_time)
+        self.finish_time_list.append(finish_time)
+        self.perf_monitor.get_stage_counter(f'{self.perf_name}.command').add_command(inflight.issue_time,
+                                                                                    inflight.command.opcode)
+        if not self.inflight_command_list:
+            self.current_command = None
 
-                pipe_graph.add_stage(read_dma_0_stage,'read_dma_0_stage')
-                pipe_graph.add_stage(mul_quant_stage,'mul_quant_stage')
-                pipe_graph.add_stage(fork_stage,'fork_stage')
-                pipe_graph.add_stage(write_dma_0_stage,'write_dma_0_stage')
+    def get_address_range(self,command:ReceiveBaseCommand)->tuple[list[AddressRange],list[AddressRange]]:
+        return get_address_range(command,self.chip_id)
 
-                pipe_graph.add_edge('read_dma_0_stage','mul_quant_stage','to_mul_quant_0',1)
-                pipe_graph.add_edge('mul_quant_stage','fork_stage','to_fork',1)
-                pipe_graph.add_edge('fork_stage','write_dma_0_stage','to_write_dma_0',1)
+    def has_hazard(self,command:ReceiveBaseCommand)->bool:
+        read_range_list,write_range_list = self.get_address_range(command)
+        for inflight in self.inflight_command_list:
+            # RAW
+            if range_overlap(read_range_list,inflight.write_range_list):
+                return True
+            # WAR
+            if range_overlap(write_range_list,inflight.read_range_list):
+                return True
+            # WAW
+            if range_overlap(write_range_list,inflight.write_range_list):
+                return True
+        return False
 
-                pipe_graph.build_graph()
-                pipe_graph.config_sink_stage_names(['write_dma_0_stage'])
+    def get_overlap_report(self)->dict:
+        return self.overlap_stat.report()
 
+    def get_pipe_template(self,command:ReceiveBaseCommand)->PipeTemplate:
+        # 所有的 RECEIVE 指令共用一条流水线, 指令中的字段决定哪些流水级工作
+        if isinstance(command, ReceiveCommand):
+            pipe_name = 'RECEIVE'
+        elif isinstance(command, QuantCommand):
+            pipe_name = 'QUANT'
+        else:
+            raise ValueError
 
-            pipe_graph.start_pipe_graph()
+        if pipe_name not in self.pipe_template_dict:
+            if pipe_name == 'RECEIVE':
+                self.pipe_template_dict[pipe_name] = self.build_receive_pipe_template()
+            else:
+                self.pipe_template_dict[pipe_name] = self.build_quant_pipe_template()
+        return self.pipe_template_dict[pipe_name]
+
+    def build_receive_pipe_template(self)->PipeTemplate:
+        # 还是构建一个固定的流水线吧, 通过调整里面的流水级的函数实现 各种操作
+        # 读取 l3 还是 reduce 由 read dma 根据每条指令自己决定
+        pipe_template = PipeTemplate(self.receive_engine_config.recv_engine_width)
+
+        pipe_template.add_stage(self.read_dma_helper(0),'read_dma_0_stage',perf_counter=self.get_stage_counter('read_dma_0_stage'))
+        pipe_template.add_stage(self.read_dma_helper(1),'read_dma_1_stage',perf_counter=self.get_stage_counter('read_dma_1_stage'))
+        pipe_template.add_stage(self.read_dma_helper(2),'read_dma_a_stage',perf_counter=self.get_stage_counter('read_dma_a_stage'))
+        pipe_template.add_stage(self.act_handler,'act_stage',perf_counter=self.get_stage_counter('act_stage'))
+        pipe_template.add_stage(self.mul_quant_handler,'mul_quant_stage',perf_counter=self.get_stage_counter('mul_quant_stage'))
+        pipe_template.add_stage(self.add_handler,'add_stage',perf_counter=self.get_stage_counter('add_stage'))
+        pipe_template.add_stage(self.fork_handler,'fork_stage',perf_counter=self.get_stage_counter('fork_stage'))
+        pipe_template.add_stage(self.l3_write_dma_helper(0),'write_dma_0_stage',is_sink=True,
+                                perf_counter=self.get_stage_counter('write_dma_0_stage'))
+        pipe_template.add_stage(self.l3_write_dma_helper(1),'write_dma_1_stage',is_sink=True,
+                                perf_counter=self.get_stage_counter('write_dma_1_stage'))
+
+        pipe_template.add_edge('read_dma_0_stage','act_stage','to_act',1)
+        pipe_template.add_edge('read_dma_1_stage','mul_quant_stage','to_mul_quant_1',1)
+        # 向量单元的输出经过流水线的延迟之后才能被下一级读取
+        pipe_template.add_edge_with_fifo('act_stage','mul_quant_stage','to_mul_quant_0',self.make_vector_fifo())
+        pipe_template.add_edge_with_fifo('mul_quant_stage','add_stage','to_add_0',self.make_vector_fifo())
+        pipe_template.add_edge('read_dma_a_stage','add_stage','to_add_1',1)
+        pipe_template.add_edge_with_fifo('add_stage','fork_stage','to_fork',self.make_vector_fifo())
+        pipe_template.add_edge('fork_stage','write_dma_0_stage','to_write_dma_0',1)
+        pipe_template.add_edge('fork_stage','write_dma_1_stage','to_write_dma_1',1)
+
+        pipe_template.build()
+        return pipe_template
+
+    def build_quant_pipe_template(self)->PipeTemplate:
+        pipe_template = PipeTemplate(self.receive_engine_config.recv_engine_width)
+
+        pipe_template.add_stage(self.l3_read_dma_helper(0),'read_dma_0_stage',perf_counter=self.get_stage_counter('read_dma_0_stage'))
+        pipe_template.add_stage(self.mul_quant_handler,'mul_quant_stage',perf_counter=self.get_stage_counter('mul_quant_stage'))
+        pipe_template.add_stage(self.fork_handler,'fork_stage',perf_counter=self.get_stage_counter('fork_stage'))
+        pipe_template.add_stage(self.l3_write_dma_helper(0),'write_dma_0_stage',is_sink=True,
+                                perf_counter=self.get_stage_counter('write_dma_0_stage'))
+
+        pipe_template.add_edge('read_dma_0_stage','mul_quant_stage','to_mul_quant_0',1)
+        pipe_template.add_edge_with_fifo('mul_quant_stage','fork_stage','to_fork',self.make_vector_fifo())
+        pipe_template.add_edge('fork_stage','write_dma_0_stage','to_write_dma_0',1)
+
+        pipe_template.build()
+        return pipe_template
+
+    def make_vector_fifo(self)->DelayFIFO:
+        return DelayFIFO(self.receive_engine_config.vector_engine_config.max_inflight_chunk,0)
+
+    def run_vector_op(self,op_config:VectorOpConfig,packet:ChunkPacket,perf_counter:StageCounter)->int:
+        """
+        等待向量单元处理完这个 chunk, 返回结果写出之前还需要的延迟
+        """
+        wait_time,occupancy = self.vector_engine.issue(op_config,packet.num_elements,packet.batch_size,
+                                                       packet.element_bytes)
+        SimModule.wait_time(SimTime(wait_time))
+        perf_counter.add_busy(occupancy)
+        return op_config.latency
 
-            # 等待流水线执行完毕
-            pipe_graph.wait_pipe_graph_finish()
+    def write_vector_output(self,output_fifo_map:PipeArg,packet:ChunkPacket,latency:int):
+        for fifo_name,fifo in output_fifo_map.items():
+            fifo.delay_write(packet,SimTime(latency))
 
-            self.current_command = None
-            SimModule.wait_time(SimTime(1))
+    def get_stage_counter(self,stage_name:str):
+        # 两种流水线中同名的流水级共用一个计数器
+        return self.perf_monitor.get_stage_counter(f'{self.perf_name}.{stage_name}')
 
 
 
-    def check_read_dma_in_use(self,read_dma_id:int)->bool:
+    def check_read_dma_in_use(self,command:ReceiveBaseCommand,read_dma_id:int)->bool:
         if read_dma_id == 0:
             return True
         elif read_dma_id == 1:
-            if self.current_command.opcode in ['RECEIVE_BIN','RECEIVE_TRI']:
+            if command.opcode in ['RECEIVE_BIN','RECEIVE_TRI']:
                 return True
         elif read_dma_id == 2:
-            if self.current_command.opcode == 'RECEIVE_TRI':
+            if command.opcode == 'RECEIVE_TRI':
                 return True
         else:
             raise ValueError
         return False
 
-    def check_write_dma_in_use(self,write_dma_id:int)->bool:
+    def check_write_dma_in_use(self,command:ReceiveBaseCommand,write_dma_id:int)->bool:
         if write_dma_id == 0:
             return True
         elif write_dma_id == 1:
-            if isinstance(self.current_command, ReceiveCommand):
-                if self.current_command.dst1_flag:
+            if isinstance(command, ReceiveCommand):
+                if command.dst1_flag:
                     return True
         else:
             raise ValueError
@@ -168,58 +364,71 @@ class ReceiveEngine(SimModule):
 
 
 
+    def read_dma_helper(self,read_dma_id:int):
+        """
+        根据指令的 src loc 选择从 l3 还是 reduce buffer 中读取
+        """
+        l3_read_dma_handler = self.l3_read_dma_helper(read_dma_id)
+        reduce_read_dma_handler = self.reduce_read_dma_helper(read_dma_id)
+
+        def read_dma_handler(command:ReceiveBaseCommand,input_fifo_map:PipeArg,output_fifo_map:PipeArg)->bool:
+            src_loc = 'l3'
+            if isinstance(command, ReceiveCommand):
+                src_loc = {0:command.src0_loc,1:command.src1_loc,2:'l3'}[read_dma_id]
+
+            if src_loc == 'l3':
+                return l3_read_dma_handler(command,input_fifo_map,output_fifo_map)
+            elif src_loc == 'reduce':
+                return reduce_read_dma_handler(command,input_fifo_map,output_fifo_map)
+            else:
+                assert False
+
+        return read_dma_handler
+
     def reduce_read_dma_helper(self,read_dma_id:int ):
         """
         暂时只支持 receive 指令的操作
         quant 指令暂时没法读取 reduce buffer
         """
 
-        def reduce_read_dma_handler(input_fifo_map:PipeArg,output_fifo_map:PipeArg)->bool:
+        def reduce_read_dma_handler(command:ReceiveBaseCommand,input_fifo_map:PipeArg,output_fifo_map:PipeArg)->bool:
             # 首先决定是否启用 这个 dma
-            if not self.check_read_dma_in_use(read_dma_id):
+            if not self.check_read_dma_in_use(command,read_dma_id):
                 return False
 
-            # 构建 port 进行连接
-            reduce_read_port = ChunkMemoryPort()
-            reduce_read_port.config_chunk_memory(self.external_reduce_memory)
-
 
-
-            if isinstance(self.current_command, ReceiveCommand):
-                src_map = {0:self.current_command.src0,1:self.current_command.src1,2:self.current_command.asrc}
+            if isinstance(command, ReceiveCommand):
+                src_map = {0:command.src0,1:command.src1,2:command.asrc}
             else:
                 raise ValueError
 
             src_addr = src_map[read_dma_id]
 
             # 该 DMA 会被使用，根据指令确定读取次数，并发送到指定的下一个队列中
-            for i in range(self.current_command.chunk_num):
-                # 读取一个chunk的数据
-
-                enable_free = self.current_command.free0 if read_dma_id == 0 else self.current_command.free1
-
-                chunk_data = reduce_read_port.read(src_addr+i,
-                                                   self.current_command.redcount,
-                                                   enable_free,
-                                                   self.current_command.chunk_size,
-                                                   self.current_command.batch_size,
-                                                   2) # reduce 固定是 fp32
-                packet = ChunkPacket(
+            enable_free = command.free0 if read_dma_id == 0 else command.free1
+
+            def forward_chunk(i:int,chunk_data,finish_time:int):
+                packet = make_chunk_packet(
                     chunk_data,
-                    self.current_command.chunk_size,
-                    self.current_command.batch_size,
+                    command.chunk_size,
+                    command.batch_size,
                     2
                 )
 
                 # 根据指令的情况，向后面的部件转发数据
                 # TODO 暂时简单操作， 直接向所有的 fifo 发送， 看看会不会有问题
                 for output_fifo_name,output_fifo in output_fifo_map.items():
-                    output_fifo.write(packet)
+                    deliver_chunk(output_fifo,packet,finish_time)
 
-                # 开启下一次的操作
+            burst_read(reduce_read_port,src_addr,command.chunk_num,command.redcount,enable_free,
+                       command.chunk_size,command.batch_size,2,forward_chunk) # reduce 固定是 fp32
 
             return False
 
+        # 流水线常驻, port 只需要构建一次
+        reduce_read_port = self.perf_monitor.make_memory_port(self.external_reduce_memory,
+                                                              f'{self.perf_name}.{read_dma_stage_name_dict[read_dma_id]}')
+
         return reduce_read_dma_handler
 
 
@@ -227,153 +436,146 @@ class ReceiveEngine(SimModule):
     def l3_read_dma_helper(self,read_dma_id):
 
 
-        def l3_read_dma_handler(input_fifo_map:PipeArg,output_fifo_map:PipeArg)->bool:
+        def l3_read_dma_handler(command:ReceiveBaseCommand,input_fifo_map:PipeArg,output_fifo_map:PipeArg)->bool:
 
-            if not self.check_read_dma_in_use(read_dma_id):
+            if not self.check_read_dma_in_use(command,read_dma_id):
                 return False
 
-            l3_read_port = ChunkMemoryPort()
-            l3_read_port.config_chunk_memory(self.external_l3_memory)
-
-            if isinstance(self.current_command, ReceiveCommand):
-                src_map = {0:self.current_command.src0,1:self.current_command.src1,2:self.current_command.asrc}
-            elif isinstance(self.current_command, QuantCommand):
-                src_map = {0:self.current_command.src}
+            if isinstance(command, ReceiveCommand):
+                src_map = {0:command.src0,1:command.src1,2:command.asrc}
+            elif isinstance(command, QuantCommand):
+                src_map = {0:command.src}
             else:
                 raise ValueError
 
             src_addr = src_map[read_dma_id]
 
-            for i in range(self.current_command.chunk_num):
-                if isinstance(self.current_command, ReceiveCommand):
-                    enable_free = {0:self.current_command.free0,1:self.current_command.free1,3:self.current_command.afree}[read_dma_id]
-                    element_bytes = element_bytes_dict[{0:self.current_command.src0_dtype,1:self.current_command.src1_dtype,3:self.current_command.adtype}[read_dma_id]]
-
-                    chunk_data = l3_read_port.read(src_addr+i,
-                                                   1,
-                                                   enable_free,
-                                                   self.current_command.chunk_size,
-                                                   self.current_command.batch_size,
-                                                   element_bytes
-                                                   )
-
-                    packet = ChunkPacket(
-                        chunk_data,
-                        self.current_command.chunk_size,
-                        self.current_command.batch_size,
-                        element_bytes
-                    )
-
-
-                elif isinstance(self.current_command, QuantCommand):
-                    enable_free = self.current_command.free
-                    element_bytes = element_bytes_dict[self.current_command.src_dtype]
-                    chunk_data = l3_read_port.read(src_addr+i,
-                                                   1,
-                                                   enable_free,
-                                                   self.current_command.chunk_size,
-                                                   self.current_command.batch_size,
-                                                   element_bytes
-                                                   )
-                    packet = ChunkPacket(
-                        chunk_data,
-                        self.current_command.chunk_size,
-                        self.current_command.batch_size,
-                        element_bytes
-                    )
+            if isinstance(command, ReceiveCommand):
+                enable_free = {0:command.free0,1:command.free1,2:command.afree}[read_dma_id]
+                element_bytes = element_bytes_dict[{0:command.src0_dtype,1:command.src1_dtype,2:command.adtype}[read_dma_id]]
+            elif isinstance(command, QuantCommand):
+                enable_free = command.free
+                element_bytes = element_bytes_dict[command.src_dtype]
+            else:
+                raise ValueError
 
-                else:
-                    raise ValueError
+            def forward_chunk(i:int,chunk_data,finish_time:int):
+                packet = make_chunk_packet(
+                    chunk_data,
+                    command.chunk_size,
+                    command.batch_size,
+                    element_bytes
+                )
 
                 for fifo_name,fifo in output_fifo_map.items():
-                    fifo.write(packet)
+                    deliver_chunk(fifo,packet,finish_time)
+
+            burst_read(l3_read_port,src_addr,command.chunk_num,1,enable_free,
+                       command.chunk_size,command.batch_size,element_bytes,forward_chunk)
 
             return False
 
 
+        l3_read_port = self.perf_monitor.make_memory_port(self.external_l3_memory,
+                                                          f'{self.perf_name}.{read_dma_stage_name_dict[read_dma_id]}')
+
         return l3_read_dma_handler
 
     def l3_write_dma_helper(self,write_dma_id):
 
-        def l3_write_dma_handler(input_fifo_map:PipeArg,output_fifo_map:PipeArg)->bool:
-            if not self.check_write_dma_in_use(write_dma_id):
+        def l3_write_dma_handler(command:ReceiveBaseCommand,input_fifo_map:PipeArg,output_fifo_map:PipeArg)->bool:
+            if not self.check_write_dma_in_use(command,write_dma_id):
                 return False
 
-            l3_write_port = ChunkMemoryPort()
-            l3_write_port.config_chunk_memory(self.external_l3_memory)
-
             input_fifo = input_fifo_map[f'to_write_dma_{write_dma_id}']
 
             write_addr = 0
 
-            if isinstance(self.current_command, ReceiveCommand):
+            if isinstance(command, ReceiveCommand):
                 if write_dma_id == 0 :
-                    write_addr = self.current_command.dst0
+                    write_addr = command.dst0
                 elif write_dma_id == 1 :
-                    write_addr = self.current_command.dst1
-            elif isinstance(self.current_command, QuantCommand):
-                write_addr = self.current_command.dstq
+                    write_addr = command.dst1
+            elif isinstance(command, QuantCommand):
+                write_addr = command.dstq
             else:
                 raise ValueError
 
 
-            for i in range(self.current_command.chunk_num):
-                chunk_packet:ChunkPacket = input_fifo.read()
+            # 目的地址在其他 chip 上的时候, 交给片间网络发送
+            dst_chip = command.dst_chip if isinstance(command, ReceiveCommand) else -1
+            remote_write = dst_chip >= 0 and dst_chip != self.chip_id
 
+            if remote_write:
+                # 等待目的 chip 确认全部写入之后这条指令才完成
+                remote_write_ack = self.external_system.make_remote_write_ack(self.chip_id,dst_chip,command.chunk_num)
+                for i in range(command.chunk_num):
+                    chunk_packet:ChunkPacket = input_fifo.read()
+                    self.external_system.send_packet(self.chip_id,
+                                                     InterChipPacket(dst_chip,'l3',write_addr+i,chunk_packet,
+                                                                     remote_write_ack))
+                remote_write_ack.wait()
+                return False
 
-                l3_write_port.write(write_addr+i,
-                                    chunk_packet.payload,
-                                    True,
-                                    chunk_packet.num_elements,
-                                    chunk_packet.batch_size,
-                                    chunk_packet.element_bytes)
-
+            burst_write_from_fifo(l3_write_port,input_fifo,write_addr,command.chunk_num,True,
+                                  lambda chunk_packet:chunk_packet.payload)
 
             return False
 
 
+        l3_write_port = self.perf_monitor.make_memory_port(self.external_l3_memory,
+                                                           f'{self.perf_name}.write_dma_{write_dma_id}_stage')
+
         return l3_write_dma_handler
 
 
-    def act_handler(self,input_fifo_map:PipeArg,output_fifo_map:PipeArg)->bool:
+    def act_handler(self,command:ReceiveBaseCommand,input_fifo_map:PipeArg,output_fifo_map:PipeArg)->bool:
 
         input_fifo = input_fifo_map['to_act']
-        for i in range(self.current_command.chunk_num):
+        act_counter = self.get_stage_counter('act_stage')
+        for i in range(command.chunk_num):
             packet = input_fifo.read()
 
-            if isinstance(self.current_command, ReceiveCommand):
-                if self.current_command.act:
-                    SimModule.wait_time(SimTime(100)) # TODO 修正为正确的时间
+            latency = 0
+            if isinstance(command, ReceiveCommand):
+                if command.act:
+                    latency = self.run_vector_op(self.vector_engine.get_act_op(command.act),packet,act_counter)
             else:
                 raise ValueError
 
 
-            for fifo_name,fifo in output_fifo_map.items():
-                fifo.write(packet)
+            self.write_vector_output(output_fifo_map,packet,latency)
 
         return False
 
-    def mul_quant_handler(self,input_fifo_map:PipeArg,output_fifo_map:PipeArg)->bool:
+    def mul_quant_handler(self,command:ReceiveBaseCommand,input_fifo_map:PipeArg,output_fifo_map:PipeArg)->bool:
 
         input_from_act = input_fifo_map['to_mul_quant_0']
-        input_from_dma = input_fifo_map['to_mul_quant_1']
+        # quant 的流水线中没有这个输入
+        input_from_dma = input_fifo_map.get('to_mul_quant_1')
+        mul_quant_counter = self.get_stage_counter('mul_quant_stage')
+
+        vector_engine_config = self.receive_engine_config.vector_engine_config
 
-        for i in range(self.current_command.chunk_num):
-            if isinstance(self.current_command, ReceiveCommand):
-                if self.current_command.mul:
+        for i in range(command.chunk_num):
+            latency = 0
+            if isinstance(command, ReceiveCommand):
+                if command.mul:
                     packet_from_act = input_from_act.read()
                     packet_from_dma = input_from_dma.read()
 
                     packet = packet_from_act
-                    SimModule.wait_time(SimTime(100))  # TODO 修正为正确的时间
+                    latency = self.run_vector_op(vector_engine_config.mul_op,packet,mul_quant_counter)
 
                 else:
                     packet_from_act = input_from_act.read()
                     packet = packet_from_act
 
-            elif isinstance(self.current_command, QuantCommand):
+            elif isinstance(command, QuantCommand):
                 packet_from_act:ChunkPacket = input_from_act.read()
-                packet = ChunkPacket(
+                # 按照输入的大小计算量化的开销
+                latency = self.run_vector_op(vector_engine_config.quant_op,packet_from_act,mul_quant_counter)
+                packet = make_chunk_packet(
                     packet_from_act.payload,
                     packet_from_act.num_elements,
                     packet_from_act.batch_size,
@@ -382,71 +584,73 @@ class ReceiveEngine(SimModule):
             else:
                 raise ValueError
 
-            for fifo_name,fifo in output_fifo_map.items():
-                fifo.write(packet)
+            self.write_vector_output(output_fifo_map,packet,latency)
 
 
         return False
 
-    def add_handler(self,input_fifo_map:PipeArg,output_fifo_map:PipeArg)->bool:
+    def add_handler(self,command:ReceiveBaseCommand,input_fifo_map:PipeArg,output_fifo_map:PipeArg)->bool:
 
         input_from_mul_quant = input_fifo_map['to_add_0']
         input_from_dma = input_fifo_map['to_add_1']
-        for i in range(self.current_command.chunk_num):
-            if isinstance(self.current_command, ReceiveCommand):
-                if self.current_command.add:
+        add_counter = self.get_stage_counter('add_stage')
+        for i in range(command.chunk_num):
+            latency = 0
+            if isinstance(command, ReceiveCommand):
+                if command.add:
                     packet_from_mul_quant = input_from_mul_quant.read()
                     packet_from_dma = input_from_dma.read()
                     packet = packet_from_mul_quant
+                    latency = self.run_vector_op(self.receive_engine_config.vector_engine_config.add_op,
+                                                 packet,add_counter)
                 else:
                     packet_from_mul_quant = input_from_mul_quant.read()
                     packet = packet_from_mul_quant
-            elif isinstance(self.current_command, QuantCommand):
+            elif isinstance(command, QuantCommand):
                 # 直接转发
                 packet = input_from_mul_quant.read()
 
             else:
                 raise ValueError
 
-            for fifo_name,fifo in output_fifo_map.items():
-                fifo.write(packet)
+            self.write_vector_output(output_fifo_map,packet,latency)
 
         return False
 
 
-    def fork_handler(self,input_fifo_map:PipeArg,output_fifo_map:PipeArg)->bool:
+    def fork_handler(self,command:ReceiveBaseCommand,input_fifo_map:PipeArg,output_fifo_map:PipeArg)->bool:
 
         input_fifo = input_fifo_map['to_fork']
 
         output_fifo_0 = output_fifo_map['to_write_dma_0']
-        output_fifo_1 = output_fifo_map['to_write_dma_1']
+        output_fifo_1 = output_fifo_map.get('to_write_dma_1')
 
-        for i in range(self.current_command.chunk_num):
+        for i in range(command.chunk_num):
             packet:ChunkPacket = input_fifo.read()
 
-            if isinstance(self.current_command, ReceiveCommand):
+            if isinstance(command, ReceiveCommand):
                 # 不是很懂， 这里还可以改变数据类型
 
-                packet_0 = ChunkPacket(
+                packet_0 = make_chunk_packet(
                     packet.payload,
                     packet.num_elements,
                     packet.batch_size,
-                    element_bytes_dict[self.current_command.dst0_type]
+                    element_bytes_dict[command.dst0_type]
                 )
 
-                if self.current_command.dst1_flag:
-                    packet_1 = ChunkPacket(
+                if command.dst1_flag:
+                    packet_1 = make_chunk_packet(
                         packet.payload,
                         packet.num_elements,
                         packet.batch_size,
-                        element_bytes_dict[self.current_command.dst1_type]
+                        element_bytes_dict[command.dst1_type]
                     )
 
                     output_fifo_1.write(packet_1)
 
                 output_fifo_0.write(packet_0)
 
-            elif isinstance(self.current_command, QuantCommand):
+            elif isinstance(command, QuantCommand):
                 output_fifo_0.write(packet)
             else:
                 raise ValueError
@@ -457,6 +661,13 @@ class ReceiveEngine(SimModule):
         self.external_reduce_memory = reduce_memory
         self.external_l3_memory = l3_memory
 
+    def config_perf_monitor(self,perf_monitor:PerfMonitor):
+        self.perf_monitor = perf_monitor
+
+    def config_inter_chip(self,chip_id:int,system:System):
+        self.chip_id = chip_id
+        self.external_system = system
+
 
 
 
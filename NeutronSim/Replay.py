@@ -0,0 +1,251 @@
+from __future__ import annotations
+
+import copy
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+from Desim.Core import SimSession
+
+from NeutronSim.Chip import Chip
+from NeutronSim.Commands import SendCommand, ReceiveBaseCommand, ComputeCommand
+from NeutronSim.ReceiveEngine import get_address_range
+from NeutronSim.Sampling import split_block, detect_block_num, normalize_block
+from NeutronSim.Sweep import SweepPoint, build_chip
+from NeutronSim.Utils import get_sim_cycle
+
+"""
+基于相同指令块记忆化的完成时间估计, 结果不是完整仿真的时间
+trace 按块切分, 每个块在一个新的 SimSession 中从空闲的 engine 开始单独仿真, memory 的初始状态来自上一个块结束时的状态
+块的 key = 按 memory 空间归一化地址之后的指令 + 块访问的地址上已有的 tag 及其值
+命中的时候直接加上缓存的时间, 并把缓存的 memory tag 变化平移到当前的基地址上
+没有命中的时候也只是单独仿真这个块, 不是退回完整仿真:
+- 块与块之间串行执行, 上一个块的 RECEIVE 与下一个块的 SEND / COMPUTE 不会重叠
+- link / FIFO / 流水线等 engine 的状态不在 key 中, 每个块都从空闲的状态开始
+所以估计值是完整仿真的一个上界, ReplayConfig.measure_bias 打开的时候同时做一次完整仿真, 报告估计值的偏差
+"""
+
+
+MemoryState = dict[str,dict[int,Any]]
+
+
+@dataclass
+class ReplayConfig:
+    # 为 None 的时候自动找出最多可以分成多少个相同的块
+    block_num:Optional[int] = None
+    cache_size:int = 64
+    # 同时做一次完整仿真, 报告估计值相对完整仿真的偏差
+    measure_bias:bool = False
+
+
+@dataclass
+class BlockRecord:
+    time_delta:int
+    # memory 名字 -> {相对地址: 新的 tag}, 值为 None 表示这个地址的 tag 被删除
+    memory_diff:dict[str,dict[int,Any]] = field(default_factory=dict)
+
+
+def get_block_range_list(send_command_list:list[SendCommand],receive_command_list:list[ReceiveBaseCommand],
+                         compute_command_list:list[ComputeCommand])->list[tuple[str,str,int,int]]:
+    """
+    块中所有指令访问的地址范围 (memory 名字, 地址空间, 起始地址, 结束地址)
+    所有 atom 的 l2 共用一个地址空间, 平移的时候使用同一个基地址
+    """
+    range_list:list[tuple[str,str,int,int]] = []
+
+    for command in send_command_list:
+        range_list.append(('l3','l3',command.src,command.src+command.chunk_num))
+        for atom_id in command.group_id:
+            range_list.append((f'l2-{atom_id}','l2',command.dst,command.dst+command.chunk_num))
+
+    for command in compute_command_list:
+        for atom_id in command.group_id:
+            range_list.append((f'l2-{atom_id}','l2',command.src,command.src+command.src_chunk_num))
+            range_list.append((f'l2-{atom_id}','l2',command.dst,command.dst+command.dst_chunk_num))
+        reduce_chunk_num = (max(command.redid[atom_id] for atom_id in command.group_id) + 1) * command.dst_chunk_num
+        range_list.append(('reduce','reduce',command.reddst,command.reddst+reduce_chunk_num))
+
+    for command in receive_command_list:
+        # 与 ReceiveEngine 检查指令之间冲突使用的地址范围相同
+        read_range_list,write_range_list = get_address_range(command)
+        for loc,start,stop in read_range_list + write_range_list:
+            range_list.append((loc,loc,start,stop))
+
+    return range_list
+
+
+def get_space_base_dict(range_list:list[tuple[str,str,int,int]])->dict[str,int]:
+    base_dict:dict[str,int] = {}
+    for memory_name,space,start,stop in range_list:
+        base_dict[space] = min(base_dict.get(space,start),start)
+    return base_dict
+
+
+def get_memory_space(memory_name:str)->str:
+    return 'l2' if memory_name.startswith('l2-') else memory_name
+
+
+def get_chip_memory_dict(chip:Chip)->dict[str,Any]:
+    memory_dict:dict[str,Any] = {'l3':chip.l3_memory,'reduce':chip.reduce_memory}
+    for atom_id,atom_instance in chip.atom_manager.atom_instance_dict.items():
+        memory_dict[f'l2-{atom_id}'] = atom_instance.atom_die.l2_memory
+    return memory_dict
+
+
+class BlockReplayEstimator:
+    """
+    按块推进整个 trace, 维护块边界上的 memory 状态和 LRU 缓存, 估计整个 trace 的完成时间
+    """
+
+    def __init__(self,point:SweepPoint,replay_config:ReplayConfig=ReplayConfig()):
+        self.point = point
+        self.replay_config = replay_config
+
+        self.block_cache:OrderedDict[tuple,BlockRecord] = OrderedDict()
+        self.hit_num:int = 0
+        self.miss_num:int = 0
+
+        self.memory_state:MemoryState = {}
+        self.current_time:int = 0
+
+    def lookup(self,key:tuple)->Optional[BlockRecord]:
+        record = self.block_cache.get(key)
+        if record is not None:
+            self.block_cache.move_to_end(key)
+        return record
+
+    def insert(self,key:tuple,record:BlockRecord):
+        self.block_cache[key] = record
+        if len(self.block_cache) > self.replay_config.cache_size:
+            self.block_cache.popitem(last=False)
+
+    def init_memory_state(self,preload_function:Optional[Callable[[Chip],None]]):
+        SimSession.reset()
+        SimSession.init()
+        chip = build_chip(self.point)
+        if preload_function is not None:
+            preload_function(chip)
+        self.memory_state = {memory_name:dict(memory.memory_tag)
+                             for memory_name,memory in get_chip_memory_dict(chip).items()}
+
+    def get_touched_state(self,range_list:list[tuple[str,str,int,int]])->dict[str,dict[int,Any]]:
+        touched_state:dict[str,dict[int,Any]] = {}
+        for memory_name,space,start,stop in range_list:
+            memory_tag = self.memory_state.get(memory_name,{})
+            touched_tag = touched_state.setdefault(memory_name,{})
+            for addr in range(start,stop):
+                if addr in memory_tag:
+                    touched_tag[addr] = memory_tag[addr]
+        return touched_state
+
+    def simulate_block(self,block_tuple:tuple[list,list,list],touched_state:dict[str,dict[int,Any]],
+                       base_dict:dict[str,int])->BlockRecord:
+        SimSession.reset()
+        SimSession.init()
+
+        chip = build_chip(self.point)
+        memory_dict = get_chip_memory_dict(chip)
+        # 只写入块会访问的地址, 之后按对象是否被替换找出块修改过的 tag
+        seed_state = copy.deepcopy(touched_state)
+        for memory_name,memory_tag in seed_state.items():
+            memory_dict[memory_name].memory_tag.update(memory_tag)
+
+        send_block,receive_block,compute_block = block_tuple
+        chip.load_command(send_block,receive_block,compute_block)
+        SimSession.scheduler.run()
+
+        memory_diff:dict[str,dict[int,Any]] = {}
+        for memory_name,memory in memory_dict.items():
+            base = base_dict.get(get_memory_space(memory_name),0)
+            before_tag = seed_state.get(memory_name,{})
+            after_tag = dict(memory.memory_tag)
+
+            diff:dict[int,Any] = {}
+            for addr,value in after_tag.items():
+                if addr not in before_tag or before_tag[addr] is not value:
+                    diff[addr - base] = value
+            for addr in before_tag:
+                if addr not in after_tag:
+                    diff[addr - base] = None
+            if diff:
+                memory_diff[memory_name] = diff
+
+        return BlockRecord(get_sim_cycle(),memory_diff)
+
+    def apply(self,record:BlockRecord,base_dict:dict[str,int]):
+        self.current_time += record.time_delta
+        for memory_name,diff in record.memory_diff.items():
+            base = base_dict.get(get_memory_space(memory_name),0)
+            memory_tag = self.memory_state.setdefault(memory_name,{})
+            for offset,value in diff.items():
+                if value is None:
+                    memory_tag.pop(base + offset,None)
+                else:
+                    memory_tag[base + offset] = copy.deepcopy(value)
+
+    def run(self,send_command_list:list[SendCommand],receive_command_list:list[ReceiveBaseCommand],
+            compute_command_list:list[ComputeCommand],
+            preload_function:Optional[Callable[[Chip],None]]=None)->dict[str,Any]:
+        block_num = self.replay_config.block_num
+        if block_num is None:
+            block_num = detect_block_num(send_command_list,receive_command_list,compute_command_list)
+
+        start_time = time.perf_counter()
+        self.init_memory_state(preload_function)
+
+        block_list = list(zip(split_block(send_command_list,block_num),
+                              split_block(receive_command_list,block_num),
+                              split_block(compute_command_list,block_num)))
+        for block_tuple in block_list:
+            range_list = get_block_range_list(*block_tuple)
+            base_dict = get_space_base_dict(range_list)
+            touched_state = self.get_touched_state(range_list)
+
+            # tag 的值 (写入次数) 也是 key 的一部分, 例如 reduce 累加到第几次会影响块中 RECEIVE 的等待
+            tag_set = frozenset((memory_name,addr - base_dict[get_memory_space(memory_name)],value)
+                                for memory_name,memory_tag in touched_state.items()
+                                for addr,value in memory_tag.items())
+            key = (tuple(normalize_block(command_list,base_dict) for command_list in block_tuple),tag_set)
+
+            record = self.lookup(key)
+            if record is None:
+                self.miss_num += 1
+                record = self.simulate_block(block_tuple,touched_state,base_dict)
+                self.insert(key,record)
+            else:
+                self.hit_num += 1
+            self.apply(record,base_dict)
+
+        result = self.report(block_num,time.perf_counter() - start_time)
+        if self.replay_config.measure_bias:
+            simulated_time = self.simulate_full(send_command_list,receive_command_list,compute_command_list,
+                                                preload_function)
+            result['simulated_time'] = simulated_time
+            result['bias'] = self.current_time - simulated_time
+            result['relative_bias'] = result['bias'] / simulated_time if simulated_time > 0 else 0.0
+        return result
+
+    def simulate_full(self,send_command_list:list[SendCommand],receive_command_list:list[ReceiveBaseCommand],
+                      compute_command_list:list[ComputeCommand],
+                      preload_function:Optional[Callable[[Chip],None]])->int:
+        SimSession.reset()
+        SimSession.init()
+        chip = build_chip(self.point)
+        chip.load_command(send_command_list,receive_command_list,compute_command_list)
+        if preload_function is not None:
+            preload_function(chip)
+        SimSession.scheduler.run()
+        return get_sim_cycle()
+
+    def report(self,block_num:int,wall_time:float)->dict[str,Any]:
+        access_num = self.hit_num + self.miss_num
+        return {
+            'block_num':block_num,
+            'estimate':self.current_time,
+            'hit_num':self.hit_num,
+            'miss_num':self.miss_num,
+            'hit_rate':self.hit_num / access_num if access_num > 0 else 0.0,
+            'cache_size':len(self.block_cache),
+            'wall_time':wall_time,
+        }
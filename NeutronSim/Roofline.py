@@ -0,0 +1,457 @@
+from __future__ import annotations
+
+import heapq
+import math
+from dataclasses import dataclass, field
+from typing import Any, Iterable, Optional
+
+from NeutronSim.Commands import SendCommand, ComputeCommand, ReceiveBaseCommand, ReceiveCommand, QuantCommand
+from NeutronSim.Config import LinkConfig, MemoryConfig, AtomConfig, TopologyConfig, element_bytes_dict
+from NeutronSim.Link import D2DLinkModel
+from NeutronSim.VectorEngine import VectorEngine, VectorEngineConfig
+
+"""
+不进行事件仿真的解析模型, 用于快速筛选设计点
+对每个 chunk 按照流水线的递推关系算出完成时间:
+    每一级的完成时间 = max(上一个 chunk 在这一级的完成时间, 这个 chunk 在上一级的完成时间, 数据就绪的时间) + 这一级的耗时
+数据依赖通过地址追踪: l3 / 每个 atom 的 l2 / reduce 中每个 chunk 的就绪时间
+最后与各个资源的总占用时间 (roofline) 取最大值
+没有模拟 FIFO 的反压和 memory 端口的竞争, 所以一般会偏乐观
+"""
+
+
+@dataclass
+class RooflineConfig:
+    d2d_link_config:LinkConfig = field(default_factory=LinkConfig)
+    l2_memory_config:MemoryConfig = field(default_factory=MemoryConfig)
+    l3_memory_config:MemoryConfig = field(default_factory=MemoryConfig)
+    reduce_memory_config:MemoryConfig = field(default_factory=MemoryConfig)
+    atom_config:AtomConfig = field(default_factory=AtomConfig)
+    topology_config:TopologyConfig = field(default_factory=TopologyConfig)
+
+    # 与 ReceiveEngineConfig 中的向量单元配置保持一致
+    vector_engine_config:VectorEngineConfig = field(default_factory=VectorEngineConfig)
+
+
+def memory_time(chunk_bytes:int,memory_config:MemoryConfig)->int:
+    return math.ceil(chunk_bytes / memory_config.bandwidth)
+
+
+class RooflineEstimator:
+    def __init__(self,config:RooflineConfig=RooflineConfig()):
+        self.config = config
+        topology_config = config.topology_config
+
+        # 地址 -> 就绪时间, 没有记录的地址认为一开始就已经就绪 (预先写入的数据)
+        self.l3_ready_dict:dict[int,int] = {}
+        self.l2_ready_dict:dict[tuple[int,int],int] = {}
+        # reduce 需要等到所有的写入完成, 记录 (最后一次写入的时间, 写入次数)
+        self.reduce_ready_dict:dict[int,list[int]] = {}
+
+        # 地址上当前有效的版本数 (只包含被写入或者释放过的地址), 以及还没有被处理的写入次数
+        self.l3_valid_dict:dict[int,int] = {}
+        self.l2_valid_dict:dict[tuple[int,int],int] = {}
+        self.pending_l3_write_dict:dict[int,int] = {}
+        self.pending_l2_write_dict:dict[tuple[int,int],int] = {}
+
+        # 各个部件下一次空闲的时间
+        self.sub_send_engine_heap:list[int] = [0]*topology_config.num_sub_send_engine
+        self.link_free_dict:dict[int,int] = {}
+        self.send_link_model_dict:dict[int,D2DLinkModel] = {}
+        # 返回方向的 link 与发送方向一样按照 atom_link_map 共用
+        self.store_link_model_dict:dict[int,D2DLinkModel] = {
+            topology_config.get_link_id(atom_id):D2DLinkModel(config.d2d_link_config)
+            for atom_id in range(topology_config.num_atoms)
+        }
+        self.fetch_free_dict:dict[int,int] = {atom_id:0 for atom_id in range(topology_config.num_atoms)}
+        self.compute_free_dict:dict[int,int] = {atom_id:0 for atom_id in range(topology_config.num_atoms)}
+        self.store_free_dict:dict[int,int] = {atom_id:0 for atom_id in range(topology_config.num_atoms)}
+        self.receive_free_time:int = 0
+        # 只用来计算每个 chunk 占用向量单元的时间
+        self.vector_engine = VectorEngine(config.vector_engine_config)
+
+        # 各个资源的总占用时间
+        self.resource_busy_dict:dict[str,int] = {}
+
+        # 每条指令的下界 (只考虑自身, 不考虑依赖和竞争)
+        self.command_bound_list:list[tuple[str,int]] = []
+
+        self.finish_time:int = 0
+
+    def add_busy(self,resource:str,busy_time:int):
+        self.resource_busy_dict[resource] = self.resource_busy_dict.get(resource,0) + busy_time
+
+    def get_link_id(self,atom_id:int)->int:
+        return self.config.topology_config.get_link_id(atom_id)
+
+    def get_link_atom_dict(self,group_id:list[int])->dict[int,list[int]]:
+        link_atom_dict:dict[int,list[int]] = {}
+        for atom_id in group_id:
+            link_atom_dict.setdefault(self.get_link_id(atom_id),[]).append(atom_id)
+        return link_atom_dict
+
+    def estimate_send(self,command:SendCommand):
+        config = self.config
+        link_config = config.d2d_link_config
+        chunk_bytes = command.chunk_size * command.batch_size * element_bytes_dict[command.dtype]
+        l3_time = memory_time(chunk_bytes,config.l3_memory_config)
+        l2_time = memory_time(chunk_bytes,config.l2_memory_config)
+
+        link_atom_dict = self.get_link_atom_dict(command.group_id)
+
+        # 最早空闲的 sub send engine, 以及这一组 link 都空闲的时间
+        engine_free_time = heapq.heappop(self.sub_send_engine_heap)
+        start_time = max([engine_free_time] + [self.link_free_dict.get(link_id,0) for link_id in link_atom_dict])
+
+        finish_time = start_time
+        read_time = start_time
+        write_time_dict:dict[int,int] = {atom_id:start_time for atom_id in command.group_id}
+        for link_id in link_atom_dict:
+            link_model = self.send_link_model_dict.setdefault(link_id,D2DLinkModel(link_config))
+            link_model.link_free_time = max(link_model.link_free_time,start_time)
+
+        for i in range(command.chunk_num):
+            read_time = max(read_time,self.l3_ready_dict.get(command.src+i,0)) + l3_time
+
+            for link_id,atom_id_list in link_atom_dict.items():
+                link_model = self.send_link_model_dict[link_id]
+                for atom_id in atom_id_list:
+                    arrive_time = link_model.transfer(read_time,chunk_bytes)
+                    write_time = max(write_time_dict[atom_id],arrive_time) + l2_time
+                    write_time_dict[atom_id] = write_time
+                    self.l2_ready_dict[(atom_id,command.dst+i)] = write_time
+                    finish_time = max(finish_time,write_time)
+
+        for link_id,atom_id_list in link_atom_dict.items():
+            self.link_free_dict[link_id] = finish_time
+            self.add_busy(f'link-{link_id}',command.chunk_num * len(atom_id_list) * math.ceil(chunk_bytes/link_config.bandwidth))
+        self.add_busy('l3',command.chunk_num * l3_time)
+
+        heapq.heappush(self.sub_send_engine_heap,finish_time + 1)
+        self.command_bound_list.append((command.opcode,link_config.link_latency + command.chunk_num * max(
+            l3_time,max(len(atom_id_list) for atom_id_list in link_atom_dict.values()) * math.ceil(chunk_bytes/link_config.bandwidth))))
+        self.finish_time = max(self.finish_time,finish_time)
+
+    def estimate_compute(self,command:ComputeCommand):
+        config = self.config
+        atom_config = config.atom_config
+        link_config = config.d2d_link_config
+
+        src_bytes = command.src_chunk_size * command.batch_size * element_bytes_dict[command.src_dtype]
+        dst_bytes = command.dst_chunk_size * command.batch_size * 4
+        src_l2_time = memory_time(src_bytes,config.l2_memory_config)
+        dst_l2_time = memory_time(dst_bytes,config.l2_memory_config)
+        reduce_time = memory_time(dst_bytes,config.reduce_memory_config)
+
+        ops = command.src_chunk_size * command.dst_chunk_size
+        chunk_latency = math.ceil(ops / atom_config.single_batch_OPS) * command.dst_chunk_num
+
+        for atom_id in command.group_id:
+            fetch_time = self.fetch_free_dict[atom_id]
+            compute_time = self.compute_free_dict[atom_id]
+            for i in range(command.src_chunk_num):
+                fetch_time = max(fetch_time,self.l2_ready_dict.get((atom_id,command.src+i),0)) + src_l2_time
+                compute_time = max(compute_time,fetch_time) + chunk_latency
+            self.fetch_free_dict[atom_id] = fetch_time
+            self.add_busy(f'atom-{atom_id}',command.src_chunk_num * chunk_latency)
+
+            if command.last_acc:
+                # 写回 l2, 再通过 link 写入 reduce
+                store_time = max(self.store_free_dict[atom_id],compute_time)
+                link_model = self.store_link_model_dict[self.get_link_id(atom_id)]
+                reduce_addr = command.reddst + command.redid[atom_id] * command.dst_chunk_num
+                write_time = compute_time
+                for j in range(command.dst_chunk_num):
+                    compute_time += dst_l2_time
+                    store_time = max(store_time,compute_time) + dst_l2_time
+                    arrive_time = link_model.transfer(store_time,dst_bytes)
+                    write_time = max(write_time,arrive_time) + reduce_time
+
+                    ready = self.reduce_ready_dict.setdefault(reduce_addr+j,[0,0])
+                    ready[0] = max(ready[0],write_time)
+                    ready[1] += 1
+
+                self.store_free_dict[atom_id] = write_time
+                self.add_busy('reduce',command.dst_chunk_num * reduce_time)
+                self.finish_time = max(self.finish_time,write_time)
+
+            self.compute_free_dict[atom_id] = compute_time
+            self.finish_time = max(self.finish_time,compute_time)
+
+        self.command_bound_list.append((command.opcode,command.src_chunk_num * chunk_latency
+                                        + command.dst_chunk_num * (dst_l2_time + reduce_time) + link_config.link_latency))
+
+    def get_receive_source_list(self,command:ReceiveBaseCommand)->list[tuple[str,int,int]]:
+        """
+        (loc, 地址, 每个 chunk 的字节数)
+        """
+        chunk_elements = command.chunk_size * command.batch_size
+        if isinstance(command,ReceiveCommand):
+            source_list = [(command.src0_loc,command.src0,
+                            chunk_elements * (2 if command.src0_loc == 'reduce' else element_bytes_dict[command.src0_dtype]))]
+            if command.opcode in ['RECEIVE_BIN','RECEIVE_TRI']:
+                source_list.append((command.src1_loc,command.src1,
+                                    chunk_elements * (2 if command.src1_loc == 'reduce' else element_bytes_dict[command.src1_dtype])))
+            if command.opcode == 'RECEIVE_TRI':
+                source_list.append(('l3',command.asrc,chunk_elements * element_bytes_dict[command.adtype]))
+            return source_list
+        elif isinstance(command,QuantCommand):
+            return [('l3',command.src,chunk_elements * element_bytes_dict[command.src_dtype])]
+        raise ValueError
+
+    def estimate_receive(self,command:ReceiveBaseCommand):
+        config = self.config
+        chunk_elements = command.chunk_size * command.batch_size
+
+        source_list = self.get_receive_source_list(command)
+        dst_list = self.get_receive_dst_list(command)
+
+        # 向量单元: 每个 chunk 的占用时间串行累加, 流水线深度只影响结果写出的时间
+        vector_engine_config = config.vector_engine_config
+        if isinstance(command,ReceiveCommand):
+            op_list = []
+            if command.act:
+                op_list.append(self.vector_engine.get_act_op(command.act))
+            if command.mul:
+                op_list.append(vector_engine_config.mul_op)
+            if command.add:
+                op_list.append(vector_engine_config.add_op)
+        else:
+            op_list = [vector_engine_config.quant_op]
+
+        element_bytes = source_list[0][2] // chunk_elements
+        stage_occupancy = sum(self.vector_engine.get_occupancy(op_config,command.chunk_size,command.batch_size,element_bytes)
+                              for op_config in op_list)
+        stage_latency = sum(op_config.latency for op_config in op_list)
+
+        start_time = self.receive_free_time
+        read_time_list = [start_time]*len(source_list)
+        stage_time = start_time
+        write_time_list = [start_time]*len(dst_list)
+        finish_time = start_time
+
+        for i in range(command.chunk_num):
+            ready_time = 0
+            for source_id,(loc,addr,chunk_bytes) in enumerate(source_list):
+                if loc == 'reduce':
+                    data_ready = self.reduce_ready_dict.get(addr+i,[0,0])[0]
+                    access_time = memory_time(chunk_bytes,config.reduce_memory_config)
+                else:
+                    data_ready = self.l3_ready_dict.get(addr+i,0)
+                    access_time = memory_time(chunk_bytes,config.l3_memory_config)
+                read_time_list[source_id] = max(read_time_list[source_id],data_ready) + access_time
+                ready_time = max(ready_time,read_time_list[source_id])
+
+            stage_time = max(stage_time,ready_time) + stage_occupancy
+
+            for dst_id,(addr,element_bytes) in enumerate(dst_list):
+                write_time = max(write_time_list[dst_id],stage_time + stage_latency) \
+                             + memory_time(chunk_elements*element_bytes,config.l3_memory_config)
+                write_time_list[dst_id] = write_time
+                self.l3_ready_dict[addr+i] = write_time
+                finish_time = max(finish_time,write_time)
+
+        self.add_busy('vector',command.chunk_num * stage_occupancy)
+        for loc,addr,chunk_bytes in source_list:
+            memory_config = config.reduce_memory_config if loc == 'reduce' else config.l3_memory_config
+            self.add_busy(loc,command.chunk_num * memory_time(chunk_bytes,memory_config))
+        for addr,element_bytes in dst_list:
+            self.add_busy('l3',command.chunk_num * memory_time(chunk_elements*element_bytes,config.l3_memory_config))
+
+        self.command_bound_list.append((command.opcode,command.chunk_num * max(stage_occupancy,1) + stage_latency))
+        self.receive_free_time = finish_time + 1
+        self.finish_time = max(self.finish_time,finish_time)
+
+    def estimate(self,send_command_list:Iterable[SendCommand],receive_command_list:Iterable[ReceiveBaseCommand],
+                 compute_command_list:Iterable[ComputeCommand])->dict[str,Any]:
+        """
+        三个 engine 的指令流之间只通过地址产生依赖, 按照生产者在前的顺序处理:
+        send 写 l2, compute 读 l2 写 reduce, receive 读 reduce / l3 写 l3
+        receive 写 l3 之后又可能被之后的 send 读取, 所以按层交替推进: 每次处理一个 engine 中
+        所有依赖已经满足的指令, 直到所有指令都处理完
+
+        l3 / l2 的每个地址与仿真中的 tag 一样记录当前有效的版本数: 写入加一, 带 free 的读取减一
+        读取需要有效的版本 (写后读), 写入需要之前的版本已经被释放 (读后写)
+        所以读取总是对应程序顺序上最近的一次写入, 同一块 buffer 在不同的层之间复用也不会产生假的依赖
+        """
+        send_queue = list(send_command_list)
+        compute_queue = list(compute_command_list)
+        receive_queue = list(receive_command_list)
+
+        # 还没有被处理的写入次数, 之后不会再被写入的地址按照预先写入的数据处理
+        for command in receive_queue:
+            for addr in self.get_receive_write_list(command):
+                self.pending_l3_write_dict[addr] = self.pending_l3_write_dict.get(addr,0) + 1
+        for command in send_queue:
+            for key in self.get_send_write_list(command):
+                self.pending_l2_write_dict[key] = self.pending_l2_write_dict.get(key,0) + 1
+
+        send_index = compute_index = receive_index = 0
+        while send_index < len(send_queue) or compute_index < len(compute_queue) or receive_index < len(receive_queue):
+            progress = False
+
+            while send_index < len(send_queue):
+                command = send_queue[send_index]
+                if not self.send_ready(command):
+                    break
+                self.estimate_send(command)
+                self.update_send_version(command)
+                send_index += 1
+                progress = True
+
+            while compute_index < len(compute_queue):
+                command = compute_queue[compute_index]
+                if not self.compute_ready(command):
+                    break
+                self.estimate_compute(command)
+                self.update_compute_version(command)
+                compute_index += 1
+                progress = True
+
+            while receive_index < len(receive_queue):
+                command = receive_queue[receive_index]
+                if not self.receive_ready(command):
+                    break
+                self.estimate_receive(command)
+                self.update_receive_version(command)
+                receive_index += 1
+                progress = True
+
+            if progress:
+                continue
+
+            # 队首的指令读取的 l3 地址之后还会被写入, 但是这个地址从来没有被访问过,
+            # 说明第一个版本是预先写入的数据, 之后的写入是在复用这块 buffer
+            # l2 只会被 send 写入, 不存在预先写入的数据
+            if send_index < len(send_queue) and \
+                    self.assume_preload(self.get_send_read_list(send_queue[send_index])):
+                continue
+            if receive_index < len(receive_queue) and \
+                    self.assume_preload(self.get_receive_read_list(receive_queue[receive_index])):
+                continue
+            raise RuntimeError('指令之间存在无法满足的依赖')
+
+        return self.report()
+
+    def assume_preload(self,addr_list:Iterable[int])->bool:
+        assumed = False
+        for addr in addr_list:
+            if addr not in self.l3_valid_dict:
+                self.l3_valid_dict[addr] = 1
+                assumed = True
+        return assumed
+
+    def get_receive_dst_list(self,command:ReceiveBaseCommand)->list[tuple[int,int]]:
+        if isinstance(command,ReceiveCommand):
+            dst_list = [(command.dst0,element_bytes_dict[command.dst0_type])]
+            if command.dst1_flag:
+                dst_list.append((command.dst1,element_bytes_dict[command.dst1_type]))
+            return dst_list
+        return [(command.dstq,1)]
+
+    # 每条指令读写的 l3 地址 / (atom, l2 地址)
+    def get_send_read_list(self,command:SendCommand)->range:
+        return range(command.src,command.src+command.chunk_num)
+
+    def get_send_write_list(self,command:SendCommand)->list[tuple[int,int]]:
+        return [(atom_id,command.dst+i) for atom_id in command.group_id for i in range(command.chunk_num)]
+
+    def get_compute_read_list(self,command:ComputeCommand)->list[tuple[int,int]]:
+        return [(atom_id,command.src+i) for atom_id in command.group_id for i in range(command.src_chunk_num)]
+
+    def get_receive_read_list(self,command:ReceiveBaseCommand)->list[int]:
+        return [addr+i for loc,addr,_ in self.get_receive_source_list(command) if loc != 'reduce'
+                for i in range(command.chunk_num)]
+
+    def get_receive_write_list(self,command:ReceiveBaseCommand)->list[int]:
+        return [addr+i for addr,_ in self.get_receive_dst_list(command) for i in range(command.chunk_num)]
+
+    def get_receive_free_list(self,command:ReceiveBaseCommand)->list[bool]:
+        """
+        与 get_receive_source_list 一一对应, 读取之后是否释放
+        """
+        if isinstance(command,ReceiveCommand):
+            free_list = [command.free0]
+            if command.opcode in ['RECEIVE_BIN','RECEIVE_TRI']:
+                free_list.append(command.free1)
+            if command.opcode == 'RECEIVE_TRI':
+                free_list.append(command.afree)
+            return free_list
+        elif isinstance(command,QuantCommand):
+            return [command.free]
+        raise ValueError
+
+    def read_ready(self,valid_dict:dict,pending_dict:dict,key)->bool:
+        # 之后不会再被写入的地址认为数据已经在那里了
+        return valid_dict.get(key,0) > 0 or pending_dict.get(key,0) == 0
+
+    def send_ready(self,command:SendCommand)->bool:
+        return all(self.read_ready(self.l3_valid_dict,self.pending_l3_write_dict,addr)
+                   for addr in self.get_send_read_list(command)) and \
+               all(self.l2_valid_dict.get(key,0) == 0 for key in self.get_send_write_list(command))
+
+    def compute_ready(self,command:ComputeCommand)->bool:
+        return all(self.read_ready(self.l2_valid_dict,self.pending_l2_write_dict,key)
+                   for key in self.get_compute_read_list(command))
+
+    def receive_ready(self,command:ReceiveBaseCommand)->bool:
+        for loc,addr,_ in self.get_receive_source_list(command):
+            if loc != 'reduce':
+                continue
+            for i in range(command.chunk_num):
+                if self.reduce_ready_dict.get(addr+i,[0,0])[1] < command.redcount:
+                    return False
+        return all(self.read_ready(self.l3_valid_dict,self.pending_l3_write_dict,addr)
+                   for addr in self.get_receive_read_list(command)) and \
+               all(self.l3_valid_dict.get(addr,0) == 0 for addr in self.get_receive_write_list(command))
+
+    def write_version(self,valid_dict:dict,pending_dict:dict,key):
+        valid_dict[key] = valid_dict.get(key,0) + 1
+        pending_dict[key] -= 1
+
+    def free_version(self,valid_dict:dict,key):
+        valid_dict[key] = max(valid_dict.get(key,0) - 1,0)
+
+    def update_send_version(self,command:SendCommand):
+        if command.free:
+            for addr in self.get_send_read_list(command):
+                self.free_version(self.l3_valid_dict,addr)
+        for key in self.get_send_write_list(command):
+            self.write_version(self.l2_valid_dict,self.pending_l2_write_dict,key)
+
+    def update_compute_version(self,command:ComputeCommand):
+        if command.src_free:
+            for key in self.get_compute_read_list(command):
+                self.free_version(self.l2_valid_dict,key)
+
+    def update_receive_version(self,command:ReceiveBaseCommand):
+        for (loc,addr,_),free in zip(self.get_receive_source_list(command),self.get_receive_free_list(command)):
+            if not free:
+                continue
+            for i in range(command.chunk_num):
+                if loc == 'reduce':
+                    # reduce 的下一个版本可能已经开始累加, 只去掉这一次读取的写入次数
+                    ready = self.reduce_ready_dict.setdefault(addr+i,[0,0])
+                    ready[1] = max(ready[1] - command.redcount,0)
+                else:
+                    self.free_version(self.l3_valid_dict,addr+i)
+        for addr in self.get_receive_write_list(command):
+            self.write_version(self.l3_valid_dict,self.pending_l3_write_dict,addr)
+
+    def report(self)->dict[str,Any]:
+        resource_bound = max(self.resource_busy_dict.values(),default=0)
+        bound_by = max(self.resource_busy_dict,key=self.resource_busy_dict.get) if self.resource_busy_dict else None
+        return {
+            'estimate':max(self.finish_time,resource_bound),
+            'critical_path':self.finish_time,
+            'resource_bound':resource_bound,
+            'bound_by':bound_by,
+            'resource_busy':dict(self.resource_busy_dict),
+            'command_bound_list':self.command_bound_list,
+        }
+
+
+def estimate_finish_time(send_command_list,receive_command_list,compute_command_list,
+                         config:Optional[RooflineConfig]=None)->dict[str,Any]:
+    estimator = RooflineEstimator(config or RooflineConfig())
+    return estimator.estimate(send_command_list,receive_command_list,compute_command_list)
@@ -0,0 +1,191 @@
+from __future__ import annotations
+
+import dataclasses
+import math
+import statistics
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+from Desim.Core import SimSession
+
+from NeutronSim.Chip import Chip
+from NeutronSim.Commands import SendCommand, ReceiveBaseCommand, ComputeCommand, ReceiveCommand, QuantCommand
+from NeutronSim.Sweep import SweepPoint, build_chip
+from NeutronSim.Utils import get_sim_cycle
+
+"""
+重复层的采样仿真
+decode 阶段的 trace 由同一个指令块 (一层) 重复很多次组成, 只是地址不同
+只仿真前面 warm-up + sample 个块, 用 sample 块的平均时间外推剩下的块
+每个块的时间 = 这个块最后一条 receive 指令结束的时间 - 上一个块结束的时间
+"""
+
+
+class SamplingError(Exception):
+    pass
+
+
+@dataclass
+class SamplingConfig:
+    warmup_block_num:int = 2
+    sample_block_num:int = 4
+    confidence:float = 0.95
+    # 为 None 的时候自动找出最多可以分成多少个相同的块
+    block_num:Optional[int] = None
+
+
+def get_field_space_dict(command:Any)->dict[str,str]:
+    """
+    地址字段 -> 所在的地址空间, 所有 atom 的 l2 共用一个地址空间
+    """
+    if isinstance(command,SendCommand):
+        return {'src':'l3','dst':'l2'}
+    if isinstance(command,ComputeCommand):
+        return {'src':'l2','dst':'l2','reddst':'reduce'}
+    if isinstance(command,ReceiveCommand):
+        return {'src0':command.src0_loc,'src1':command.src1_loc,'asrc':'l3','dst0':'l3','dst1':'l3'}
+    if isinstance(command,QuantCommand):
+        return {'src':'l3','dstq':'l3','dstzs':'l3'}
+    raise ValueError
+
+
+def get_block_base_dict(block_tuple:tuple[list,...])->dict[str,int]:
+    # 块中每个地址空间出现的最小地址
+    base_dict:dict[str,int] = {}
+    for command_list in block_tuple:
+        for command in command_list:
+            for name,space in get_field_space_dict(command).items():
+                value = getattr(command,name)
+                if value >= 0:
+                    base_dict[space] = min(base_dict.get(space,value),value)
+    return base_dict
+
+
+def normalize_block(command_list:list,base_dict:dict[str,int])->tuple:
+    """
+    地址换成相对于所在地址空间基地址的偏移, 不同字段以及不同指令之间的相对位置也会反映在结果中
+    采样和重放都用这个结果判断两个块是否相同
+    """
+    normalized_list:list[tuple] = []
+    for command in command_list:
+        space_dict = get_field_space_dict(command)
+        value_list:list[Any] = [type(command).__name__]
+        for command_field in dataclasses.fields(command):
+            value = getattr(command,command_field.name)
+            if command_field.name in space_dict and value >= 0:
+                value = value - base_dict.get(space_dict[command_field.name],0)
+            elif isinstance(value,list):
+                value = tuple(value)
+            value_list.append(value)
+        normalized_list.append(tuple(value_list))
+    return tuple(normalized_list)
+
+
+def split_block(command_list:list,block_num:int)->list[list]:
+    block_size = len(command_list) // block_num
+    return [command_list[i*block_size:(i+1)*block_size] for i in range(block_num)]
+
+
+def is_repeated(command_list_tuple:tuple[list,...],block_num:int)->bool:
+    """
+    三种指令都能平均分成 block_num 块, 每一块都至少有一条 receive 指令, 并且每一块在归一化之后都相同
+    三种指令使用同一组基地址归一化, 块中 SEND 写入 COMPUTE 读取这类跨指令的地址关系也要相同
+    """
+    if any(len(command_list) % block_num != 0 for command_list in command_list_tuple):
+        return False
+    send_command_list,receive_command_list,compute_command_list = command_list_tuple
+    if block_num > 1 and len(receive_command_list) < block_num:
+        return False
+
+    block_tuple_list = list(zip(*(split_block(command_list,block_num) for command_list in command_list_tuple)))
+
+    def normalize_helper(block_tuple:tuple[list,...])->tuple:
+        base_dict = get_block_base_dict(block_tuple)
+        return tuple(normalize_block(command_list,base_dict) for command_list in block_tuple)
+
+    first_block = normalize_helper(block_tuple_list[0])
+    return all(normalize_helper(block_tuple) == first_block for block_tuple in block_tuple_list[1:])
+
+
+def detect_block_num(send_command_list:list[SendCommand],receive_command_list:list[ReceiveBaseCommand],
+                     compute_command_list:list[ComputeCommand])->int:
+    """
+    找出最多可以分成多少个相同的块, 每个块至少要有一条 receive 指令, 找不到的时候返回 1
+    """
+    command_list_tuple = (send_command_list,receive_command_list,compute_command_list)
+    length_gcd = math.gcd(*(len(command_list) for command_list in command_list_tuple))
+    for block_num in range(length_gcd,1,-1):
+        if length_gcd % block_num == 0 and is_repeated(command_list_tuple,block_num):
+            return block_num
+    return 1
+
+
+def run_sampled(point:SweepPoint,
+                send_command_list:list[SendCommand],receive_command_list:list[ReceiveBaseCommand],
+                compute_command_list:list[ComputeCommand],
+                preload_function:Optional[Callable[[Chip],None]]=None,
+                sampling_config:SamplingConfig=SamplingConfig())->dict[str,Any]:
+    """
+    在一个全新的 SimSession 中仿真前面的几个块, 并外推整个 trace 的完成时间
+    块的数量不够的时候退化为完整的仿真, 此时上下界与估计值相同
+    """
+    block_num = sampling_config.block_num
+    if block_num is None:
+        block_num = detect_block_num(send_command_list,receive_command_list,compute_command_list)
+    elif not is_repeated((send_command_list,receive_command_list,compute_command_list),block_num):
+        raise SamplingError(f'trace can not be split into {block_num} identical blocks')
+
+    simulate_block_num = min(block_num,sampling_config.warmup_block_num + sampling_config.sample_block_num)
+    if simulate_block_num == block_num - 1:
+        # 只剩下一个块的时候直接完整仿真
+        simulate_block_num = block_num
+
+    def take_prefix(command_list:list)->list:
+        return command_list[:len(command_list) // block_num * simulate_block_num]
+
+    SimSession.reset()
+    SimSession.init()
+
+    chip = build_chip(point)
+    chip.load_command(take_prefix(send_command_list),take_prefix(receive_command_list),
+                      take_prefix(compute_command_list))
+    if preload_function is not None:
+        preload_function(chip)
+
+    start_time = time.perf_counter()
+    SimSession.scheduler.run()
+    wall_time = time.perf_counter() - start_time
+    sim_time = get_sim_cycle()
+
+    # 每个块的结束时间
+    receive_block_size = len(receive_command_list) // block_num
+    finish_time_list = chip.receive_engine.finish_time_list
+    # 没有 receive 指令的时候只有一个块, 完整仿真的结束时间就是这个块的结束时间
+    block_finish_time_list = [max(finish_time_list[i*receive_block_size:(i+1)*receive_block_size],default=sim_time)
+                              for i in range(simulate_block_num)]
+    block_time_list = [finish_time - previous_finish_time for previous_finish_time,finish_time
+                       in zip([0] + block_finish_time_list[:-1],block_finish_time_list)]
+
+    sample_time_list = block_time_list[min(sampling_config.warmup_block_num,simulate_block_num-1):]
+    block_time_mean = statistics.fmean(sample_time_list)
+    block_time_std = statistics.stdev(sample_time_list) if len(sample_time_list) > 1 else 0.0
+
+    remain_block_num = block_num - simulate_block_num
+    z = statistics.NormalDist().inv_cdf(0.5 + sampling_config.confidence / 2)
+    # 剩下的每个块都按照平均值估计, 平均值的误差会被放大 remain_block_num 倍
+    margin = z * block_time_std / math.sqrt(len(sample_time_list)) * remain_block_num
+    estimate = sim_time + remain_block_num * block_time_mean
+
+    return {
+        'block_num':block_num,
+        'simulated_block_num':simulate_block_num,
+        'block_time_mean':block_time_mean,
+        'block_time_std':block_time_std,
+        'simulated_time':sim_time,
+        'estimate':estimate,
+        'lower':estimate - margin,
+        'upper':estimate + margin,
+        'confidence':sampling_config.confidence,
+        'wall_time':wall_time,
+    }
@@ -1,25 +1,42 @@
 from __future__ import annotations
 
 import math
-from dataclasses import dataclass
+from collections import OrderedDict, deque
+from dataclasses import dataclass, replace
 from typing import Optional, TYPE_CHECKING
 
-from Desim.module.Pipeline import PipeStage
-
+from NeutronSim.ArrayMemory import burst_read, burst_write_from_fifo
 from NeutronSim.Atom import AtomManager,AtomResourceRequest
 from NeutronSim.Commands import SendCommand
+from NeutronSim.CommandQueue import make_command_queue
 from NeutronSim.Config import MemoryConfig, LinkConfig, element_bytes_dict
+from NeutronSim.Link import D2DLinkModel, LinkTransfer
+from NeutronSim.Packet import make_chunk_packet
+from NeutronSim.PerfCounter import PerfMonitor, CountedPortMixin, make_counted_memory_port
+from NeutronSim.Utils import get_sim_cycle
 from Desim.Core import Event, SimModule, SimTime
 from Desim.memory.Memory import DepMemory, DepMemoryPort, ChunkMemoryPort, ChunkMemory, ChunkPacket
 from Desim.module.FIFO import FIFO,DelayFIFO
-from Desim.module.Pipeline import PipeGraph
+from NeutronSim.PipeTemplate import PipeTemplate
 
 if TYPE_CHECKING:
     from NeutronSim.Chip import Chip
 
+# 逐 chunk 模式下 l3 read dma 与 l2 write dma 之间两级 FIFO 的总容量
+link_transfer_capacity:int = 20
+
+
 @dataclass
 class SendEngineConfig:
     num_sub_engine:int = 4
+    # 大于 0 的时候, 超过这个 chunk 数的 SEND 拆分为多个 batch, 每个 batch 单独申请和释放 link
+    # 不同的 sub send engine 可以同时处理同一条 SEND 的不同 batch
+    batch_chunk_num:int = 0
+    # 拆分模式下最多提前读取的 SEND 数量, 前面的 SEND 还有 batch 没有发出的时候, 空闲的 sub send engine
+    # 可以先处理后面 link 不冲突的 SEND
+    batch_window_num:int = 8
+    # 每个 sub send engine 最多缓存的流水线数量, 超过之后关闭最久没有使用的流水线
+    max_pipe_template_num:int = 16
 
 
 class SubSendEngine(SimModule):
@@ -37,7 +54,8 @@ class SubSendEngine(SimModule):
 
         self.external_atom_manager:Optional[AtomManager] = None
 
-        self.l3_memory_read_port:ChunkMemoryPort = ChunkMemoryPort()
+        self.external_l3_memory:Optional[ChunkMemory] = None
+        self.l3_memory_read_port:Optional[CountedPortMixin] = None
 
 
         self.sub_send_engine_id = sub_send_engine_id
@@ -46,31 +64,52 @@ class SubSendEngine(SimModule):
 
         self.acquire_finish_event:Event = Event()
 
+        # coalesce 模式下每条 link 的模型, 每条指令重新构建
+        self.link_model_dict:dict[int,D2DLinkModel] = {}
+
+        # 按照 group 形状缓存的常驻流水线, 共用 link 的 atom 共用一个 link 流水级, 按照 LRU 淘汰
+        self.pipe_template_dict:OrderedDict[tuple[int,...],PipeTemplate] = OrderedDict()
+
+        self.perf_monitor:PerfMonitor = PerfMonitor()
+        self.perf_name:str = f'send_engine.{self.sub_send_engine_id}'
+
     def config_connection(self,atom_manager:AtomManager,l3_memory:ChunkMemory,send_engine:SendEngine):
         """
         用于构建各种连接关系
         """
 
         self.external_atom_manager=atom_manager
-        self.l3_memory_read_port.config_chunk_memory(l3_memory)
+        self.external_l3_memory = l3_memory
+        self.l3_memory_read_port = make_counted_memory_port(l3_memory)
         self.external_send_engine = send_engine
 
+    def config_perf_monitor(self,perf_monitor:PerfMonitor):
+        self.perf_monitor = perf_monitor
+        self.perf_monitor.config_memory_port(self.l3_memory_read_port,self.external_l3_memory,
+                                             f'{self.perf_name}.l3_read_dma')
 
-    def l3_read_dma_handler(self,input_fifo_map:Optional[dict[str,FIFO]],output_fifo_map:Optional[dict[str,FIFO]])->bool:
-        # 根据指令的情况进行 分段读取数据
-        read_addr = self.current_command.src
-        for i in range(self.current_command.chunk_num):
-            # 从 memory 中读取数据
-            data = self.l3_memory_read_port.read(read_addr+i,1,self.current_command.free,
-                                                 self.current_command.chunk_size,self.current_command.batch_size,
-                                                 element_bytes_dict[self.current_command.dtype])
 
+    def l3_read_dma_handler(self,command:SendCommand,input_fifo_map:Optional[dict[str,FIFO]],output_fifo_map:Optional[dict[str,FIFO]])->bool:
+        link_atom_dict = self.external_atom_manager.get_link_atom_dict(command.group_id)
+
+        link_transfer_dict:dict[int,LinkTransfer] = {}
+        if self.d2d_link_config.coalesce:
+            # 每条指令开始的时候链路都是空闲的
+            for link_id,atom_id_list in link_atom_dict.items():
+                self.link_model_dict[link_id] = D2DLinkModel(self.d2d_link_config)
+                # 整条指令只向每个 atom 发送一次
+                for atom_id in atom_id_list:
+                    link_transfer_dict[atom_id] = LinkTransfer(link_transfer_capacity)
+                    output_fifo_map[f'uci-e-{atom_id}-l2-{atom_id}'].write(link_transfer_dict[atom_id])
+
+        # 每个 chunk 在 finish_time 从 l3 中读出, burst 读取的时候 finish_time 可能晚于当前时间
+        def send_chunk(i:int,data,finish_time:int):
             # 构建为 chunk packet
-            chunk_packet = ChunkPacket(
+            chunk_packet = make_chunk_packet(
                 data,
-                self.current_command.chunk_size,
-                self.current_command.batch_size,
-                element_bytes_dict[self.current_command.dtype]
+                command.chunk_size,
+                command.batch_size,
+                element_bytes_dict[command.dtype]
             )
 
             # 写入到 DelayFIFO 中, 模拟UCI-E 的延迟行为
@@ -78,61 +117,139 @@ class SubSendEngine(SimModule):
             # 向多个fifo中写入, 需要支持
 
             # 计算一下传输的延迟, 邻接的下一个fifo是 DelayFIFO, 需要在这里仿真出来uci-e的传输开销
-            for atom_id in self.current_command.group_id:
-                output_fifo_map[f'l3-uci-e-{atom_id}'].delay_write(chunk_packet,SimTime(self.d2d_link_config.link_latency))
+            if self.d2d_link_config.coalesce:
+                # 事务级模型, 直接算出 link 传输结束的时间, 跳过 link 流水级
+                # 共用一条 link 的 atom 依次占用这条 link
+                for link_id,atom_id_list in link_atom_dict.items():
+                    link_counter = self.perf_monitor.get_stage_counter(f'{self.perf_name}.link-{link_id}')
+                    for atom_id in atom_id_list:
+                        link_counter.add_busy(math.ceil(chunk_packet.chunk_bytes/self.d2d_link_config.bandwidth))
+                        link_counter.add_bytes(chunk_packet.chunk_bytes)
+                        link_finish_time = self.link_model_dict[link_id].transfer(finish_time,chunk_packet.chunk_bytes)
+                        link_transfer_dict[atom_id].push(chunk_packet,link_finish_time)
+            else:
+                current_time = get_sim_cycle()
+                for link_id in link_atom_dict:
+                    output_fifo_map[f'l3-uci-e-{link_id}'].delay_write(
+                        chunk_packet,SimTime(finish_time-current_time+self.d2d_link_config.link_latency))
+
+        # 根据指令的情况进行 分段读取数据
+        burst_read(self.l3_memory_read_port,command.src,command.chunk_num,1,command.free,
+                   command.chunk_size,command.batch_size,element_bytes_dict[command.dtype],send_chunk)
 
 
 
         return False
 
 
-    def link_handler(self,input_fifo_map:Optional[dict[str,FIFO]],output_fifo_map:Optional[dict[str,FIFO]])->bool:
-        assert len(input_fifo_map) == 1 and len(output_fifo_map) == 1
-        input_fifo = list(input_fifo_map.values())[0]
-        output_fifo = list(output_fifo_map.values())[0]
+    # 返回一个函数, 用于作为某一条 link 的流水级
+    def link_helper(self,link_id:int):
+        def link_handler(command:SendCommand,input_fifo_map:Optional[dict[str,FIFO]],output_fifo_map:Optional[dict[str,FIFO]])->bool:
+            # 一条 link 可能连接多个 atom, 每个 chunk 要依次发送给这条 link 上的所有 atom
+            assert len(input_fifo_map) == 1
+            input_fifo = list(input_fifo_map.values())[0]
 
-        for i in range(self.current_command.chunk_num):
-            chunk_packet:ChunkPacket = input_fifo.read()
-            latency = math.ceil(chunk_packet.chunk_bytes / self.d2d_link_config.bandwidth)
-            SimModule.wait_time(SimTime(latency))
-            output_fifo.write(chunk_packet)
+            for i in range(command.chunk_num):
+                chunk_packet:ChunkPacket = input_fifo.read()
+                latency = math.ceil(chunk_packet.chunk_bytes / self.d2d_link_config.bandwidth)
+                for output_fifo in output_fifo_map.values():
+                    SimModule.wait_time(SimTime(latency))
+                    link_counter.add_busy(latency)
+                    link_counter.add_bytes(chunk_packet.chunk_bytes)
+                    output_fifo.write(chunk_packet)
 
-        return False
+            return False
+
+        link_counter = self.perf_monitor.get_stage_counter(f'{self.perf_name}.link-{link_id}')
+
+        return link_handler
 
 
 
     # 返回一个函数, 用于作为 l2 的 write dma
     def l2_write_dma_helper(self,atom_id:int):
-        def l2_write_dma_handler(input_fifo_map:Optional[dict[str,FIFO]],output_fifo_map:Optional[dict[str,FIFO]]):
-            l2_write_port = ChunkMemoryPort()
-            l2_write_port.config_chunk_memory(atom_die.l2_memory)
-
-            write_addr = self.current_command.dst
-            for i in range(self.current_command.chunk_num):
-                chunk_packet:ChunkPacket = input_fifo_map[f'uci-e-{atom_id}-l2-{atom_id}'].read()
+        def l2_write_dma_handler(command:SendCommand,input_fifo_map:Optional[dict[str,FIFO]],output_fifo_map:Optional[dict[str,FIFO]]):
+            input_fifo = input_fifo_map[f'uci-e-{atom_id}-l2-{atom_id}']
+            if self.d2d_link_config.coalesce:
+                # 整条指令的 chunk 都在这一个 LinkTransfer 中, 按照各自到达的时间读取
+                input_fifo = input_fifo.read()
 
-                data = chunk_packet.payload
-                # 写入到 l2 memory 中
-                l2_write_port.write(write_addr+i,data,True,
-                                    self.current_command.chunk_size,
-                                    self.current_command.batch_size,
-                                    element_bytes_dict[self.current_command.dtype])
+            # 写入到 l2 memory 中
+            burst_write_from_fifo(l2_write_port,input_fifo,
+                                  command.dst,command.chunk_num,True,lambda chunk_packet:chunk_packet.payload)
 
             return False
 
         atom_die = self.external_atom_manager.get_atom_instance(atom_id).atom_die
 
+        # 流水线常驻, port 也只需要构建一次
+        l2_write_port = self.perf_monitor.make_memory_port(atom_die.l2_memory,f'{self.perf_name}.l2_write_dma-{atom_id}')
+
         return l2_write_dma_handler
 
+    def get_pipe_template(self,group_id:list[int])->PipeTemplate:
+        """
+        按照 group 的形状缓存流水线, 相同 group 的指令共用一条常驻的流水线
+        sub send engine 一次只执行一条指令, 调用的时候所有的流水线都是空闲的, 可以直接关闭被淘汰的流水线
+        """
+        group_key = tuple(group_id)
+        pipe_template = self.pipe_template_dict.get(group_key)
+        if pipe_template is not None:
+            self.pipe_template_dict.move_to_end(group_key)
+            return pipe_template
+
+        pipe_template = self.build_pipe_template(group_id)
+        self.pipe_template_dict[group_key] = pipe_template
+        if len(self.pipe_template_dict) > self.top_module.send_engine_config.max_pipe_template_num:
+            _,evict_template = self.pipe_template_dict.popitem(last=False)
+            evict_template.close()
+        return pipe_template
+
+    def build_pipe_template(self,group_id:list[int])->PipeTemplate:
+        pipe_template = PipeTemplate()
+
+        link_atom_dict = self.external_atom_manager.get_link_atom_dict(group_id)
+
+        pipe_template.add_stage(self.l3_read_dma_handler,'l3_read_dma',
+                                perf_counter=self.perf_monitor.get_stage_counter(f'{self.perf_name}.l3_read_dma'))
+
+        for link_id,atom_id_list in link_atom_dict.items():
+            if not self.d2d_link_config.coalesce:
+                pipe_template.add_stage(self.link_helper(link_id),f'link-{link_id}',
+                                        perf_counter=self.perf_monitor.get_stage_counter(f'{self.perf_name}.link-{link_id}'))
+
+            for atom_id in atom_id_list:
+                pipe_template.add_stage(self.l2_write_dma_helper(atom_id),f'l2_write_dma-{atom_id}',is_sink=True,
+                                        perf_counter=self.perf_monitor.get_stage_counter(f'{self.perf_name}.l2_write_dma-{atom_id}'))
+
+        # 连接各个流水级
+        for link_id,atom_id_list in link_atom_dict.items():
+            if self.d2d_link_config.coalesce:
+                # link 的延迟已经算好了, 每条指令只通过 fifo 传递一个 LinkTransfer
+                for atom_id in atom_id_list:
+                    pipe_template.add_edge('l3_read_dma',f'l2_write_dma-{atom_id}',f'uci-e-{atom_id}-l2-{atom_id}',1,0)
+            else:
+                delay_fifo = DelayFIFO(10,0)
+                pipe_template.add_edge_with_fifo('l3_read_dma',f'link-{link_id}',f'l3-uci-e-{link_id}',delay_fifo)
+
+                for atom_id in atom_id_list:
+                    pipe_template.add_edge(f'link-{link_id}',f'l2_write_dma-{atom_id}',f'uci-e-{atom_id}-l2-{atom_id}',10,0)
+
+        pipe_template.build()
+        return pipe_template
+
     def process(self):
         while True:
             # 读取新的指令, 如果指令队列空了,就说明没有新的指令了,退出执行
-            if self.external_send_command_queue.is_empty():
+            if not self.external_send_engine.has_command():
                 return
 
-            # 读取新的指令
-            command:SendCommand = self.external_send_command_queue.read()
+            # 读取新的指令, 可能是一条 SEND 拆分出来的一个 batch
+            command:SendCommand = self.external_send_engine.read_command()
             self.current_command = command
+            # 包括申请 link 的等待时间
+            engine_counter = self.perf_monitor.get_stage_counter(f'{self.perf_name}.command')
+            engine_counter.begin(command.opcode)
             # 对指令进行解析,并申请资源 
             acquire_req = AtomResourceRequest(
                 resource_type='link',
@@ -145,34 +262,10 @@ class SubSendEngine(SimModule):
             self.external_atom_manager.handle_acquire_request(acquire_req)
             SimModule.wait(self.acquire_finish_event)
 
-            # 构建流水线处理指令
-            pipe_graph = PipeGraph()
-            read_pipe_stage = PipeStage.dynamic_create(self.l3_read_dma_handler)
-
-            pipe_graph.add_stage(read_pipe_stage,'l3_read_dma')
-
-            for atom_id in self.current_command.group_id:
-                link_pipe_stage = PipeStage.dynamic_create(self.link_handler)
-                pipe_graph.add_stage(link_pipe_stage,f'link-{atom_id}')
-
-                l2_write_pipe_stage = PipeStage.dynamic_create(self.l2_write_dma_helper(atom_id))
-                pipe_graph.add_stage(l2_write_pipe_stage,f'l2_write_dma-{atom_id}')
-
-                pipe_graph.add_sink_stage_by_name(f'l2_write_dma-{atom_id}')
-
-            # 连接各个流水级
-            for atom_id in self.current_command.group_id:
-                delay_fifo = DelayFIFO(10,0)
-                pipe_graph.add_edge_with_fifo('l3_read_dma',f'link-{atom_id}',f'l3-uci-e-{atom_id}',delay_fifo)
-
-                pipe_graph.add_edge(f'link-{atom_id}',f'l2_write_dma-{atom_id}',f'uci-e-{atom_id}-l2-{atom_id}',10,0)
-
-
-            pipe_graph.build_graph()
-
-            # 启动流水线，并等待流水线结束, 执行完成
-            pipe_graph.start_pipe_graph()
-            pipe_graph.wait_pipe_graph_finish()  # 等待结束
+            # 指令作为 token 发送给常驻的流水线, 并等待流水线处理完这条指令
+            pipe_template = self.get_pipe_template(command.group_id)
+            pipe_template.issue(command)
+            pipe_template.wait_finish()  # 等待结束
 
             # 释放释放资源 
             release_req = AtomResourceRequest(
@@ -182,6 +275,8 @@ class SubSendEngine(SimModule):
                 requester_id=self.sub_send_engine_id,
             )
             self.external_atom_manager.handle_release_request(release_req)
+            self.external_send_engine.finish_command(command)
+            engine_counter.end()
             # 处理结束 等一个周期在处理下一次的请求吧
             self.current_command = None
             SimModule.wait_time(SimTime(1))
@@ -196,7 +291,7 @@ class SendEngine(SimModule):
 
     """
 
-    def __init__(self,top_module:Chip,d2d_link_config:LinkConfig):
+    def __init__(self,top_module:Chip,d2d_link_config:LinkConfig,send_engine_config:SendEngineConfig=SendEngineConfig()):
         super().__init__()
 
         self.top_module = top_module
@@ -205,7 +300,12 @@ class SendEngine(SimModule):
 
         self.send_command_queue:Optional[FIFO] = None
 
-        self.send_engine_config:SendEngineConfig = SendEngineConfig()
+        self.send_engine_config:SendEngineConfig = send_engine_config
+
+        # 拆分模式下已经读取, 还有 batch 没有发出的 SEND, 每个元素是一条 SEND 剩下的 batch, 按照指令的顺序
+        self.pending_send_list:list[deque[SendCommand]] = []
+        # link id -> 正在使用这条 link 的 batch 数量 (包括还在等待申请 link 的)
+        self.inflight_link_dict:dict[int,int] = {}
 
         self.external_atom_manager:Optional[AtomManager] = None
 
@@ -229,14 +329,78 @@ class SendEngine(SimModule):
 
         pass
 
+    def config_perf_monitor(self,perf_monitor:PerfMonitor):
+        for sub_send_engine in self.sub_send_engine_list:
+            sub_send_engine.config_perf_monitor(perf_monitor)
+
 
     def load_command(self,command_list:list[SendCommand]):
-        command_size = len(command_list)
-        self.send_command_queue = FIFO(command_size,command_size,command_list)
+        self.send_command_queue = make_command_queue(command_list)
+
+        self.pending_send_list.clear()
+        self.inflight_link_dict.clear()
 
         for sub_send_engine in self.sub_send_engine_list:
             sub_send_engine.external_send_command_queue = self.send_command_queue
 
+    def has_command(self)->bool:
+        return bool(self.pending_send_list) or not self.send_command_queue.is_empty()
+
+    def get_link_id_list(self,command:SendCommand)->list[int]:
+        return list(self.external_atom_manager.get_link_atom_dict(command.group_id))
+
+    def read_command(self)->SendCommand:
+        """
+        sub send engine 从这里获取下一条需要执行的指令
+        拆分模式下最多提前读取 batch_window_num 条 SEND, 选择第一条满足下面条件的 SEND 的下一个 batch:
+        之前的 SEND 中还没有发出的 batch 不使用它的 link, 并且它的 link 上没有正在执行的 batch
+        没有满足条件的 batch 的时候选择最早的 SEND, 在 link 上排队
+        同一条 link 上的 batch 仍然按照指令的顺序申请, 不会越过之前的 SEND
+        """
+        batch_chunk_num = self.send_engine_config.batch_chunk_num
+        if batch_chunk_num <= 0:
+            return self.send_command_queue.read()
+
+        while len(self.pending_send_list) < self.send_engine_config.batch_window_num \
+                and not self.send_command_queue.is_empty():
+            command:SendCommand = self.send_command_queue.read()
+            self.pending_send_list.append(deque(self.split_command(command,batch_chunk_num)))
+
+        send_index = 0
+        blocked_link_set:set[int] = set()
+        for index,batch_queue in enumerate(self.pending_send_list):
+            link_id_list = self.get_link_id_list(batch_queue[0])
+            if blocked_link_set.isdisjoint(link_id_list) and \
+                    all(self.inflight_link_dict.get(link_id,0) == 0 for link_id in link_id_list):
+                send_index = index
+                break
+            blocked_link_set.update(link_id_list)
+
+        batch_queue = self.pending_send_list[send_index]
+        command = batch_queue.popleft()
+        if not batch_queue:
+            del self.pending_send_list[send_index]
+
+        for link_id in self.get_link_id_list(command):
+            self.inflight_link_dict[link_id] = self.inflight_link_dict.get(link_id,0) + 1
+        return command
+
+    def finish_command(self,command:SendCommand):
+        if self.send_engine_config.batch_chunk_num <= 0:
+            return
+        for link_id in self.get_link_id_list(command):
+            self.inflight_link_dict[link_id] -= 1
+
+    @staticmethod
+    def split_command(command:SendCommand,batch_chunk_num:int)->list[SendCommand]:
+        batch_list:list[SendCommand] = []
+        for offset in range(0,command.chunk_num,batch_chunk_num):
+            batch_list.append(replace(command,
+                                      chunk_num=min(batch_chunk_num,command.chunk_num-offset),
+                                      src=command.src+offset,
+                                      dst=command.dst+offset))
+        return batch_list
+
 
 
 
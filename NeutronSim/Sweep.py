@@ -0,0 +1,167 @@
+import copy
+import csv
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional, TypeAlias
+
+from Desim.Core import SimSession
+
+from NeutronSim.Chip import Chip
+from NeutronSim.Commands import SendCommand, ReceiveBaseCommand, ComputeCommand
+from NeutronSim.Config import LinkConfig, MemoryConfig, AtomConfig, TopologyConfig
+from NeutronSim.ReceiveEngine import ReceiveEngineConfig
+from NeutronSim.Utils import get_sim_cycle
+
+
+@dataclass
+class SweepPoint:
+    d2d_link_config:LinkConfig = field(default_factory=LinkConfig)
+    l2_memory_config:MemoryConfig = field(default_factory=MemoryConfig)
+    l3_memory_config:MemoryConfig = field(default_factory=MemoryConfig)
+    reduce_memory_config:MemoryConfig = field(default_factory=MemoryConfig)
+    atom_config:AtomConfig = field(default_factory=AtomConfig)
+    topology_config:TopologyConfig = field(default_factory=TopologyConfig)
+    receive_engine_config:ReceiveEngineConfig = field(default_factory=ReceiveEngineConfig)
+
+    # 这个设计点在各个 sweep 维度上的取值, 会原样写到结果表中
+    tag:dict[str,Any] = field(default_factory=dict)
+    # 打开性能计数器, 把 chip.get_perf_report() 展开之后写到结果表中
+    perf_report:bool = True
+
+
+# 需要是模块级别的函数, 才能被发送到子进程中
+TraceGenerator:TypeAlias = Callable[[SweepPoint],tuple[list[SendCommand],list[ReceiveBaseCommand],list[ComputeCommand]]]
+PreloadFunction:TypeAlias = Callable[[Chip,SweepPoint],None]
+
+
+def set_sweep_value(point:SweepPoint,key:str,value:Any):
+    """
+    key 可以是 SweepPoint 的字段, 例如 'atom_config'
+    也可以是某个 config 中的字段, 例如 'd2d_link_config.bandwidth'
+    """
+    target = point
+    attr_list = key.split('.')
+    for attr in attr_list[:-1]:
+        target = getattr(target,attr)
+
+    if not hasattr(target,attr_list[-1]):
+        raise AttributeError(f'unknown sweep key {key}')
+    setattr(target,attr_list[-1],value)
+
+
+def build_sweep_grid(base_point:SweepPoint,axis_dict:dict[str,list[Any]])->list[SweepPoint]:
+    """
+    在 base_point 的基础上, 对 axis_dict 中的所有维度做笛卡尔积
+    """
+    key_list = list(axis_dict.keys())
+
+    point_list:list[SweepPoint] = []
+    for value_tuple in itertools.product(*axis_dict.values()):
+        point = copy.deepcopy(base_point)
+        for key,value in zip(key_list,value_tuple):
+            set_sweep_value(point,key,value)
+        point.tag = {**base_point.tag,**dict(zip(key_list,value_tuple))}
+        point_list.append(point)
+
+    return point_list
+
+
+def flatten_report(report:dict[str,Any],prefix:str='')->dict[str,Any]:
+    """
+    嵌套的性能报告展开为一层, 键用 '.' 连接, 例如 'memory.l3.utilization'
+    """
+    flat_report:dict[str,Any] = {}
+    for key,value in report.items():
+        name = f'{prefix}{key}'
+        if isinstance(value,dict):
+            flat_report.update(flatten_report(value,f'{name}.'))
+        else:
+            flat_report[name] = value
+    return flat_report
+
+
+def build_chip(point:SweepPoint)->Chip:
+    return Chip(point.d2d_link_config,point.l2_memory_config,point.l3_memory_config,point.reduce_memory_config,
+                point.atom_config,point.topology_config,point.receive_engine_config)
+
+
+def run_sweep_point(point:SweepPoint,trace_generator:TraceGenerator,
+                    preload_function:Optional[PreloadFunction]=None)->dict[str,Any]:
+    """
+    在一个全新的 SimSession 中仿真一个设计点
+    """
+    SimSession.reset()
+    SimSession.init()
+
+    chip = build_chip(point)
+    chip.perf_monitor.enable(point.perf_report)
+
+    send_command_list,receive_command_list,compute_command_list = trace_generator(point)
+    chip.load_command(send_command_list,receive_command_list,compute_command_list)
+
+    if preload_function is not None:
+        preload_function(chip,point)
+
+    start_time = time.perf_counter()
+    SimSession.scheduler.run()
+    wall_time = time.perf_counter() - start_time
+
+    result = dict(point.tag)
+    result['finish_time'] = get_sim_cycle()
+    result['wall_time'] = wall_time
+    result['saved_compute_event_num'] = chip.atom_manager.get_saved_compute_event_num()
+    result['receive_span'] = chip.receive_engine.overlap_stat.get_span()
+    if point.perf_report:
+        result.update(flatten_report(chip.get_perf_report(),'perf.'))
+    return result
+
+
+def run_overlap_gain(point:SweepPoint,trace_generator:TraceGenerator,
+                     preload_function:Optional[PreloadFunction]=None)->dict[str,Any]:
+    """
+    同一个设计点分别用 recv_engine_width=1 和设定的宽度仿真
+    两次 receive 指令跨度之比就是重叠执行的收益
+    """
+    serial_point = copy.deepcopy(point)
+    serial_point.receive_engine_config.recv_engine_width = 1
+    serial_result = run_sweep_point(serial_point,trace_generator,preload_function)
+
+    result = run_sweep_point(point,trace_generator,preload_function)
+    result['serial_receive_span'] = serial_result['receive_span']
+    result['serial_finish_time'] = serial_result['finish_time']
+    result['overlap_gain'] = serial_result['receive_span'] / result['receive_span'] if result['receive_span'] > 0 else 1.0
+    return result
+
+
+def run_sweep(point_list:list[SweepPoint],trace_generator:TraceGenerator,
+              preload_function:Optional[PreloadFunction]=None,
+              max_workers:Optional[int]=None)->list[dict[str,Any]]:
+    """
+    每个设计点在一个独立的进程中仿真, 默认使用所有的核
+    结果的顺序与 point_list 一致
+    """
+    max_workers = max_workers or os.cpu_count()
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        result_list = list(executor.map(run_sweep_point,
+                                        point_list,
+                                        itertools.repeat(trace_generator),
+                                        itertools.repeat(preload_function)))
+
+    return result_list
+
+
+def write_sweep_table(result_list:list[dict[str,Any]],path:str):
+    field_name_list:list[str] = []
+    for result in result_list:
+        for key in result:
+            if key not in field_name_list:
+                field_name_list.append(key)
+
+    with open(path,'w',newline='') as f:
+        writer = csv.DictWriter(f,fieldnames=field_name_list)
+        writer.writeheader()
+        writer.writerows(result_list)
@@ -0,0 +1,276 @@
+from __future__ import annotations
+
+import math
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Literal, Optional
+
+from Desim.Core import Event, SimModule, SimTime
+from Desim.memory.Memory import ChunkMemoryPort, ChunkPacket
+from Desim.module.FIFO import FIFO
+
+from NeutronSim.ArrayMemory import make_chunk_memory_port
+from NeutronSim.Chip import Chip
+from NeutronSim.Commands import ChipSendCommand, SendCommand, ReceiveBaseCommand, ComputeCommand
+from NeutronSim.CommandQueue import make_command_queue
+from NeutronSim.Config import LinkConfig, MemoryConfig, AtomConfig, TopologyConfig, element_bytes_dict
+from NeutronSim.Link import InterChipPacket, RemoteWriteAck
+from NeutronSim.Packet import make_chunk_packet
+from NeutronSim.ReceiveEngine import ReceiveEngineConfig
+from NeutronSim.Tracer import ChromeTracer
+from NeutronSim.Utils import get_sim_cycle
+
+
+# 每条片间 link 上同时存在的本 chip 注入的数据包数量
+inter_chip_inject_credit:int = 10
+
+
+@dataclass
+class SystemConfig:
+    num_chips:int = 2
+    inter_chip_link_config:LinkConfig = field(default_factory=LinkConfig)
+    # ring 只连接相邻的 chip, 数据按最短方向逐跳转发
+    link_topology:Literal['fully_connected','ring'] = 'ring'
+
+
+class InterChipLink(SimModule):
+    """
+    单向的片间 link, 最后一跳的数据由 write_handler 写入到目的 chip 的存储中
+    本 chip 注入的数据包受 inject_credit 限制, 队列满的时候发送方等待
+    转发的数据包不占用 credit, link 转发的时候不会因为下一跳的队列满而阻塞, ring 上的环形等待不会死锁
+    """
+
+    def __init__(self,top_module:System,src_chip_id:int,dst_chip_id:int,link_config:LinkConfig):
+        super().__init__()
+
+        self.top_module = top_module
+
+        self.src_chip_id = src_chip_id
+        self.dst_chip_id = dst_chip_id
+        self.link_config = link_config
+
+        # (到达 link 的时间, 数据包, 是否为转发的数据包), 所有数据包的 link_latency 相同, 按到达时间有序
+        self.packet_queue:deque[tuple[int,InterChipPacket,bool]] = deque()
+        self.inject_num:int = 0
+        self.inject_credit:int = inter_chip_inject_credit
+
+        self.packet_event = Event()
+        self.credit_event = Event()
+        self.link_waiting:bool = False
+        self.inject_waiting:bool = False
+
+        self.link_to_write_fifo:FIFO = FIFO(10)
+
+        self.write_port_dict:dict[str,ChunkMemoryPort] = {}
+
+        self.register_coroutine(self.link_handler)
+        self.register_coroutine(self.write_handler)
+
+    def config_connection(self,dst_chip:Chip):
+        self.write_port_dict = {'l3':make_chunk_memory_port(dst_chip.l3_memory),
+                                'reduce':make_chunk_memory_port(dst_chip.reduce_memory)}
+
+    def push_packet(self,packet:InterChipPacket,transit:bool):
+        """
+        数据包经过 link_latency 之后到达 link, 本 chip 注入的数据包需要先拿到 credit
+        """
+        if not transit:
+            while self.inject_num >= self.inject_credit:
+                self.inject_waiting = True
+                SimModule.wait(self.credit_event)
+            self.inject_num += 1
+
+        self.packet_queue.append((get_sim_cycle()+self.link_config.link_latency,packet,transit))
+        if self.link_waiting:
+            self.link_waiting = False
+            self.packet_event.notify(SimTime(0))
+
+    def link_handler(self):
+        while True:
+            while not self.packet_queue:
+                self.link_waiting = True
+                SimModule.wait(self.packet_event)
+
+            arrive_time,packet,transit = self.packet_queue[0]
+            remain_time = arrive_time - get_sim_cycle()
+            if remain_time > 0:
+                SimModule.wait_time(SimTime(remain_time))
+            self.packet_queue.popleft()
+
+            if not transit:
+                self.inject_num -= 1
+                if self.inject_waiting:
+                    self.inject_waiting = False
+                    self.credit_event.notify(SimTime(0))
+
+            transfer_latency = math.ceil(packet.chunk_packet.chunk_bytes/self.link_config.bandwidth)
+            SimModule.wait_time(SimTime(transfer_latency))
+
+            if packet.dst_chip == self.dst_chip_id:
+                self.link_to_write_fifo.write(packet)
+            else:
+                # 还没有到达目的 chip, 继续转发
+                self.top_module.forward_packet(self.dst_chip_id,packet)
+
+    def write_handler(self):
+        while True:
+            packet:InterChipPacket = self.link_to_write_fifo.read()
+            chunk_packet = packet.chunk_packet
+
+            if packet.dst_loc == 'l3':
+                self.write_port_dict['l3'].write(packet.dst_addr,chunk_packet.payload,True,
+                                                 chunk_packet.num_elements,chunk_packet.batch_size,
+                                                 chunk_packet.element_bytes)
+            elif packet.dst_loc == 'reduce':
+                # 与 atom 写 reduce buffer 一样, 不检查 tag, 多次写入进行累加
+                self.write_port_dict['reduce'].write(packet.dst_addr,chunk_packet,False,
+                                                     chunk_packet.num_elements,chunk_packet.batch_size,
+                                                     chunk_packet.element_bytes)
+            else:
+                raise ValueError
+
+            if packet.ack is not None:
+                packet.ack.chunk_written()
+
+
+class ChipSendEngine(SimModule):
+    """
+    执行 CHIP_SEND 指令, 从本 chip 的 l3 中读取数据发送到片间网络
+    """
+
+    def __init__(self,top_module:System,chip:Chip):
+        super().__init__()
+
+        self.top_module = top_module
+        self.chip = chip
+
+        self.chip_send_command_queue:Optional[FIFO] = None
+
+        self.l3_memory_read_port:ChunkMemoryPort = make_chunk_memory_port(chip.l3_memory)
+
+        self.register_coroutine(self.process)
+
+    def process(self):
+        while True:
+            if self.chip_send_command_queue.is_empty():
+                return
+
+            command:ChipSendCommand = self.chip_send_command_queue.read()
+            assert command.dst_chip != self.chip.chip_id
+
+            element_bytes = element_bytes_dict[command.dtype]
+            for i in range(command.chunk_num):
+                data = self.l3_memory_read_port.read(command.src+i,1,command.free,
+                                                     command.chunk_size,command.batch_size,element_bytes)
+
+                chunk_packet = make_chunk_packet(data,command.chunk_size,command.batch_size,element_bytes)
+
+                self.top_module.send_packet(self.chip.chip_id,
+                                            InterChipPacket(command.dst_chip,command.dst_loc,command.dst+i,chunk_packet))
+
+    def load_command(self,command_list:list[ChipSendCommand]):
+        self.chip_send_command_queue = make_command_queue(command_list)
+
+
+class System(SimModule):
+    """
+    多个 chip 组成的系统, 所有的 chip 在同一个 SimSession 中仿真
+    chip 之间通过片间 link 连接, 支持 CHIP_SEND 指令以及写到其他 chip 上的 RECEIVE 指令
+    """
+
+    def __init__(self,system_config:SystemConfig,d2d_link_config:LinkConfig,
+                 l2_memory_config:MemoryConfig,l3_memory_config:MemoryConfig,reduce_memory_config:MemoryConfig,
+                 atom_config:AtomConfig,
+                 topology_config:TopologyConfig=TopologyConfig(),
+                 receive_engine_config:ReceiveEngineConfig=ReceiveEngineConfig()):
+        super().__init__()
+
+        self.system_config = system_config
+
+        self.chip_list:list[Chip] = []
+        for chip_id in range(self.system_config.num_chips):
+            chip = Chip(d2d_link_config,l2_memory_config,l3_memory_config,reduce_memory_config,
+                        atom_config,topology_config,receive_engine_config)
+            chip.config_inter_chip(chip_id,self)
+            self.chip_list.append(chip)
+
+        # (src chip, dst chip) -> link
+        self.inter_chip_link_dict:dict[tuple[int,int],InterChipLink] = {}
+        for src_chip_id,dst_chip_id in self.get_link_pair_list():
+            inter_chip_link = InterChipLink(self,src_chip_id,dst_chip_id,self.system_config.inter_chip_link_config)
+            inter_chip_link.config_connection(self.chip_list[dst_chip_id])
+            self.inter_chip_link_dict[(src_chip_id,dst_chip_id)] = inter_chip_link
+
+        self.chip_send_engine_list:list[ChipSendEngine] = [
+            ChipSendEngine(self,chip) for chip in self.chip_list
+        ]
+
+    def get_link_pair_list(self)->list[tuple[int,int]]:
+        num_chips = self.system_config.num_chips
+        if num_chips <= 1:
+            return []
+
+        if self.system_config.link_topology == 'fully_connected':
+            return [(i,j) for i in range(num_chips) for j in range(num_chips) if i != j]
+        elif self.system_config.link_topology == 'ring':
+            link_pair_set = set()
+            for i in range(num_chips):
+                link_pair_set.add((i,(i+1) % num_chips))
+                link_pair_set.add(((i+1) % num_chips,i))
+            return sorted(link_pair_set)
+        raise ValueError
+
+    def get_next_hop(self,src_chip_id:int,dst_chip_id:int)->int:
+        if self.system_config.link_topology == 'fully_connected':
+            return dst_chip_id
+
+        # ring 上走较短的方向, 距离相同的时候顺时针
+        num_chips = self.system_config.num_chips
+        forward_distance = (dst_chip_id - src_chip_id) % num_chips
+        if forward_distance <= num_chips - forward_distance:
+            return (src_chip_id + 1) % num_chips
+        return (src_chip_id - 1) % num_chips
+
+    def get_hop_num(self,src_chip_id:int,dst_chip_id:int)->int:
+        hop_num = 0
+        while src_chip_id != dst_chip_id:
+            src_chip_id = self.get_next_hop(src_chip_id,dst_chip_id)
+            hop_num += 1
+        return hop_num
+
+    def make_remote_write_ack(self,src_chip_id:int,dst_chip_id:int,chunk_num:int)->RemoteWriteAck:
+        """
+        确认沿原路返回, 每一跳都需要一次 link_latency
+        """
+        ack_latency = self.get_hop_num(src_chip_id,dst_chip_id) * self.system_config.inter_chip_link_config.link_latency
+        return RemoteWriteAck(chunk_num,ack_latency)
+
+    def send_packet(self,src_chip_id:int,packet:InterChipPacket):
+        """
+        从 src chip 注入一个数据包, link 上注入的数据包太多的时候等待
+        """
+        next_chip_id = self.get_next_hop(src_chip_id,packet.dst_chip)
+        self.inter_chip_link_dict[(src_chip_id,next_chip_id)].push_packet(packet,False)
+
+    def forward_packet(self,src_chip_id:int,packet:InterChipPacket):
+        """
+        转发经过 src chip 的数据包, 不会阻塞
+        """
+        next_chip_id = self.get_next_hop(src_chip_id,packet.dst_chip)
+        self.inter_chip_link_dict[(src_chip_id,next_chip_id)].push_packet(packet,True)
+
+    def get_chip(self,chip_id:int)->Chip:
+        return self.chip_list[chip_id]
+
+    def config_tracer(self,tracer:Optional[ChromeTracer]):
+        # 所有 chip 写入同一个时间线, 通过 chip 的编号区分
+        for chip in self.chip_list:
+            chip.config_tracer(tracer)
+
+    def load_command(self,chip_id:int,
+                     send_command_list:list[SendCommand],
+                     receive_command_list:list[ReceiveBaseCommand],
+                     compute_command_list:list[ComputeCommand],
+                     chip_send_command_list:Optional[list[ChipSendCommand]]=None):
+        self.chip_list[chip_id].load_command(send_command_list,receive_command_list,compute_command_list)
+        self.chip_send_engine_list[chip_id].load_command(chip_send_command_list or [])
@@ -0,0 +1,356 @@
+import os
+from functools import lru_cache
+
+import numpy as np
+
+from NeutronSim.CommandQueue import CommandSequence
+from NeutronSim.Commands import SendCommand, ComputeCommand, ReceiveCommand, QuantCommand, ReceiveBaseCommand
+
+"""
+紧凑的二进制指令 trace
+每一类指令保存为一个 NumPy structured array, 字段定长
+opcode / dtype / loc 保存为枚举, group_id 和 bdcst 保存为 bitmask, redid 保存为 offset + 一个扁平的数组
+保存为 .npy 文件, 可以通过 np.memmap 的方式直接加载
+"""
+
+opcode_list = ['SEND', 'COMPUTE', 'RECEIVE_MONO', 'RECEIVE_BIN', 'RECEIVE_TRI', 'QUANT']
+dtype_list = ['', 'fp16', 'bf16', 'fp32', 'int8']
+loc_list = ['', 'l3', 'reduce']
+
+opcode_code_dict = {opcode: i for i, opcode in enumerate(opcode_list)}
+dtype_code_dict = {dtype: i for i, dtype in enumerate(dtype_list)}
+loc_code_dict = {loc: i for i, loc in enumerate(loc_list)}
+
+# bitmask 使用 uint64, 最多支持 64 个 atom
+max_mask_atom_num = 64
+
+send_trace_dtype = np.dtype([
+    ('opcode', np.uint8),
+    ('group_mask', np.uint64),
+    ('chunk_size', np.int32),
+    ('batch_size', np.int32),
+    ('chunk_num', np.int32),
+    ('dtype', np.uint8),
+    ('dst', np.int64),
+    ('src', np.int64),
+    ('free', np.bool_),
+])
+
+compute_trace_dtype = np.dtype([
+    ('opcode', np.uint8),
+    ('group_mask', np.uint64),
+    ('batch_size', np.int32),
+    ('dst', np.int64),
+    ('dst_chunk_size', np.int32),
+    ('dst_chunk_num', np.int32),
+    ('dst_free', np.bool_),
+    ('reddst', np.int64),
+    ('redid_offset', np.int64),  # redid 在 redid array 中的起始位置
+    ('redid_len', np.int32),
+    ('src', np.int64),
+    ('src_chunk_size', np.int32),
+    ('src_chunk_num', np.int32),
+    ('src_dtype', np.uint8),
+    ('src_free', np.bool_),
+    ('first_acc', np.bool_),
+    ('last_acc', np.bool_),
+])
+
+# RECEIVE 和 QUANT 共用一个表, 由 opcode 区分
+receive_trace_dtype = np.dtype([
+    ('opcode', np.uint8),
+    ('chunk_size', np.int32),
+    ('batch_size', np.int32),
+    ('chunk_num', np.int32),
+    ('bdcst_mask', np.uint64),
+    ('dst0', np.int64),
+    ('dst0_type', np.uint8),
+    ('dst1', np.int64),
+    ('dst1_type', np.uint8),
+    ('dst1_flag', np.bool_),
+    ('src0', np.int64),
+    ('src0_dtype', np.uint8),
+    ('free0', np.bool_),
+    ('src0_loc', np.uint8),
+    ('src1', np.int64),
+    ('src1_dtype', np.uint8),
+    ('free1', np.bool_),
+    ('src1_loc', np.uint8),
+    ('redcount', np.int32),
+    ('dst_chip', np.int32),
+    ('act', np.uint8),
+    ('mul', np.bool_),
+    ('add', np.bool_),
+    ('asrc', np.int64),
+    ('adtype', np.uint8),
+    ('afree', np.bool_),
+    ('dstq', np.int64),
+    ('dstzs', np.int64),
+    ('src', np.int64),
+    ('src_dtype', np.uint8),
+    ('free', np.bool_),
+    ('ngroup', np.int8),
+])
+
+
+def list_to_mask(atom_id_list:list[int])->int:
+    mask = 0
+    for atom_id in atom_id_list:
+        assert 0 <= atom_id < max_mask_atom_num
+        mask |= 1 << atom_id
+    return mask
+
+
+@lru_cache(maxsize=None)
+def mask_to_tuple(mask:int)->tuple[int,...]:
+    return tuple(i for i in range(mask.bit_length()) if (mask >> i) & 1)
+
+
+class SendCommandArray(CommandSequence):
+    def __init__(self,send_array:np.ndarray):
+        self.send_array = send_array
+
+    def __len__(self)->int:
+        return len(self.send_array)
+
+    def decode(self,index:int)->SendCommand:
+        record = dict(zip(send_trace_dtype.names, self.send_array[index].item()))
+        return SendCommand(
+            opcode=opcode_list[record['opcode']],
+            group_id=list(mask_to_tuple(record['group_mask'])),
+            chunk_size=record['chunk_size'],
+            batch_size=record['batch_size'],
+            chunk_num=record['chunk_num'],
+            dtype=dtype_list[record['dtype']],
+            dst=record['dst'],
+            src=record['src'],
+            free=record['free'],
+        )
+
+
+class ComputeCommandArray(CommandSequence):
+    def __init__(self,compute_array:np.ndarray,redid_array:np.ndarray):
+        self.compute_array = compute_array
+        self.redid_array = redid_array
+
+    def __len__(self)->int:
+        return len(self.compute_array)
+
+    def get_group_index_list(self,atom_id:int)->np.ndarray:
+        group_mask = self.compute_array['group_mask']
+        return np.flatnonzero(group_mask & np.uint64(1 << atom_id))
+
+    def decode(self,index:int)->ComputeCommand:
+        record = dict(zip(compute_trace_dtype.names, self.compute_array[index].item()))
+        redid_offset = record['redid_offset']
+        redid = self.redid_array[redid_offset:redid_offset + record['redid_len']].tolist()
+        return ComputeCommand(
+            opcode=opcode_list[record['opcode']],
+            group_id=list(mask_to_tuple(record['group_mask'])),
+            batch_size=record['batch_size'],
+            dst=record['dst'],
+            dst_chunk_size=record['dst_chunk_size'],
+            dst_chunk_num=record['dst_chunk_num'],
+            dst_free=record['dst_free'],
+            reddst=record['reddst'],
+            redid=redid,
+            src=record['src'],
+            src_chunk_size=record['src_chunk_size'],
+            src_chunk_num=record['src_chunk_num'],
+            src_dtype=dtype_list[record['src_dtype']],
+            src_free=record['src_free'],
+            first_acc=record['first_acc'],
+            last_acc=record['last_acc'],
+        )
+
+
+class ReceiveCommandArray(CommandSequence):
+    def __init__(self,receive_array:np.ndarray):
+        self.receive_array = receive_array
+
+    def __len__(self)->int:
+        return len(self.receive_array)
+
+    def get_act_array(self)->np.ndarray:
+        # RECEIVE 指令的 act 列, 不解码指令, QUANT 不使用 act
+        return self.receive_array['act'][self.receive_array['opcode'] != opcode_code_dict['QUANT']]
+
+    def decode(self,index:int)->ReceiveBaseCommand:
+        record = dict(zip(receive_trace_dtype.names, self.receive_array[index].item()))
+        opcode = opcode_list[record['opcode']]
+        if opcode == 'QUANT':
+            return QuantCommand(
+                opcode=opcode,
+                chunk_size=record['chunk_size'],
+                batch_size=record['batch_size'],
+                chunk_num=record['chunk_num'],
+                bdcst=list(mask_to_tuple(record['bdcst_mask'])),
+                dstq=record['dstq'],
+                dstzs=record['dstzs'],
+                src=record['src'],
+                src_dtype=dtype_list[record['src_dtype']],
+                free=record['free'],
+                ngroup=record['ngroup'],
+            )
+
+        return ReceiveCommand(
+            opcode=opcode,
+            chunk_size=record['chunk_size'],
+            batch_size=record['batch_size'],
+            chunk_num=record['chunk_num'],
+            bdcst=list(mask_to_tuple(record['bdcst_mask'])),
+            dst0=record['dst0'],
+            dst0_type=dtype_list[record['dst0_type']],
+            dst1=record['dst1'],
+            dst1_type=dtype_list[record['dst1_type']],
+            dst1_flag=record['dst1_flag'],
+            src0=record['src0'],
+            src0_dtype=dtype_list[record['src0_dtype']],
+            free0=record['free0'],
+            src0_loc=loc_list[record['src0_loc']],
+            src1=record['src1'],
+            src1_dtype=dtype_list[record['src1_dtype']],
+            free1=record['free1'],
+            src1_loc=loc_list[record['src1_loc']],
+            redcount=record['redcount'],
+            dst_chip=record['dst_chip'],
+            act=record['act'],
+            mul=record['mul'],
+            add=record['add'],
+            asrc=record['asrc'],
+            adtype=dtype_list[record['adtype']],
+            afree=record['afree'],
+        )
+
+
+def encode_send_command(command:SendCommand)->tuple:
+    return (
+        opcode_code_dict[command.opcode], list_to_mask(command.group_id),
+        command.chunk_size, command.batch_size, command.chunk_num,
+        dtype_code_dict[command.dtype], command.dst, command.src, command.free,
+    )
+
+
+def encode_compute_command(command:ComputeCommand,redid_offset:int)->tuple:
+    return (
+        opcode_code_dict[command.opcode], list_to_mask(command.group_id),
+        command.batch_size,
+        command.dst, command.dst_chunk_size, command.dst_chunk_num, command.dst_free,
+        command.reddst, redid_offset, len(command.redid),
+        command.src, command.src_chunk_size, command.src_chunk_num,
+        dtype_code_dict[command.src_dtype], command.src_free,
+        command.first_acc, command.last_acc,
+    )
+
+
+def encode_receive_command(command:ReceiveBaseCommand)->tuple:
+    record = dict.fromkeys(receive_trace_dtype.names, 0)
+    record.update(
+        opcode=opcode_code_dict[command.opcode],
+        chunk_size=command.chunk_size,
+        batch_size=command.batch_size,
+        chunk_num=command.chunk_num,
+        bdcst_mask=list_to_mask(command.bdcst),
+    )
+
+    if isinstance(command, QuantCommand):
+        record.update(
+            dstq=command.dstq, dstzs=command.dstzs,
+            src=command.src, src_dtype=dtype_code_dict[command.src_dtype], free=command.free,
+            ngroup=command.ngroup,
+        )
+    elif isinstance(command, ReceiveCommand):
+        record.update(
+            dst0=command.dst0, dst0_type=dtype_code_dict[command.dst0_type],
+            dst1=command.dst1, dst1_type=dtype_code_dict[command.dst1_type], dst1_flag=command.dst1_flag,
+            src0=command.src0, src0_dtype=dtype_code_dict[command.src0_dtype], free0=command.free0,
+            src0_loc=loc_code_dict[command.src0_loc],
+            src1=command.src1, src1_dtype=dtype_code_dict[command.src1_dtype], free1=command.free1,
+            src1_loc=loc_code_dict[command.src1_loc],
+            redcount=command.redcount, dst_chip=command.dst_chip,
+            act=command.act, mul=command.mul, add=command.add,
+            asrc=command.asrc, adtype=dtype_code_dict[command.adtype], afree=command.afree,
+        )
+    else:
+        raise ValueError
+
+    return tuple(record[name] for name in receive_trace_dtype.names)
+
+
+class CommandTrace:
+    """
+    一个 chip 的完整指令 trace
+    可以直接交给 Chip.load_trace 使用, 指令只有在 engine 读取的时候才会被解码
+    """
+
+    file_name_dict = {
+        'send_array': 'send.npy',
+        'compute_array': 'compute.npy',
+        'redid_array': 'compute_redid.npy',
+        'receive_array': 'receive.npy',
+    }
+
+    def __init__(self,send_array:np.ndarray,compute_array:np.ndarray,
+                 redid_array:np.ndarray,receive_array:np.ndarray):
+        self.send_array = send_array
+        self.compute_array = compute_array
+        self.redid_array = redid_array
+        self.receive_array = receive_array
+
+    @classmethod
+    def empty(cls,send_num:int,compute_num:int,redid_num:int,receive_num:int)->'CommandTrace':
+        """
+        预先分配好的 trace, 生成器可以直接按列填充, 不需要构建指令对象
+        """
+        return cls(
+            np.zeros(send_num, dtype=send_trace_dtype),
+            np.zeros(compute_num, dtype=compute_trace_dtype),
+            np.zeros(redid_num, dtype=np.int32),
+            np.zeros(receive_num, dtype=receive_trace_dtype),
+        )
+
+    @classmethod
+    def from_commands(cls,send_command_list:list[SendCommand],
+                      receive_command_list:list[ReceiveBaseCommand],
+                      compute_command_list:list[ComputeCommand])->'CommandTrace':
+        send_array = np.array([encode_send_command(command) for command in send_command_list],
+                              dtype=send_trace_dtype)
+
+        compute_row_list = []
+        redid_list:list[int] = []
+        for command in compute_command_list:
+            compute_row_list.append(encode_compute_command(command, len(redid_list)))
+            redid_list.extend(command.redid)
+        compute_array = np.array(compute_row_list, dtype=compute_trace_dtype)
+        redid_array = np.array(redid_list, dtype=np.int32)
+
+        receive_array = np.array([encode_receive_command(command) for command in receive_command_list],
+                                 dtype=receive_trace_dtype)
+
+        return cls(send_array, compute_array, redid_array, receive_array)
+
+    def save(self,trace_dir:str):
+        os.makedirs(trace_dir, exist_ok=True)
+        for attr, file_name in self.file_name_dict.items():
+            np.save(os.path.join(trace_dir, file_name), getattr(self, attr))
+
+    @classmethod
+    def load(cls,trace_dir:str,mmap:bool = True)->'CommandTrace':
+        mmap_mode = 'r' if mmap else None
+        array_dict = {
+            attr: np.load(os.path.join(trace_dir, file_name), mmap_mode=mmap_mode)
+            for attr, file_name in cls.file_name_dict.items()
+        }
+        return cls(**array_dict)
+
+    @property
+    def send_commands(self)->SendCommandArray:
+        return SendCommandArray(self.send_array)
+
+    @property
+    def compute_commands(self)->ComputeCommandArray:
+        return ComputeCommandArray(self.compute_array, self.redid_array)
+
+    @property
+    def receive_commands(self)->ReceiveCommandArray:
+        return ReceiveCommandArray(self.receive_array)
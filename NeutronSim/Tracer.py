@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import json
+from typing import Any, Optional
+
+"""
+Chrome Trace Event 格式的时间线, 可以直接用 Perfetto (ui.perfetto.dev) 或者 chrome://tracing 打开
+事件先写入固定大小的缓冲区, 满了之后追加写入文件, 内存占用与仿真规模无关
+"""
+
+
+class ChromeTracer:
+    """
+    每个 process 对应一个部件, 例如 send_engine.0 / atom.3 / receive_engine
+    每个 thread 对应部件中的一个流水级, command 表示整条指令
+    仿真时间的单位是 ns, trace 中的时间单位是 us
+    """
+
+    def __init__(self,path:str,buffer_size:int=65536):
+        self.path = path
+        self.buffer_size = buffer_size
+
+        self.event_buffer:list[Optional[str]] = [None]*buffer_size
+        self.event_num:int = 0
+
+        # (process name, thread name) -> (pid, tid)
+        self.track_dict:dict[tuple[str,str],tuple[int,int]] = {}
+        self.pid_dict:dict[str,int] = {}
+
+        self.total_event_num:int = 0
+
+        self.file = open(self.path,'w')
+        self.file.write('{"displayTimeUnit":"ns","traceEvents":[\n')
+        self.first_flush:bool = True
+
+        self.closed:bool = False
+
+    def get_track(self,process_name:str,thread_name:str)->tuple[int,int]:
+        track_key = (process_name,thread_name)
+        if track_key not in self.track_dict:
+            if process_name not in self.pid_dict:
+                pid = len(self.pid_dict)
+                self.pid_dict[process_name] = pid
+                self.add_event({'name':'process_name','ph':'M','pid':pid,'tid':0,'args':{'name':process_name}})
+            pid = self.pid_dict[process_name]
+
+            tid = sum(1 for key in self.track_dict if key[0] == process_name)
+            self.track_dict[track_key] = (pid,tid)
+            self.add_event({'name':'thread_name','ph':'M','pid':pid,'tid':tid,'args':{'name':thread_name}})
+        return self.track_dict[track_key]
+
+    def add_complete_event(self,name:str,track:tuple[int,int],begin_time:int,end_time:int,
+                           args:Optional[dict[str,Any]]=None):
+        event = {'name':name,'ph':'X','pid':track[0],'tid':track[1],
+                 'ts':begin_time/1000,'dur':(end_time-begin_time)/1000}
+        if args:
+            event['args'] = args
+        self.add_event(event)
+
+    def add_event(self,event:dict[str,Any]):
+        self.event_buffer[self.event_num] = json.dumps(event,separators=(',',':'))
+        self.event_num += 1
+        self.total_event_num += 1
+        if self.event_num == self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.event_num == 0:
+            return
+
+        if not self.first_flush:
+            self.file.write(',\n')
+        self.file.write(',\n'.join(self.event_buffer[:self.event_num]))
+        self.first_flush = False
+
+        self.event_num = 0
+        self.file.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        self.flush()
+        self.file.write('\n]}\n')
+        self.file.close()
+        self.closed = True
+
+    def __enter__(self)->ChromeTracer:
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.close()
@@ -0,0 +1,8 @@
+from Desim.Core import SimSession
+
+
+def get_sim_cycle()->int:
+    """
+    当前的仿真时间, 只取 cycle 部分
+    """
+    return SimSession.sim_time.cycle
@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import math
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from NeutronSim.Utils import get_sim_cycle
+
+"""
+ReceiveEngine 中 act / mul / add / quant 共用的向量单元
+每个 chunk 占用向量单元 occupancy 个周期, 占用结束之后才能发射下一个 chunk
+结果在占用结束之后再经过 latency 个周期 (流水线深度) 才能写出, 所以连续的 chunk 可以流水执行
+"""
+
+
+@dataclass
+class VectorOpConfig:
+    latency:int = 4 # ns, 流水线深度
+    throughput:float = 1.0 # 每条 lane 每 ns 处理的元素个数, 超越函数一般小于 1
+
+
+def default_act_op_dict()->dict[int,VectorOpConfig]:
+    # act 编码与 ReceiveCommand.act 一致, 0 表示不做激活
+    return {
+        1:VectorOpConfig(latency=2,throughput=1.0), # relu 之类的比较
+        2:VectorOpConfig(latency=16,throughput=0.25),
+        3:VectorOpConfig(latency=16,throughput=0.25),
+        4:VectorOpConfig(latency=12,throughput=0.5),
+        5:VectorOpConfig(latency=12,throughput=0.5),
+        6:VectorOpConfig(latency=20,throughput=0.25),
+    }
+
+
+@dataclass
+class VectorEngineConfig:
+    lanes:int = 64
+    # 每条 lane 的宽度, fp32 的元素需要占用两条 lane
+    lane_bytes:int = 2
+
+    act_op_dict:dict[int,VectorOpConfig] = field(default_factory=default_act_op_dict)
+    mul_op:VectorOpConfig = field(default_factory=lambda:VectorOpConfig(latency=4,throughput=1.0))
+    add_op:VectorOpConfig = field(default_factory=lambda:VectorOpConfig(latency=2,throughput=1.0))
+    quant_op:VectorOpConfig = field(default_factory=lambda:VectorOpConfig(latency=8,throughput=0.5))
+
+    # 流水级之间 DelayFIFO 的大小, 即每一级最多有多少个 chunk 还在流水线中
+    max_inflight_chunk:int = 4
+
+
+class VectorEngine:
+    """
+    不是 SimModule, 只记录向量单元下一次可以发射的时间, 由调用它的流水级负责等待
+    """
+
+    def __init__(self,vector_engine_config:VectorEngineConfig=VectorEngineConfig()):
+        self.vector_engine_config = vector_engine_config
+
+        self.next_issue_time:int = 0
+
+    def check_act(self,act:int):
+        # 0 表示不做激活
+        if act and act not in self.vector_engine_config.act_op_dict:
+            raise ValueError(f'unknown act code {act}, '
+                             f'supported act codes are {sorted(self.vector_engine_config.act_op_dict)}')
+
+    def check_act_array(self,act_array:np.ndarray):
+        # trace 中整列检查, 不需要逐条解码
+        unknown_array = act_array[~np.isin(act_array,[0,*self.vector_engine_config.act_op_dict])]
+        if len(unknown_array) > 0:
+            self.check_act(int(unknown_array[0]))
+
+    def get_act_op(self,act:int)->VectorOpConfig:
+        self.check_act(act)
+        return self.vector_engine_config.act_op_dict[act]
+
+    def get_occupancy(self,op_config:VectorOpConfig,num_elements:int,batch_size:int,element_bytes:int)->int:
+        config = self.vector_engine_config
+        lane_per_element = max(1,math.ceil(element_bytes / config.lane_bytes))
+        element_per_ns = config.lanes * op_config.throughput / lane_per_element
+        return math.ceil(num_elements * batch_size / element_per_ns)
+
+    def issue(self,op_config:VectorOpConfig,num_elements:int,batch_size:int,element_bytes:int)->tuple[int,int]:
+        """
+        返回 (调用者需要等待的时间, 占用的周期数), 等待结束之后结果还需要 op_config.latency 才能写出
+        """
+        current_time = get_sim_cycle()
+        occupancy = self.get_occupancy(op_config,num_elements,batch_size,element_bytes)
+
+        start_time = max(current_time,self.next_issue_time)
+        self.next_issue_time = start_time + occupancy
+        return self.next_issue_time - current_time,occupancy
@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Callable
+
+from NeutronSim.ArrayMemory import preload_range
+from NeutronSim.Chip import Chip
+from NeutronSim.Commands import SendCommand, ComputeCommand, ReceiveCommand
+from NeutronSim.Config import element_bytes_dict
+
+"""
+参数化生成的合成 workload, 用于 benchmark
+每一层都是 test_chip 中 (k_split, n_split) 场景的推广:
+    k 方向切分为 k_split 份, 每一份输入通过一条 SEND 指令发送给 n_split 个 atom
+    一条 COMPUTE 指令在所有 atom 上计算, 同一列的 atom 把结果累加到 reduce buffer 中
+    一条 RECEIVE 指令读取 reduce buffer (需要 k_split 次写入), 写回 l3 作为下一层的输入
+"""
+
+
+@dataclass
+class LayerShape:
+    # 以 chunk 为单位的输入 (K) 和输出 (N) 大小
+    k_chunk_num:int = 32
+    n_chunk_num:int = 32
+
+
+@dataclass
+class WorkloadConfig:
+    name:str = 'workload'
+
+    num_atoms:int = 8
+    k_split:int = 4
+
+    chunk_size:int = 128
+    batch_size:int = 16
+    dtype:str = 'fp16'
+
+    layer_list:list[LayerShape] = field(default_factory=lambda:[LayerShape()])
+
+    @property
+    def n_split(self)->int:
+        return self.num_atoms // self.k_split
+
+
+@dataclass
+class Workload:
+    config:WorkloadConfig
+    send_command_list:list[SendCommand] = field(default_factory=list)
+    compute_command_list:list[ComputeCommand] = field(default_factory=list)
+    receive_command_list:list[ReceiveCommand] = field(default_factory=list)
+
+    # 第一层的输入在 l3 中的位置, 仿真之前需要预先写入
+    input_addr:int = 0
+    input_chunk_num:int = 0
+
+    @property
+    def command_num(self)->int:
+        return len(self.send_command_list) + len(self.compute_command_list) + len(self.receive_command_list)
+
+    def preload(self,chip:Chip):
+        preload_range(chip.l3_memory,self.input_addr,self.input_chunk_num,
+                      self.config.chunk_size,self.config.batch_size,element_bytes_dict[self.config.dtype])
+
+
+def gen_workload(config:WorkloadConfig)->Workload:
+    """
+    每一层的输出写到 l3 中新的位置, 作为下一层的输入, 层与层之间通过 l3 的 tag 形成依赖
+    每一层的 l2 / reduce 地址也是新分配的, 不需要等待上一层释放
+    """
+    assert config.num_atoms % config.k_split == 0
+    n_split = config.n_split
+
+    workload = Workload(config)
+    workload.input_addr = 0
+    workload.input_chunk_num = config.layer_list[0].k_chunk_num
+
+    l3_addr = workload.input_addr
+    l2_addr = 0
+    reduce_addr = 0
+
+    for layer_id,layer in enumerate(config.layer_list):
+        assert layer.k_chunk_num % config.k_split == 0 and layer.n_chunk_num % n_split == 0
+        if layer_id > 0:
+            assert layer.k_chunk_num == config.layer_list[layer_id-1].n_chunk_num
+
+        src_chunk_num = layer.k_chunk_num // config.k_split
+        dst_chunk_num = layer.n_chunk_num // n_split
+
+        input_addr = l3_addr
+        output_addr = l3_addr + layer.k_chunk_num
+        l2_src_addr = l2_addr
+        l2_dst_addr = l2_addr + src_chunk_num
+
+        # atom = k * n_split + n
+        for k in range(config.k_split):
+            workload.send_command_list.append(SendCommand(
+                opcode='SEND',
+                group_id=[k*n_split + n for n in range(n_split)],
+                chunk_size=config.chunk_size,
+                batch_size=config.batch_size,
+                chunk_num=src_chunk_num,
+                dtype=config.dtype,
+                dst=l2_src_addr,
+                src=input_addr + k*src_chunk_num,
+                free=False,
+            ))
+
+        workload.compute_command_list.append(ComputeCommand(
+            opcode='COMPUTE',
+            group_id=list(range(config.num_atoms)),
+            batch_size=config.batch_size,
+            dst=l2_dst_addr,
+            dst_chunk_num=dst_chunk_num,
+            dst_chunk_size=config.chunk_size,
+            dst_free=True,
+            reddst=reduce_addr,
+            redid=[atom_id % n_split for atom_id in range(config.num_atoms)],
+            src=l2_src_addr,
+            src_chunk_num=src_chunk_num,
+            src_chunk_size=config.chunk_size,
+            src_dtype=config.dtype,
+            src_free=True,
+            first_acc=True,
+            last_acc=True,
+        ))
+
+        workload.receive_command_list.append(ReceiveCommand(
+            opcode='RECEIVE_MONO',
+            chunk_size=config.chunk_size,
+            batch_size=config.batch_size,
+            chunk_num=layer.n_chunk_num,
+            dst0=output_addr,
+            dst0_type=config.dtype,
+            dst1_flag=False,
+            src0=reduce_addr,
+            src0_dtype='fp32',
+            src0_loc='reduce',
+            free0=True,
+            redcount=config.k_split,
+            act=0,
+            mul=False,
+            add=False,
+        ))
+
+        l3_addr = output_addr
+        l2_addr = l2_dst_addr + dst_chunk_num
+        reduce_addr += layer.n_chunk_num
+
+    return workload
+
+
+def gen_gemv_stack(num_layers:int,hidden_chunk_num:int,num_atoms:int=8,k_split:int=4)->Workload:
+    """
+    decode 阶段的 GEMV, batch 为 1
+    """
+    return gen_workload(WorkloadConfig(
+        name=f'gemv_l{num_layers}_h{hidden_chunk_num}_a{num_atoms}',
+        num_atoms=num_atoms,k_split=k_split,batch_size=1,
+        layer_list=[LayerShape(hidden_chunk_num,hidden_chunk_num) for _ in range(num_layers)],
+    ))
+
+
+def gen_gemm_stack(num_layers:int,hidden_chunk_num:int,ffn_chunk_num:int,num_atoms:int=8,k_split:int=4,
+                   batch_size:int=16)->Workload:
+    """
+    类似 FFN 的 up / down 两层交替
+    """
+    layer_list:list[LayerShape] = []
+    for _ in range(num_layers):
+        layer_list.append(LayerShape(hidden_chunk_num,ffn_chunk_num))
+        layer_list.append(LayerShape(ffn_chunk_num,hidden_chunk_num))
+
+    return gen_workload(WorkloadConfig(
+        name=f'gemm_l{num_layers}_h{hidden_chunk_num}_f{ffn_chunk_num}_a{num_atoms}',
+        num_atoms=num_atoms,k_split=k_split,batch_size=batch_size,
+        layer_list=layer_list,
+    ))
+
+
+def gen_case_dict(quick:bool)->dict[str,Callable[[],Workload]]:
+    """
+    benchmark 使用的 case, quick 的时候规模更小
+    """
+    scale_list = [1,2] if quick else [1,4,16]
+
+    case_dict:dict[str,Callable[[],Workload]] = {}
+
+    # 增加 chunk 数量
+    for scale in scale_list:
+        chunk_num = 32*scale
+        case_dict[f'chunks_{chunk_num}'] = lambda chunk_num=chunk_num: gen_workload(WorkloadConfig(
+            name=f'chunks_{chunk_num}',layer_list=[LayerShape(chunk_num,chunk_num)]))
+
+    # 增加指令数量
+    for scale in scale_list:
+        layer_num = 4*scale
+        case_dict[f'commands_{layer_num}'] = lambda layer_num=layer_num: gen_workload(WorkloadConfig(
+            name=f'commands_{layer_num}',layer_list=[LayerShape(32,32) for _ in range(layer_num)]))
+
+    # 增加 atom 数量
+    for num_atoms in ([8,16] if quick else [8,16,32,64]):
+        case_dict[f'atoms_{num_atoms}'] = lambda num_atoms=num_atoms: gen_workload(WorkloadConfig(
+            name=f'atoms_{num_atoms}',num_atoms=num_atoms,k_split=4,
+            layer_list=[LayerShape(64,num_atoms*8)]))
+
+    # 按层堆叠的 GEMV / GEMM
+    case_dict['gemv_stack'] = lambda: gen_gemv_stack(2 if quick else 8,32)
+    case_dict['gemm_stack'] = lambda: gen_gemm_stack(1 if quick else 4,32,128)
+
+    return case_dict
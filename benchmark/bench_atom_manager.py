@@ -0,0 +1,90 @@
+import random
+import time
+
+from Desim.Core import SimModule, SimSession, SimTime, Event
+from Desim.memory.Memory import ChunkMemory
+
+from NeutronSim.Atom import AtomManager, AtomResourceRequest
+from NeutronSim.Config import LinkConfig, MemoryConfig, AtomConfig
+
+"""
+AtomManager 仲裁器的 microbenchmark
+多个 requester 随机申请一组 atom 的 link 资源, 持有一段时间之后释放
+统计不同 requester 数量下每秒能处理的请求数
+"""
+
+
+class ArbiterRequester(SimModule):
+    def __init__(self,atom_manager:AtomManager,requester_id:int,request_num:int,
+                 num_atoms:int,group_size:int,hold_time:int,seed:int):
+        super().__init__()
+
+        self.atom_manager = atom_manager
+        self.requester_id = requester_id
+        self.request_num = request_num
+        self.num_atoms = num_atoms
+        self.group_size = group_size
+        self.hold_time = hold_time
+
+        self.rng = random.Random(seed)
+        self.acquire_finish_event = Event()
+
+        self.register_coroutine(self.process)
+
+    def process(self):
+        for i in range(self.request_num):
+            group_id = self.rng.sample(range(self.num_atoms),self.group_size)
+
+            self.atom_manager.handle_acquire_request(AtomResourceRequest(
+                resource_type='link',
+                access_type='acquire',
+                resources_id=group_id,
+                requester_id=self.requester_id,
+                acquire_finish_event=self.acquire_finish_event,
+            ))
+            SimModule.wait(self.acquire_finish_event)
+
+            SimModule.wait_time(SimTime(self.hold_time))
+
+            self.atom_manager.handle_release_request(AtomResourceRequest(
+                resource_type='link',
+                access_type='release',
+                resources_id=group_id,
+                requester_id=self.requester_id,
+            ))
+            SimModule.wait_time(SimTime(1))
+
+
+def run_arbiter_bench(num_requester:int,request_num:int,group_size:int=2,hold_time:int=10,seed:int=0)->dict:
+    SimSession.reset()
+    SimSession.init()
+
+    atom_manager = AtomManager(None,LinkConfig(),MemoryConfig(),AtomConfig())
+    atom_manager.load_command([])
+    atom_manager.config_connection(ChunkMemory(MemoryConfig().bandwidth))
+    num_atoms = len(atom_manager.atom_instance_dict)
+
+    for i in range(num_requester):
+        ArbiterRequester(atom_manager,i,request_num,num_atoms,group_size,hold_time,seed+i)
+
+    start = time.perf_counter()
+    SimSession.scheduler.run()
+    wall_time = time.perf_counter() - start
+
+    total_request = num_requester * request_num
+    return {
+        'num_requester': num_requester,
+        'total_request': total_request,
+        'wall_time': wall_time,
+        'request_per_second': total_request / wall_time,
+        'sim_time': SimSession.sim_time.cycle,
+    }
+
+
+if __name__ == '__main__':
+    for num_requester in [4,16,64,256]:
+        result = run_arbiter_bench(num_requester,request_num=200)
+        print(f"requester {result['num_requester']:>4} | "
+              f"requests {result['total_request']:>6} | "
+              f"{result['request_per_second']:>10.0f} req/s | "
+              f"wall {result['wall_time']:.3f} s")
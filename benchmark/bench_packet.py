@@ -0,0 +1,80 @@
+import argparse
+import gc
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from Desim.Core import SimSession
+
+from NeutronSim.Chip import Chip
+from NeutronSim.Config import LinkConfig, MemoryConfig, AtomConfig, TopologyConfig
+from NeutronSim.Packet import set_flyweight_enabled
+from NeutronSim.Utils import get_sim_cycle
+from NeutronSim.Workload import gen_case_dict
+
+"""
+比较共用 chunk packet 前后的 GC 开销
+通过 gc.callbacks 统计每一代的回收次数和回收花费的时间, 每种模式在单独的子进程中运行
+"""
+
+
+def run_case(name:str,quick:bool,flyweight:bool)->dict:
+    set_flyweight_enabled(flyweight)
+    workload = gen_case_dict(quick)[name]()
+
+    SimSession.reset()
+    SimSession.init()
+    chip = Chip(LinkConfig(),MemoryConfig(),MemoryConfig(),MemoryConfig(),AtomConfig(),
+                TopologyConfig(num_atoms=workload.config.num_atoms))
+    chip.load_command(workload.send_command_list,workload.receive_command_list,workload.compute_command_list)
+    workload.preload(chip)
+
+    collection_num = [0,0,0]
+    gc_time = [0.0]
+    gc_start_time = [0.0]
+
+    def gc_callback(phase:str,info:dict):
+        if phase == 'start':
+            gc_start_time[0] = time.perf_counter()
+        else:
+            gc_time[0] += time.perf_counter() - gc_start_time[0]
+            collection_num[info['generation']] += 1
+
+    gc.collect()
+    gc.callbacks.append(gc_callback)
+    start_time = time.perf_counter()
+    SimSession.scheduler.run()
+    wall_time = time.perf_counter() - start_time
+    gc.callbacks.remove(gc_callback)
+
+    return {
+        'name':name,
+        'flyweight':flyweight,
+        'wall_time':wall_time,
+        'gc_time':gc_time[0],
+        'gc_collection_num':collection_num,
+        'sim_time':get_sim_cycle(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='GC time with and without flyweight chunk packets')
+    parser.add_argument('--output',default='packet_gc.json')
+    parser.add_argument('--quick',action='store_true')
+    args = parser.parse_args()
+
+    result_list = []
+    for name in gen_case_dict(args.quick):
+        for flyweight in [False,True]:
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                result = executor.submit(run_case,name,args.quick,flyweight).result()
+            print(f"{name:<16} flyweight {str(flyweight):<5}  wall {result['wall_time']:8.3f} s  "
+                  f"gc {result['gc_time']*1000:8.1f} ms  collections {result['gc_collection_num']}")
+            result_list.append(result)
+
+    with open(args.output,'w') as f:
+        json.dump(result_list,f,indent=2)
+
+
+if __name__ == '__main__':
+    main()
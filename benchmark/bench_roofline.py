@@ -0,0 +1,78 @@
+import argparse
+import json
+import time
+
+from Desim.Core import SimSession
+
+from NeutronSim.Chip import Chip
+from NeutronSim.Config import LinkConfig, MemoryConfig, AtomConfig, TopologyConfig
+from NeutronSim.Roofline import RooflineConfig, estimate_finish_time
+from NeutronSim.Utils import get_sim_cycle
+from NeutronSim.Workload import gen_case_dict
+
+"""
+比较解析模型与完整的事件仿真在 benchmark workload 上的结果
+相对误差 = (估计值 - 仿真值) / 仿真值, 负数表示估计偏乐观
+"""
+
+
+def compare_case(name:str,quick:bool)->dict:
+    workload = gen_case_dict(quick)[name]()
+    config = workload.config
+    topology_config = TopologyConfig(num_atoms=config.num_atoms)
+
+    start_time = time.perf_counter()
+    estimate = estimate_finish_time(workload.send_command_list,workload.receive_command_list,
+                                    workload.compute_command_list,RooflineConfig(topology_config=topology_config))
+    estimate_wall_time = time.perf_counter() - start_time
+
+    SimSession.reset()
+    SimSession.init()
+    chip = Chip(LinkConfig(),MemoryConfig(),MemoryConfig(),MemoryConfig(),AtomConfig(),topology_config)
+    chip.load_command(workload.send_command_list,workload.receive_command_list,workload.compute_command_list)
+    workload.preload(chip)
+
+    start_time = time.perf_counter()
+    SimSession.scheduler.run()
+    sim_wall_time = time.perf_counter() - start_time
+    sim_time = get_sim_cycle()
+
+    return {
+        'name':name,
+        'estimate':estimate['estimate'],
+        'critical_path':estimate['critical_path'],
+        'bound_by':estimate['bound_by'],
+        'sim_time':sim_time,
+        'relative_error':(estimate['estimate'] - sim_time) / sim_time if sim_time > 0 else 0.0,
+        'estimate_wall_time':estimate_wall_time,
+        'sim_wall_time':sim_wall_time,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='roofline estimator vs event simulation')
+    parser.add_argument('--output',default='roofline_error.json')
+    parser.add_argument('--quick',action='store_true')
+    args = parser.parse_args()
+
+    result_list = []
+    for name in gen_case_dict(args.quick):
+        result = compare_case(name,args.quick)
+        print(f"{name:<16} estimate {result['estimate']:>10}  sim {result['sim_time']:>10}  "
+              f"error {result['relative_error']:+7.1%}  bound by {result['bound_by']}  "
+              f"({result['estimate_wall_time']*1000:.1f} ms vs {result['sim_wall_time']:.2f} s)")
+        result_list.append(result)
+
+    abs_error_list = [abs(result['relative_error']) for result in result_list]
+    summary = {
+        'max_abs_error':max(abs_error_list,default=0.0),
+        'mean_abs_error':sum(abs_error_list) / len(abs_error_list) if abs_error_list else 0.0,
+    }
+    print(f"max |error| {summary['max_abs_error']:.1%}, mean |error| {summary['mean_abs_error']:.1%}")
+
+    with open(args.output,'w') as f:
+        json.dump({'summary':summary,'results':result_list},f,indent=2)
+
+
+if __name__ == '__main__':
+    main()
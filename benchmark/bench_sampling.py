@@ -0,0 +1,55 @@
+import argparse
+import json
+
+from NeutronSim.Config import TopologyConfig
+from NeutronSim.Sampling import SamplingConfig, run_sampled
+from NeutronSim.Sweep import SweepPoint, run_sweep_point
+from NeutronSim.Workload import gen_gemv_stack, gen_gemm_stack
+
+"""
+比较采样仿真与完整仿真在重复层 workload 上的完成时间和仿真速度
+"""
+
+
+def compare_case(workload,sampling_config:SamplingConfig)->dict:
+    point = SweepPoint(topology_config=TopologyConfig(num_atoms=workload.config.num_atoms))
+    command_lists = (workload.send_command_list,workload.receive_command_list,workload.compute_command_list)
+
+    sampled = run_sampled(point,*command_lists,preload_function=workload.preload,sampling_config=sampling_config)
+    full = run_sweep_point(point,lambda _: command_lists,lambda chip,_: workload.preload(chip))
+
+    finish_time = full['finish_time']
+    return {
+        'name':workload.config.name,
+        **sampled,
+        'finish_time':finish_time,
+        'relative_error':(sampled['estimate'] - finish_time) / finish_time if finish_time > 0 else 0.0,
+        'in_bounds':sampled['lower'] <= finish_time <= sampled['upper'],
+        'full_wall_time':full['wall_time'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='sampled simulation vs full simulation')
+    parser.add_argument('--output',default='sampling_error.json')
+    parser.add_argument('--layers',type=int,default=80)
+    parser.add_argument('--warmup',type=int,default=2)
+    parser.add_argument('--sample',type=int,default=4)
+    args = parser.parse_args()
+
+    sampling_config = SamplingConfig(warmup_block_num=args.warmup,sample_block_num=args.sample)
+    result_list = []
+    for workload in [gen_gemv_stack(args.layers,32),gen_gemm_stack(args.layers // 2,32,128)]:
+        result = compare_case(workload,sampling_config)
+        print(f"{result['name']:<28} estimate {result['estimate']:>12.0f} "
+              f"[{result['lower']:.0f}, {result['upper']:.0f}]  full {result['finish_time']:>10}  "
+              f"error {result['relative_error']:+7.2%}  "
+              f"wall {result['wall_time']:.2f} s vs {result['full_wall_time']:.2f} s")
+        result_list.append(result)
+
+    with open(args.output,'w') as f:
+        json.dump(result_list,f,indent=2)
+
+
+if __name__ == '__main__':
+    main()
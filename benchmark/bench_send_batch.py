@@ -0,0 +1,73 @@
+import argparse
+import json
+
+from NeutronSim.ArrayMemory import preload_range
+from NeutronSim.Commands import SendCommand
+from NeutronSim.Config import LinkConfig, TopologyConfig, element_bytes_dict
+from NeutronSim.Sweep import SweepPoint, run_sweep_point
+
+"""
+SEND 拆分为 batch 之后的 link 利用率
+权重搬运为主的 trace: 相邻的两条 SEND 发往同一组 atom, 不拆分的时候后一条 SEND 占住一个 sub send engine
+等待前一条结束, 后面发往其他 atom 的 SEND 读不出来, 这些 link 空闲
+link 利用率 = 所有 link 上传输的字节数 / (link 带宽 x link 数量 x 完成时间)
+"""
+
+num_atoms = 8
+chunk_size = 128
+batch_size = 16
+dtype = 'fp16'
+
+
+def gen_send_command_list(chunk_num:int,group_size:int,repeat:int)->list[SendCommand]:
+    send_command_list:list[SendCommand] = []
+    for group_start in range(0,num_atoms,group_size):
+        for i in range(repeat):
+            send_command_list.append(SendCommand(opcode='SEND',group_id=list(range(group_start,group_start+group_size)),
+                                                 chunk_size=chunk_size,batch_size=batch_size,chunk_num=chunk_num,
+                                                 dtype=dtype,dst=i*chunk_num,src=0,free=False))
+    return send_command_list
+
+
+def run_case(chunk_num:int,group_size:int,repeat:int,batch_chunk_num:int)->dict:
+    send_command_list = gen_send_command_list(chunk_num,group_size,repeat)
+    point = SweepPoint(topology_config=TopologyConfig(num_atoms=num_atoms,send_batch_chunk_num=batch_chunk_num),
+                       perf_report=False)
+    result = run_sweep_point(point,lambda _: (send_command_list,[],[]),
+                             lambda chip,_: preload_range(chip.l3_memory,0,chunk_num,chunk_size,batch_size,
+                                                          element_bytes_dict[dtype]))
+
+    link_config = LinkConfig()
+    chunk_bytes = chunk_size * batch_size * element_bytes_dict[dtype]
+    total_bytes = sum(command.chunk_num * chunk_bytes * len(command.group_id) for command in send_command_list)
+    finish_time = result['finish_time']
+    return {
+        'batch_chunk_num':batch_chunk_num,
+        'finish_time':finish_time,
+        'link_utilization':total_bytes / (link_config.bandwidth * num_atoms * finish_time) if finish_time > 0 else 0.0,
+        'wall_time':result['wall_time'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='link utilization with and without SEND batching')
+    parser.add_argument('--output',default='send_batch.json')
+    parser.add_argument('--chunk-num',type=int,default=256)
+    parser.add_argument('--group-size',type=int,default=2)
+    parser.add_argument('--repeat',type=int,default=2,help='每组 atom 连续的 SEND 数量')
+    parser.add_argument('--batch-chunk-num',type=int,action='append',default=None)
+    args = parser.parse_args()
+
+    result_list = []
+    for batch_chunk_num in args.batch_chunk_num or [0,64,32]:
+        result = run_case(args.chunk_num,args.group_size,args.repeat,batch_chunk_num)
+        print(f"batch {result['batch_chunk_num']:>4}  finish {result['finish_time']:>10}  "
+              f"link utilization {result['link_utilization']:6.1%}  wall {result['wall_time']:.2f} s")
+        result_list.append(result)
+
+    with open(args.output,'w') as f:
+        json.dump(result_list,f,indent=2)
+
+
+if __name__ == '__main__':
+    main()
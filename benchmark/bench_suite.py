@@ -0,0 +1,124 @@
+import argparse
+import json
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from Desim.Core import SimSession
+
+from NeutronSim.Chip import Chip
+from NeutronSim.Config import LinkConfig, MemoryConfig, AtomConfig, TopologyConfig
+from NeutronSim.Utils import get_sim_cycle
+from NeutronSim.Workload import gen_case_dict
+
+"""
+合成 workload 的 benchmark suite
+每个 case 在单独的子进程中运行, peak RSS 才不会被之前的 case 影响
+结果写入 json 文件, 用于比较不同版本的仿真速度
+"""
+
+
+def run_case(name:str,quick:bool,count_events:bool,send_batch_chunk_num:int=0,memory_model:str='chunk')->dict:
+    workload = gen_case_dict(quick)[name]()
+    config = workload.config
+
+    SimSession.reset()
+    SimSession.init()
+
+    # array 模型下 DMA 按 burst 访问 memory, chunk 模型逐个 chunk 访问
+    memory_config = MemoryConfig(memory_model=memory_model)
+    chip = Chip(LinkConfig(),memory_config,memory_config,memory_config,AtomConfig(),
+                TopologyConfig(num_atoms=config.num_atoms,send_batch_chunk_num=send_batch_chunk_num))
+    chip.load_command(workload.send_command_list,workload.receive_command_list,workload.compute_command_list)
+    workload.preload(chip)
+
+    # 每次 greenlet 切换就是一次事件的处理
+    event_num = [0]
+    previous_trace_function = None
+    if count_events:
+        import greenlet
+
+        def trace_function(event,args):
+            event_num[0] += 1
+        previous_trace_function = greenlet.settrace(trace_function)
+
+    start_time = time.perf_counter()
+    SimSession.scheduler.run()
+    wall_time = time.perf_counter() - start_time
+
+    if count_events:
+        import greenlet
+        greenlet.settrace(previous_trace_function)
+
+    sim_time = get_sim_cycle()
+    return {
+        'name':name,
+        'memory_model':memory_model,
+        'num_atoms':config.num_atoms,
+        'layer_num':len(config.layer_list),
+        'command_num':workload.command_num,
+        'wall_time':wall_time,
+        # linux 上的单位是 KB
+        'peak_rss_kb':resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'event_num':event_num[0] if count_events else None,
+        'sim_time':sim_time,
+        'sim_ns_per_wall_s':sim_time / wall_time if wall_time > 0 else 0.0,
+    }
+
+
+def get_git_version()->str:
+    try:
+        return subprocess.check_output(['git','describe','--always','--dirty'],text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError,subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='NeutronSim benchmark suite')
+    parser.add_argument('--output',default='bench_results.json')
+    parser.add_argument('--quick',action='store_true',help='只运行较小的 case')
+    parser.add_argument('--case',action='append',default=None,help='只运行指定的 case, 可以重复')
+    parser.add_argument('--no-events',action='store_true',help='不统计事件数, 去掉 settrace 的开销')
+    parser.add_argument('--send-batch-chunk-num',type=int,default=0,help='SEND 拆分为 batch 的 chunk 数, 0 表示不拆分')
+    parser.add_argument('--memory-model',action='append',choices=['chunk','array'],default=None,
+                        help='memory 模型, 可以重复, 同一个 case 依次运行并比较事件数')
+    args = parser.parse_args()
+    memory_model_list = args.memory_model or ['chunk']
+
+    name_list = args.case or list(gen_case_dict(args.quick).keys())
+
+    result_list = []
+    for name in name_list:
+        event_num_dict:dict[str,int] = {}
+        for memory_model in memory_model_list:
+            # 每个 case 一个新的进程
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                result = executor.submit(run_case,name,args.quick,not args.no_events,
+                                         args.send_batch_chunk_num,memory_model).result()
+            print(f"{name:<16} {memory_model:<6} wall {result['wall_time']:8.3f} s  "
+                  f"rss {result['peak_rss_kb']/1024:8.1f} MB  events {result['event_num']}  sim {result['sim_time']} ns")
+            result_list.append(result)
+            if result['event_num'] is not None:
+                event_num_dict[memory_model] = result['event_num']
+
+        if 'chunk' in event_num_dict and 'array' in event_num_dict and event_num_dict['array'] > 0:
+            print(f"{name:<16} events chunk / array {event_num_dict['chunk'] / event_num_dict['array']:.2f}")
+
+    with open(args.output,'w') as f:
+        json.dump({
+            'version':get_git_version(),
+            'python':sys.version,
+            'platform':platform.platform(),
+            'quick':args.quick,
+            'send_batch_chunk_num':args.send_batch_chunk_num,
+            'memory_model_list':memory_model_list,
+            'results':result_list,
+        },f,indent=2)
+
+
+if __name__ == '__main__':
+    main()
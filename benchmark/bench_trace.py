@@ -0,0 +1,87 @@
+import argparse
+import json
+import os
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from Desim.Core import SimSession
+
+from NeutronSim.Chip import Chip
+from NeutronSim.Config import LinkConfig, MemoryConfig, AtomConfig, TopologyConfig
+from NeutronSim.Trace import CommandTrace
+from NeutronSim.Utils import get_sim_cycle
+from NeutronSim.Workload import gen_gemv_stack
+
+"""
+比较大 trace 的两种加载方式: 指令对象的 list, 以及 memmap 加载的二进制 trace
+每种方式在单独的子进程中运行, peak RSS 包括指令本身占用的内存
+wall time 分为加载 (生成 list 或者打开 trace) 和仿真两部分
+"""
+
+
+def run_case(mode:str,num_layers:int,hidden_chunk_num:int,trace_dir:str)->dict:
+    start_time = time.perf_counter()
+    # trace 模式只需要第一层的输入位置用于 preload, 与完整 workload 相同
+    workload = gen_gemv_stack(num_layers if mode == 'list' else 1,hidden_chunk_num)
+
+    SimSession.reset()
+    SimSession.init()
+    chip = Chip(LinkConfig(),MemoryConfig(),MemoryConfig(),MemoryConfig(),AtomConfig(),
+                TopologyConfig(num_atoms=workload.config.num_atoms))
+    if mode == 'trace':
+        trace = CommandTrace.load(trace_dir)
+        chip.load_trace(trace)
+        command_num = len(trace.send_array) + len(trace.compute_array) + len(trace.receive_array)
+    else:
+        chip.load_command(workload.send_command_list,workload.receive_command_list,workload.compute_command_list)
+        command_num = workload.command_num
+    workload.preload(chip)
+    load_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    SimSession.scheduler.run()
+    wall_time = time.perf_counter() - start_time
+
+    return {
+        'mode':mode,
+        'command_num':command_num,
+        'load_time':load_time,
+        'wall_time':wall_time,
+        # linux 上的单位是 KB
+        'peak_rss_kb':resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'sim_time':get_sim_cycle(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='peak memory and wall time of trace vs list commands')
+    parser.add_argument('--output',default='trace_load.json')
+    parser.add_argument('--layers',type=int,default=2000)
+    parser.add_argument('--hidden-chunk-num',type=int,default=8)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as trace_dir:
+        workload = gen_gemv_stack(args.layers,args.hidden_chunk_num)
+        CommandTrace.from_commands(workload.send_command_list,workload.receive_command_list,
+                                   workload.compute_command_list).save(trace_dir)
+        del workload
+        print(f"trace size {sum(os.path.getsize(os.path.join(trace_dir,name)) for name in os.listdir(trace_dir))/1024:.1f} KB")
+
+        result_list = []
+        for mode in ['list','trace']:
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                result = executor.submit(run_case,mode,args.layers,args.hidden_chunk_num,trace_dir).result()
+            print(f"{mode:<6} commands {result['command_num']}  load {result['load_time']:8.3f} s  "
+                  f"wall {result['wall_time']:8.3f} s  rss {result['peak_rss_kb']/1024:8.1f} MB  "
+                  f"sim {result['sim_time']} ns")
+            result_list.append(result)
+
+    assert result_list[0]['sim_time'] == result_list[1]['sim_time']
+    with open(args.output,'w') as f:
+        json.dump(result_list,f,indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+from Desim.Core import SimModule, SimSession, SimTime
+
+from NeutronSim.ArrayMemory import ArrayChunkMemory, ArrayChunkMemoryPort, burst_read, burst_write
+from NeutronSim.Config import MemoryConfig
+from NeutronSim.Sweep import SweepPoint, run_sweep_point
+from NeutronSim.Utils import get_sim_cycle
+from NeutronSim.Workload import gen_gemv_stack
+
+"""
+ArrayChunkMemoryPort 的 burst 访问与逐个 chunk 访问的时序相同, 以及通过 memory_tag 修改 tag 之后唤醒等待的访问
+array 与 chunk 两种 memory 模型在同一个 workload 上的完成时间相同
+"""
+
+
+# 每个 chunk 16 字节, 带宽 10, 每个 chunk 需要 2 个周期
+chunk_shape = (8,1,2)
+chunk_num = 4
+
+
+class LoggedMemory(ArrayChunkMemory):
+    # 记录每个地址写入以及释放的时间
+    def __init__(self,*args,**kwargs):
+        super().__init__(*args,**kwargs)
+        self.log_list:list[tuple[str,int,int]] = []
+
+    def store(self,addr:int,*args,**kwargs):
+        super().store(addr,*args,**kwargs)
+        self.log_list.append(('store',addr,get_sim_cycle()))
+
+    def clear(self,addr:int):
+        super().clear(addr)
+        self.log_list.append(('clear',addr,get_sim_cycle()))
+
+
+class Runner(SimModule):
+    def __init__(self,handler):
+        super().__init__()
+        self.register_coroutine(handler)
+
+
+def run_read_write(burst:bool)->tuple[list[tuple[int,int]],list[tuple[str,int,int]]]:
+    """
+    读取并释放 4 个 chunk, 同时另一个 port 向这 4 个地址写入新的数据, 写入需要等待各自的地址被释放
+    """
+    SimSession.reset()
+    SimSession.init()
+
+    memory = LoggedMemory(bandwidth=10,size=16)
+    memory.init_range(0,chunk_num,*chunk_shape)
+    read_port = ArrayChunkMemoryPort()
+    read_port.config_chunk_memory(memory)
+    write_port = ArrayChunkMemoryPort()
+    write_port.config_chunk_memory(memory)
+
+    read_list:list[tuple[int,int]] = []
+
+    def read_helper():
+        if burst:
+            burst_read(read_port,0,chunk_num,1,True,*chunk_shape,
+                       lambda i,data,finish_time: read_list.append((i,finish_time)))
+            return
+        for i in range(chunk_num):
+            read_port.read(i,1,True,*chunk_shape)
+            read_list.append((i,get_sim_cycle()))
+
+    def write_helper():
+        if burst:
+            burst_write(write_port,0,[None]*chunk_num,True,*chunk_shape)
+            return
+        for i in range(chunk_num):
+            write_port.write(i,None,True,*chunk_shape)
+
+    Runner(read_helper)
+    Runner(write_helper)
+    SimSession.scheduler.run()
+    return read_list,memory.log_list
+
+
+def test_burst_timing():
+    burst_read_list,burst_log_list = run_read_write(True)
+    read_list,log_list = run_read_write(False)
+
+    assert burst_read_list == read_list == [(i,2*(i+1)) for i in range(chunk_num)]
+    # 每个地址在读取结束的时候释放, 写入在释放之后开始, 与逐个 chunk 访问完全相同
+    # 同一个周期中的读写可能交替执行, 按时间排序之后比较
+    assert sorted(burst_log_list,key=lambda log:(log[2],log[1],log[0])) == \
+           sorted(log_list,key=lambda log:(log[2],log[1],log[0]))
+    clear_time_dict = {addr:time for op,addr,time in log_list if op == 'clear'}
+    store_time_dict = {addr:time for op,addr,time in log_list if op == 'store'}
+    for addr in range(chunk_num):
+        assert clear_time_dict[addr] == 2*(addr+1)
+        assert store_time_dict[addr] >= clear_time_dict[addr] + 2
+
+
+def test_memory_tag_notify():
+    SimSession.reset()
+    SimSession.init()
+
+    memory = ArrayChunkMemory(bandwidth=10,size=16)
+    memory.init_range(6,7,*chunk_shape)
+    port = ArrayChunkMemoryPort()
+    port.config_chunk_memory(memory)
+    finish_time_dict:dict[str,int] = {}
+
+    def read_helper():
+        # 等待地址 5 写入两次
+        port.read(5,2,False,*chunk_shape)
+        finish_time_dict['read'] = get_sim_cycle()
+
+    def write_helper():
+        # 等待地址 6 被释放
+        port.write(6,None,True,*chunk_shape)
+        finish_time_dict['write'] = get_sim_cycle()
+
+    def tag_helper():
+        SimModule.wait_time(SimTime(10))
+        memory.memory_tag[5] = 2
+        SimModule.wait_time(SimTime(10))
+        del memory.memory_tag[6]
+
+    Runner(read_helper)
+    Runner(write_helper)
+    Runner(tag_helper)
+    SimSession.scheduler.run()
+
+    assert finish_time_dict == {'read':12,'write':22}
+    assert dict(memory.memory_tag) == {5:2,6:1}
+
+
+def test_memory_model_finish_time():
+    # 同一个 workload 在两种 memory 模型上的完成时间相同
+    workload = gen_gemv_stack(3,16)
+    finish_time_dict:dict[str,int] = {}
+    for memory_model in ['chunk','array']:
+        memory_config = MemoryConfig(memory_model=memory_model)
+        point = SweepPoint(l2_memory_config=memory_config,l3_memory_config=memory_config,
+                           reduce_memory_config=memory_config,perf_report=False)
+        result = run_sweep_point(point,lambda _: (workload.send_command_list,workload.receive_command_list,
+                                                  workload.compute_command_list),
+                                 lambda chip,_: workload.preload(chip))
+        finish_time_dict[memory_model] = result['finish_time']
+
+    assert finish_time_dict['chunk'] > 0
+    assert finish_time_dict['array'] == finish_time_dict['chunk']
@@ -0,0 +1,127 @@
+from dataclasses import replace
+
+import numpy as np
+from Desim.Core import SimSession
+
+from NeutronSim.ArrayMemory import ArrayChunkMemory, get_memory_state, set_memory_state
+from NeutronSim.Checkpoint import CheckpointCut, ChipCheckpoint, run_to_checkpoint
+from NeutronSim.Chip import Chip
+from NeutronSim.Config import LinkConfig, MemoryConfig, AtomConfig, TopologyConfig
+from NeutronSim.Utils import get_sim_cycle
+from NeutronSim.Workload import gen_gemv_stack
+
+"""
+在层的边界保存 checkpoint, 恢复之后继续仿真
+参考是先仿真切分位置之前的指令, 全部结束之后再仿真剩下的指令, 恢复之后的完成时间与参考完全相同
+"""
+
+
+num_layers = 4
+memory_config = MemoryConfig(memory_model='array')
+
+
+def build_chip(workload,send_command_list=None,receive_command_list=None,compute_command_list=None,
+               preload:bool=True)->Chip:
+    SimSession.reset()
+    SimSession.init()
+
+    chip = Chip(LinkConfig(),memory_config,memory_config,memory_config,AtomConfig(),
+                TopologyConfig(num_atoms=workload.config.num_atoms))
+    chip.load_command(workload.send_command_list if send_command_list is None else send_command_list,
+                      workload.receive_command_list if receive_command_list is None else receive_command_list,
+                      workload.compute_command_list if compute_command_list is None else compute_command_list)
+    if preload:
+        workload.preload(chip)
+    return chip
+
+
+def get_chip_memory_list(chip:Chip)->list:
+    return [chip.l3_memory,chip.reduce_memory] + \
+           [atom_instance.atom_die.l2_memory for atom_instance in chip.atom_manager.atom_instance_dict.values()]
+
+
+def get_chip_state(chip:Chip)->list[dict]:
+    return [get_memory_state(memory) for memory in get_chip_memory_list(chip)]
+
+
+def assert_state_equal(state_list:list[dict],other_state_list:list[dict]):
+    assert len(state_list) == len(other_state_list)
+    for state,other_state in zip(state_list,other_state_list):
+        assert state.keys() == other_state.keys()
+        for name,value in state.items():
+            if isinstance(value,np.ndarray):
+                assert np.array_equal(value,other_state[name])
+            else:
+                assert value == other_state[name]
+
+
+def test_checkpoint_restore(tmp_path):
+    workload = gen_gemv_stack(num_layers,16)
+    k_split = workload.config.k_split
+
+    chip = build_chip(workload)
+    SimSession.scheduler.run()
+    full_finish_time = get_sim_cycle()
+    full_state = get_chip_state(chip)
+
+    # 前两层之后切分, 每层 k_split 条 SEND, 一条 COMPUTE, 一条 RECEIVE
+    cut = CheckpointCut(send_command_num=2*k_split,receive_command_num=2,compute_command_num=2)
+    checkpoint = run_to_checkpoint(build_chip(workload),cut)
+    assert 0 < checkpoint.time_offset < full_finish_time
+    assert len(checkpoint.send_command_list) == (num_layers-2)*k_split
+    assert len(checkpoint.receive_command_list) == num_layers-2
+    assert len(checkpoint.compute_command_list) == num_layers-2
+
+    # 参考: 只仿真前两层的指令, 全部结束之后把 memory 的状态拷贝到新的 chip 上仿真剩下的指令
+    chip = build_chip(workload,workload.send_command_list[:cut.send_command_num],
+                      workload.receive_command_list[:cut.receive_command_num],
+                      workload.compute_command_list[:cut.compute_command_num])
+    SimSession.scheduler.run()
+    drain_time = get_sim_cycle()
+    drain_state = get_chip_state(chip)
+    assert checkpoint.time_offset == drain_time
+
+    chip = build_chip(workload,workload.send_command_list[cut.send_command_num:],
+                      workload.receive_command_list[cut.receive_command_num:],
+                      workload.compute_command_list[cut.compute_command_num:],preload=False)
+    for memory,memory_state in zip(get_chip_memory_list(chip),drain_state):
+        set_memory_state(memory,memory_state)
+    SimSession.scheduler.run()
+    resume_time = get_sim_cycle()
+
+    # 从保存到文件的 checkpoint 恢复, 与参考完全相同
+    path = str(tmp_path / 'checkpoint.pkl')
+    checkpoint.save(path)
+    SimSession.reset()
+    SimSession.init()
+    chip = ChipCheckpoint.load(path).restore()
+    SimSession.scheduler.run()
+
+    assert_state_equal(get_chip_state(chip),full_state)
+    restored_finish_time = checkpoint.time_offset + get_sim_cycle()
+    assert restored_finish_time == drain_time + resume_time
+    # 切分位置之前的指令全部结束之后才开始之后的指令, 不会比不中断的仿真更早
+    assert restored_finish_time >= full_finish_time
+
+    # config 修改之后从同一个 checkpoint 恢复
+    SimSession.reset()
+    SimSession.init()
+    replace(checkpoint,atom_config=AtomConfig(fast_compute=True)).restore()
+    SimSession.scheduler.run()
+    assert get_sim_cycle() > 0
+
+
+def test_array_memory_state():
+    memory = ArrayChunkMemory(bandwidth=16,size=16)
+    memory.store(3,'payload',128,16,2)
+    memory.store_range(40,[None,None],64,8,4)
+
+    restored_memory = ArrayChunkMemory(bandwidth=16,size=16)
+    set_memory_state(restored_memory,get_memory_state(memory))
+
+    assert dict(restored_memory.memory_tag) == {3:1,40:1,41:1}
+    assert restored_memory.payload_dict == {3:'payload'}
+    assert (restored_memory.num_elements[3],restored_memory.batch_size[3],restored_memory.element_bytes[3]) == \
+           (128,16,2)
+    assert (restored_memory.num_elements[41],restored_memory.batch_size[41],restored_memory.element_bytes[41]) == \
+           (64,8,4)
@@ -0,0 +1,62 @@
+import pytest
+
+from NeutronSim.ArrayMemory import preload_range
+from NeutronSim.Commands import SendCommand, ComputeCommand, ReceiveCommand
+from NeutronSim.Config import LinkConfig, TopologyConfig
+from NeutronSim.Sweep import SweepPoint, run_sweep_point
+from NeutronSim.Workload import gen_gemv_stack, gen_gemm_stack
+
+"""
+coalesce 模式与逐 chunk 的 link 模型的完成时间对比
+"""
+
+
+def run_finish_time(coalesce:bool,command_lists:tuple,preload_function,num_atoms:int=8)->int:
+    point = SweepPoint(d2d_link_config=LinkConfig(coalesce=coalesce),
+                       topology_config=TopologyConfig(num_atoms=num_atoms))
+    result = run_sweep_point(point,lambda _: command_lists,lambda chip,_: preload_function(chip))
+    return result['finish_time']
+
+
+def test_send_only():
+    # 只有 SEND 的时候 link 没有竞争, 接收端也跟得上 link, 两种模型应该完全一致
+    send_command_list = [SendCommand(opcode='SEND',group_id=[2*i,2*i+1],chunk_size=128,batch_size=16,
+                                     chunk_num=64,dtype='fp16',dst=0,src=64*i,free=False)
+                         for i in range(4)]
+
+    def preload(chip):
+        preload_range(chip.l3_memory,0,256,128,16,2)
+
+    command_lists = (send_command_list,[],[])
+    assert run_finish_time(True,command_lists,preload) == run_finish_time(False,command_lists,preload)
+
+
+def test_chip_scenario():
+    # test_chip 中的 (4,2) 场景: 4 条 SEND 各发给两个 atom, 8 个 atom 累加到两列 reduce, 一条 RECEIVE 汇总
+    send_command_list = [SendCommand(opcode='SEND',group_id=[2*i,2*i+1],chunk_size=128,batch_size=16,chunk_num=8,
+                                     dtype='fp16',dst=100,src=100+8*i,free=False)
+                         for i in range(4)]
+    compute_command_list = [ComputeCommand(opcode='COMPUTE',group_id=list(range(8)),batch_size=16,
+                                           dst=200,dst_chunk_num=16,dst_chunk_size=128,dst_free=True,
+                                           reddst=100,redid=[0,1,0,1,0,1,0,1],
+                                           src=100,src_chunk_num=8,src_chunk_size=128,src_dtype='fp16',src_free=False,
+                                           first_acc=True,last_acc=True)]
+    receive_command_list = [ReceiveCommand(opcode='RECEIVE_MONO',chunk_size=128,batch_size=16,chunk_num=32,
+                                           dst0=500,dst0_type='fp16',src0=100,src0_dtype='fp32',src0_loc='reduce',
+                                           free0=True,redcount=4)]
+
+    def preload(chip):
+        preload_range(chip.l3_memory,100,32,128,16,2)
+
+    command_lists = (send_command_list,receive_command_list,compute_command_list)
+    assert run_finish_time(True,command_lists,preload) == run_finish_time(False,command_lists,preload)
+
+
+@pytest.mark.parametrize('workload',[gen_gemv_stack(4,32),gen_gemm_stack(2,32,64)],
+                         ids=lambda workload: workload.config.name)
+def test_workload(workload):
+    # 每个 atom 独占一条 link, 每一层使用新的 l2 地址, 接收端不会等待, 两种模型完全一致
+    command_lists = (workload.send_command_list,workload.receive_command_list,workload.compute_command_list)
+    coalesce_time = run_finish_time(True,command_lists,workload.preload,workload.config.num_atoms)
+    chunk_time = run_finish_time(False,command_lists,workload.preload,workload.config.num_atoms)
+    assert coalesce_time == chunk_time
@@ -0,0 +1,105 @@
+from Desim.Core import SimModule, SimSession, SimTime
+
+from NeutronSim.CommandQueue import CommandStream, FilteredCommandStream, CommandSequence, IndexedCommandSequence, \
+    ArrayCommandQueue, SharedDecodeSequence
+from NeutronSim.Commands import ComputeCommand
+
+"""
+CommandStream 的预读窗口: 过滤之后的游标不会把 buffer 撑大
+"""
+
+
+class StreamConsumer(SimModule):
+    """
+    模拟一个 atom 的 engine, 每条指令处理 latency 个周期
+    """
+
+    def __init__(self,command_stream:CommandStream,atom_id:int,latency:int):
+        super().__init__()
+
+        self.command_stream = command_stream
+        self.command_queue = FilteredCommandStream(command_stream,
+                                                   lambda command:atom_id in command.group_id).make_queue()
+        self.latency = latency
+
+        self.read_index_list:list[int] = []
+        self.max_buffer_len:int = 0
+
+        self.register_coroutine(self.process)
+
+    def process(self):
+        while not self.command_queue.is_empty():
+            command:ComputeCommand = self.command_queue.read()
+            self.read_index_list.append(command.dst)
+            self.max_buffer_len = max(self.max_buffer_len,len(self.command_stream.buffer))
+            SimModule.wait_time(SimTime(self.latency))
+
+
+def gen_command_list(command_num:int):
+    # atom 0 的指令非常稀疏, 其他 atom 轮流出现
+    for i in range(command_num):
+        group_id = [0] if i % 97 == 0 else [1 + i % 7]
+        yield ComputeCommand(opcode='COMPUTE',group_id=group_id,dst=i)
+
+
+def test_filtered_stream_window():
+    SimSession.reset()
+    SimSession.init()
+
+    command_num = 5000
+    window = 16
+    command_stream = CommandStream(gen_command_list(command_num),window)
+    # 各个 atom 的速度不同, atom 0 最快
+    consumer_list = [StreamConsumer(command_stream,atom_id,1 + atom_id % 3) for atom_id in range(8)]
+
+    SimSession.scheduler.run()
+
+    for atom_id,consumer in enumerate(consumer_list):
+        expected_index_list = [command.dst for command in gen_command_list(command_num)
+                               if atom_id in command.group_id]
+        assert consumer.read_index_list == expected_index_list
+        assert consumer.max_buffer_len <= window
+
+    assert command_stream.exhausted
+    assert len(command_stream.buffer) == 0
+
+
+class CountingSequence(CommandSequence):
+    # 每次解码都构建新的对象, 记录解码的次数
+    def __init__(self,group_id_list:list[list[int]]):
+        self.group_id_list = group_id_list
+        self.decode_num:int = 0
+
+    def __len__(self)->int:
+        return len(self.group_id_list)
+
+    def decode(self,index:int)->ComputeCommand:
+        self.decode_num += 1
+        return ComputeCommand(opcode='COMPUTE',group_id=list(self.group_id_list[index]))
+
+
+def test_shared_decode():
+    # 两个 atom, 每个 atom 两个读者, 每条指令只解码一次, 读完之后不再缓存
+    group_id_list = [[0,1],[0],[1],[0,1]]
+    command_sequence = CountingSequence(group_id_list)
+    shared_sequence = SharedDecodeSequence(command_sequence,lambda command:2*len(command.group_id))
+
+    queue_dict:dict[int,list[ArrayCommandQueue]] = {}
+    for atom_id in [0,1]:
+        atom_sequence = IndexedCommandSequence(shared_sequence,shared_sequence.get_group_index_list(atom_id))
+        queue_dict[atom_id] = [ArrayCommandQueue(atom_sequence),ArrayCommandQueue(atom_sequence)]
+    # 构建索引的时候的解码不算在内
+    command_sequence.decode_num = 0
+
+    read_dict:dict[int,list[list]] = {atom_id:[[],[]] for atom_id in queue_dict}
+    # 读者的进度互相错开
+    for atom_id in [0,1]:
+        for reader_id in [1,0]:
+            queue = queue_dict[atom_id][reader_id]
+            while not queue.is_empty():
+                read_dict[atom_id][reader_id].append(queue.read())
+
+    assert command_sequence.decode_num == len(group_id_list)
+    assert not shared_sequence.decode_cache
+    assert read_dict[0][0][0] is read_dict[1][1][0]
+    assert [command.group_id for command in read_dict[1][0]] == [[0,1],[1],[0,1]]
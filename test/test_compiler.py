@@ -0,0 +1,82 @@
+import pytest
+
+from NeutronSim.Compiler import TilingStrategy, MatmulCompiler, RegionAllocator, tile_matmul, compile_gemm
+from NeutronSim.Roofline import estimate_finish_time
+
+"""
+矩阵乘的切分与编译: reduce 的地址和计数, 缓存的 tile 指令, l2 / reduce 的复用
+"""
+
+
+@pytest.mark.parametrize('k_chunk_num,n_chunk_num',[(8,8),(10,7),(3,5)])
+def test_tile_reduce(k_chunk_num:int,n_chunk_num:int):
+    strategy = TilingStrategy(k_split=4,n_split=2)
+    tile = tile_matmul(k_chunk_num,n_chunk_num,16,'fp16',0,strategy,8)
+
+    # 每个有数据的 k 切分写入一次
+    active_k_num = min(k_chunk_num,strategy.k_split)
+    assert tile.receive_command.redcount == active_k_num
+    assert len(tile.send_command_list) == active_k_num
+
+    # 同一列的 atom 写入 reduce 中同一段地址, 各列拼起来正好覆盖整个输出
+    column_range_dict:dict[int,set[tuple[int,int]]] = {}
+    for command in tile.compute_command_list:
+        for atom_id in command.group_id:
+            n = atom_id % strategy.n_split
+            assert command.redid[atom_id] == n
+            start = command.reddst + command.redid[atom_id]*command.dst_chunk_num
+            column_range_dict.setdefault(n,set()).add((start,start+command.dst_chunk_num))
+    range_list = []
+    for n,range_set in sorted(column_range_dict.items()):
+        assert len(range_set) == 1
+        range_list.extend(range_set)
+    assert range_list[0][0] == 0 and range_list[-1][1] == n_chunk_num
+    assert all(stop == next_start for (_,stop),(next_start,_) in zip(range_list,range_list[1:]))
+    assert tile.reduce_size == n_chunk_num
+
+
+def test_tile_cache_copy():
+    # 修改编译出来的指令不会影响缓存的 tile
+    strategy = TilingStrategy()
+    program = compile_gemm(16,1024,1024,strategy=strategy)
+    program.compute_command_list[0].redid[0] = 99
+    program.compute_command_list[0].group_id.append(99)
+    program.send_command_list[0].group_id.clear()
+    program.receive_command_list[0].bdcst.append(1)
+
+    tile = tile_matmul(8,8,16,'fp16',0,strategy,8)
+    assert 99 not in tile.compute_command_list[0].redid
+    assert 99 not in tile.compute_command_list[0].group_id
+    assert tile.send_command_list[0].group_id
+    assert not tile.receive_command.bdcst
+    assert compile_gemm(16,1024,1024,strategy=strategy).compute_command_list[0].redid[0] == 0
+
+
+def test_region_allocator():
+    allocator = RegionAllocator()
+    assert [allocator.alloc(4),allocator.alloc(4),allocator.alloc(4)] == [0,4,8]
+    allocator.free(0,4)
+    allocator.free(4,4)
+    assert allocator.free_list == [(0,8)]
+    assert allocator.alloc(6) == 0
+    assert allocator.alloc(4) == 12
+    assert allocator.free_list == [(6,2)]
+
+
+def test_layer_reuse():
+    # 每一层形状相同, 两层之后 l2 / reduce 不再增长
+    def compile_stack(num_layers:int)->MatmulCompiler:
+        compiler = MatmulCompiler()
+        compiler.lower_layer_stack(num_layers,32,1024,4096)
+        return compiler
+
+    two_layer = compile_stack(2)
+    six_layer = compile_stack(6)
+    assert six_layer.l2_allocator.top == two_layer.l2_allocator.top
+    assert six_layer.reduce_allocator.top == two_layer.reduce_allocator.top
+
+    # 复用地址之后的指令仍然可以执行完
+    program = six_layer.program
+    result = estimate_finish_time(program.send_command_list,program.receive_command_list,
+                                  program.compute_command_list)
+    assert result['estimate'] > 0
@@ -0,0 +1,28 @@
+import pytest
+
+from NeutronSim.Config import AtomConfig, TopologyConfig
+from NeutronSim.Sweep import SweepPoint, run_sweep_point
+from NeutronSim.Workload import gen_gemv_stack, gen_gemm_stack
+
+"""
+fast compute 模式与逐小块等待的完成时间对比
+"""
+
+
+def run_workload(workload,fast_compute:bool)->dict:
+    point = SweepPoint(atom_config=AtomConfig(fast_compute=fast_compute),
+                       topology_config=TopologyConfig(num_atoms=workload.config.num_atoms))
+    command_lists = (workload.send_command_list,workload.receive_command_list,workload.compute_command_list)
+    return run_sweep_point(point,lambda _: command_lists,lambda chip,_: workload.preload(chip))
+
+
+# 第二个 workload 每个 atom 的 src_chunk_num 超过 fetch fifo 的容量
+@pytest.mark.parametrize('workload',[gen_gemv_stack(4,32),gen_gemm_stack(2,64,128)],
+                         ids=lambda workload: workload.config.name)
+def test_fast_compute_finish_time(workload):
+    fast_result = run_workload(workload,True)
+    chunk_result = run_workload(workload,False)
+
+    assert fast_result['finish_time'] == chunk_result['finish_time']
+    assert fast_result['saved_compute_event_num'] > 0
+    assert chunk_result['saved_compute_event_num'] == 0
@@ -0,0 +1,80 @@
+from NeutronSim.ArrayMemory import preload_range
+from NeutronSim.Commands import ReceiveCommand
+from NeutronSim.ReceiveEngine import ReceiveEngineConfig
+from NeutronSim.Sweep import SweepPoint, run_overlap_gain
+
+"""
+多条 receive 指令重叠执行的收益, 与 recv_engine_width=1 的串行执行对比
+存在地址依赖的指令即使 width 大于 1 也逐条执行
+"""
+
+
+def test_default_width():
+    # 重叠执行需要显式打开
+    assert ReceiveEngineConfig().recv_engine_width == 1
+
+
+def gen_trace(point:SweepPoint):
+    # 互相没有地址依赖的 receive 指令
+    receive_command_list = [
+        ReceiveCommand(opcode='RECEIVE_MONO',chunk_size=128,batch_size=16,chunk_num=8,
+                       dst0=1024+8*i,dst0_type='fp16',src0=8*i,src0_dtype='fp16',src0_loc='l3',free0=False,act=2)
+        for i in range(16)
+    ]
+    return [],receive_command_list,[]
+
+
+def preload(chip,point:SweepPoint):
+    preload_range(chip.l3_memory,0,128,128,16,2)
+
+
+def test_overlap_gain():
+    serial_result = run_overlap_gain(SweepPoint(receive_engine_config=ReceiveEngineConfig(recv_engine_width=1)),
+                                     gen_trace,preload)
+    assert serial_result['overlap_gain'] == 1.0
+
+    result = run_overlap_gain(SweepPoint(receive_engine_config=ReceiveEngineConfig(recv_engine_width=4)),
+                              gen_trace,preload)
+    assert result['serial_receive_span'] == serial_result['receive_span']
+    assert result['overlap_gain'] > 1.0
+    # 收益不会超过同时执行的指令数
+    assert result['overlap_gain'] <= 4.0
+
+
+def run_width(width:int,trace_generator)->tuple[dict,dict]:
+    chip_list = []
+
+    def preload_helper(chip,point:SweepPoint):
+        preload(chip,point)
+        chip_list.append(chip)
+
+    result = run_overlap_gain(SweepPoint(receive_engine_config=ReceiveEngineConfig(recv_engine_width=width),
+                                         perf_report=False),trace_generator,preload_helper)
+    # 第二次仿真使用设定的宽度
+    return result,chip_list[-1].receive_engine.get_overlap_report()
+
+
+def test_independent_overlap():
+    result,overlap_report = run_width(4,gen_trace)
+    assert overlap_report['command_num'] == 16
+    assert 1 < overlap_report['max_inflight_num'] <= 4
+    assert result['receive_span'] < result['serial_receive_span']
+
+
+def gen_chain_trace(point:SweepPoint):
+    # 每条指令读取上一条指令写入 l3 的同一段地址 (RAW)
+    receive_command_list = [
+        ReceiveCommand(opcode='RECEIVE_MONO',chunk_size=128,batch_size=16,chunk_num=8,
+                       dst0=1024*(i+1),dst0_type='fp16',src0=1024*i,src0_dtype='fp16',src0_loc='l3',free0=False,act=2)
+        for i in range(8)
+    ]
+    return [],receive_command_list,[]
+
+
+def test_hazard_serialize():
+    result,overlap_report = run_width(4,gen_chain_trace)
+    assert overlap_report['command_num'] == 8
+    # 没有两条指令同时执行, 时序与 width 为 1 完全相同
+    assert overlap_report['max_inflight_num'] == 1
+    assert result['receive_span'] == result['serial_receive_span']
+    assert result['finish_time'] == result['serial_finish_time']
@@ -0,0 +1,37 @@
+from Desim.Core import SimSession
+
+from NeutronSim.Replay import BlockReplayEstimator, ReplayConfig
+from NeutronSim.Sweep import SweepPoint, build_chip
+from NeutronSim.Utils import get_sim_cycle
+from NeutronSim.Workload import gen_gemv_stack
+
+"""
+记忆化重放的估计值与完整仿真的比较
+"""
+
+
+def test_replay_estimate():
+    num_layers = 6
+    workload = gen_gemv_stack(num_layers,16)
+    point = SweepPoint(perf_report=False)
+
+    SimSession.reset()
+    SimSession.init()
+    chip = build_chip(point)
+    chip.load_command(workload.send_command_list,workload.receive_command_list,workload.compute_command_list)
+    workload.preload(chip)
+    SimSession.scheduler.run()
+    full_finish_time = get_sim_cycle()
+
+    estimator = BlockReplayEstimator(point,ReplayConfig(measure_bias=True))
+    result = estimator.run(workload.send_command_list,workload.receive_command_list,workload.compute_command_list,
+                           workload.preload)
+    # 每一层是一个块, 输入都是上一层写入一次的 l3, 只有第一个块需要仿真
+    assert result['block_num'] == num_layers
+    assert result['miss_num'] == 1
+    assert result['hit_num'] == num_layers - 1
+
+    # 块与块之间串行执行, 估计值不会早于完整仿真
+    assert result['simulated_time'] == full_finish_time
+    assert result['estimate'] >= full_finish_time
+    assert result['bias'] == result['estimate'] - full_finish_time
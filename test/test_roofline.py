@@ -0,0 +1,50 @@
+from NeutronSim.Commands import SendCommand, ComputeCommand, ReceiveCommand
+from NeutronSim.Config import TopologyConfig
+from NeutronSim.Roofline import RooflineConfig, estimate_finish_time
+
+"""
+解析模型中的地址依赖: buffer 在层与层之间复用的时候只依赖程序顺序上最近的一次写入
+"""
+
+
+def gen_layer_stack(num_layers:int,chunk_num:int,double_buffer:bool):
+    """
+    两个 atom 累加到同一块 reduce, 每一层的输出作为下一层的输入
+    double_buffer 的时候 l2 / reduce / l3 都只有两块 buffer 轮流使用, 否则每一层使用新的地址
+    """
+    send_command_list = []
+    compute_command_list = []
+    receive_command_list = []
+
+    def get_buffer(layer_id:int)->int:
+        return layer_id % 2 if double_buffer else layer_id
+
+    for layer_id in range(num_layers):
+        l3_src = get_buffer(layer_id) * chunk_num
+        l3_dst = get_buffer(layer_id+1) * chunk_num
+        l2_src = get_buffer(layer_id) * 2*chunk_num
+        reduce_addr = get_buffer(layer_id) * chunk_num
+
+        send_command_list.append(SendCommand(opcode='SEND',group_id=[0,1],chunk_size=128,batch_size=16,
+                                             chunk_num=chunk_num,dtype='fp16',dst=l2_src,src=l3_src,
+                                             free=double_buffer))
+        compute_command_list.append(ComputeCommand(opcode='COMPUTE',group_id=[0,1],batch_size=16,
+                                                   dst=l2_src+chunk_num,dst_chunk_num=chunk_num,dst_chunk_size=128,
+                                                   dst_free=True,reddst=reduce_addr,redid=[0,0],
+                                                   src=l2_src,src_chunk_num=chunk_num,src_chunk_size=128,
+                                                   src_dtype='fp16',src_free=True,first_acc=True,last_acc=True))
+        receive_command_list.append(ReceiveCommand(opcode='RECEIVE_MONO',chunk_size=128,batch_size=16,
+                                                   chunk_num=chunk_num,dst0=l3_dst,dst0_type='fp16',
+                                                   src0=reduce_addr,src0_dtype='fp32',src0_loc='reduce',free0=True,
+                                                   redcount=2))
+
+    return send_command_list,receive_command_list,compute_command_list
+
+
+def test_double_buffer():
+    # 复用的 buffer 不会产生假的依赖, 与每一层使用新地址的结果完全一致
+    config = RooflineConfig(topology_config=TopologyConfig(num_atoms=2))
+    double_buffer_result = estimate_finish_time(*gen_layer_stack(6,8,True),config)
+    fresh_result = estimate_finish_time(*gen_layer_stack(6,8,False),config)
+    assert double_buffer_result['critical_path'] == fresh_result['critical_path']
+    assert double_buffer_result['estimate'] == fresh_result['estimate']
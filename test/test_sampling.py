@@ -0,0 +1,29 @@
+import dataclasses
+
+from NeutronSim.Sampling import detect_block_num, run_sampled
+from NeutronSim.Sweep import SweepPoint
+from NeutronSim.Workload import gen_gemv_stack
+
+"""
+重复块的识别: 三种指令使用同一组基地址归一化
+"""
+
+
+def test_cross_command_address():
+    workload = gen_gemv_stack(6,16)
+    command_list_tuple = (workload.send_command_list,workload.receive_command_list,workload.compute_command_list)
+    assert detect_block_num(*command_list_tuple) == 6
+
+    # 只有一层的 COMPUTE 读取的 l2 地址与 SEND 写入的地址错开, 每个字段单独看仍然是相同的偏移
+    compute_command_list = list(workload.compute_command_list)
+    compute_command_list[3] = dataclasses.replace(compute_command_list[3],src=compute_command_list[3].src+1)
+    assert detect_block_num(workload.send_command_list,workload.receive_command_list,compute_command_list) == 1
+
+
+def test_without_receive():
+    # 没有 receive 指令的时候无法划分块, 完整仿真
+    workload = gen_gemv_stack(4,16)
+    result = run_sampled(SweepPoint(perf_report=False),workload.send_command_list,[],workload.compute_command_list,
+                         workload.preload)
+    assert result['block_num'] == 1
+    assert result['estimate'] == result['simulated_time']
@@ -0,0 +1,58 @@
+import csv
+
+import pytest
+
+from NeutronSim.Config import LinkConfig
+from NeutronSim.Sweep import SweepPoint, build_sweep_grid, set_sweep_value, write_sweep_table, flatten_report
+
+"""
+sweep 网格的展开以及结果表, 不需要仿真
+"""
+
+
+def test_set_sweep_value():
+    point = SweepPoint()
+    set_sweep_value(point,'d2d_link_config.bandwidth',32)
+    set_sweep_value(point,'receive_engine_config.vector_engine_config.lanes',32)
+    set_sweep_value(point,'perf_report',False)
+    assert point.d2d_link_config.bandwidth == 32
+    assert point.receive_engine_config.vector_engine_config.lanes == 32
+    assert not point.perf_report
+    # 默认的 config 不会被修改
+    assert LinkConfig().bandwidth == 16
+
+    with pytest.raises(AttributeError):
+        set_sweep_value(point,'d2d_link_config.unknown',1)
+    with pytest.raises(AttributeError):
+        set_sweep_value(point,'unknown_config.bandwidth',1)
+
+
+def test_build_sweep_grid():
+    base_point = SweepPoint(tag={'case':'base'})
+    point_list = build_sweep_grid(base_point,{'d2d_link_config.bandwidth':[16,32],
+                                              'topology_config.num_atoms':[8,16,32]})
+    assert len(point_list) == 6
+    assert [(point.d2d_link_config.bandwidth,point.topology_config.num_atoms) for point in point_list] == \
+           [(16,8),(16,16),(16,32),(32,8),(32,16),(32,32)]
+    assert point_list[4].tag == {'case':'base','d2d_link_config.bandwidth':32,'topology_config.num_atoms':16}
+    # 每个设计点都是独立的拷贝
+    assert base_point.d2d_link_config.bandwidth == 16
+    assert point_list[0].d2d_link_config is not point_list[1].d2d_link_config
+
+
+def test_write_sweep_table(tmp_path):
+    result_list = [
+        {'bandwidth':16,'finish_time':100,**flatten_report({'memory':{'l3':{'utilization':0.5}}},'perf.')},
+        {'bandwidth':32,'finish_time':60,'receive_span':40},
+    ]
+    path = tmp_path / 'sweep.csv'
+    write_sweep_table(result_list,str(path))
+
+    with open(path,newline='') as f:
+        reader = csv.DictReader(f)
+        assert reader.fieldnames == ['bandwidth','finish_time','perf.memory.l3.utilization','receive_span']
+        row_list = list(reader)
+    assert row_list == [
+        {'bandwidth':'16','finish_time':'100','perf.memory.l3.utilization':'0.5','receive_span':''},
+        {'bandwidth':'32','finish_time':'60','perf.memory.l3.utilization':'','receive_span':'40'},
+    ]
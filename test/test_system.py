@@ -0,0 +1,75 @@
+from Desim.Core import SimSession
+
+from NeutronSim.ArrayMemory import preload_range
+from NeutronSim.Commands import ChipSendCommand, ReceiveCommand
+from NeutronSim.Config import LinkConfig, MemoryConfig, AtomConfig
+from NeutronSim.System import System, SystemConfig
+from NeutronSim.Utils import get_sim_cycle
+
+"""
+多 chip 系统: ring 上满负载的转发, 以及写到其他 chip 上的 RECEIVE 指令
+"""
+
+
+def build_system(num_chips:int,link_latency:int=100)->System:
+    SimSession.reset()
+    SimSession.init()
+
+    system_config = SystemConfig(num_chips=num_chips,inter_chip_link_config=LinkConfig(link_latency=link_latency),
+                                 link_topology='ring')
+    return System(system_config,LinkConfig(),
+                  MemoryConfig(),MemoryConfig(),MemoryConfig(),AtomConfig())
+
+
+def test_ring_all_to_all():
+    # 每个 chip 同时向其他所有 chip 发送, 中间的 chip 需要转发, 所有 link 都远超 credit 的数量
+    num_chips = 4
+    chunk_num = 64
+    system = build_system(num_chips)
+
+    for src_chip_id in range(num_chips):
+        chip_send_command_list = [
+            ChipSendCommand(dst_chip=dst_chip_id,chunk_size=128,batch_size=16,chunk_num=chunk_num,dtype='fp16',
+                            dst=chunk_num*src_chip_id,dst_loc='l3',src=0,free=False)
+            for dst_chip_id in range(num_chips) if dst_chip_id != src_chip_id
+        ]
+        preload_range(system.get_chip(src_chip_id).l3_memory,0,chunk_num,128,16,2)
+        system.load_command(src_chip_id,[],[],[],chip_send_command_list)
+
+    SimSession.scheduler.run()
+
+    # 没有死锁的时候, 每个 chip 都收到了其他所有 chip 的数据
+    for dst_chip_id in range(num_chips):
+        memory_tag = system.get_chip(dst_chip_id).l3_memory.memory_tag
+        for src_chip_id in range(num_chips):
+            if src_chip_id == dst_chip_id:
+                continue
+            for addr in range(chunk_num*src_chip_id,chunk_num*(src_chip_id+1)):
+                assert addr in memory_tag
+
+
+def test_remote_receive_wait_ack():
+    # 写到两跳之外的 chip, 指令要等到数据写入并且确认返回之后才结束
+    link_latency = 100
+    chunk_num = 8
+    system = build_system(4,link_latency)
+
+    chip = system.get_chip(0)
+    preload_range(chip.l3_memory,0,chunk_num,128,16,2)
+    receive_command_list = [
+        ReceiveCommand(opcode='RECEIVE_MONO',chunk_size=128,batch_size=16,chunk_num=chunk_num,
+                       dst0=100,dst0_type='fp16',src0=0,src0_dtype='fp16',src0_loc='l3',free0=False,
+                       dst_chip=2)
+    ]
+    system.load_command(0,[],receive_command_list,[])
+
+    SimSession.scheduler.run()
+
+    memory_tag = system.get_chip(2).l3_memory.memory_tag
+    for addr in range(100,100+chunk_num):
+        assert addr in memory_tag
+
+    # 去程和回程各两跳
+    finish_time, = chip.receive_engine.finish_time_list
+    assert finish_time >= 4*link_latency
+    assert finish_time <= get_sim_cycle()
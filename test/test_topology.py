@@ -0,0 +1,45 @@
+from NeutronSim.ArrayMemory import preload_range
+from NeutronSim.Commands import SendCommand
+from NeutronSim.Config import TopologyConfig
+from NeutronSim.Sweep import SweepPoint, run_sweep_point
+from NeutronSim.Workload import gen_gemv_stack
+
+"""
+atom 与 link 的映射: 多个 atom 共用一条 link, 以及超过 8 个 atom 的配置
+"""
+
+
+def run_send(atom_link_map:dict[int,int])->int:
+    send_command_list = [SendCommand(opcode='SEND',group_id=[0,1],chunk_size=128,batch_size=16,chunk_num=16,
+                                     dtype='fp16',dst=0,src=0,free=False)]
+    point = SweepPoint(topology_config=TopologyConfig(num_atoms=2,atom_link_map=atom_link_map),perf_report=False)
+    result = run_sweep_point(point,lambda _: (send_command_list,[],[]),
+                             lambda chip,_: preload_range(chip.l3_memory,0,16,128,16,2))
+    return result['finish_time']
+
+
+def test_shared_link():
+    # 两个 atom 共用 link 0 的时候, 每个 chunk 依次发给两个 atom, 比各自独占一条 link 更晚结束
+    separate_time = run_send({})
+    shared_time = run_send({1:0})
+    assert shared_time > separate_time
+
+
+def test_16_atoms():
+    workload = gen_gemv_stack(2,16,num_atoms=16)
+    point = SweepPoint(topology_config=TopologyConfig(num_atoms=16),perf_report=False)
+    chip_list = []
+
+    def preload(chip,_):
+        workload.preload(chip)
+        chip_list.append(chip)
+
+    result = run_sweep_point(point,lambda _: (workload.send_command_list,workload.receive_command_list,
+                                              workload.compute_command_list),preload)
+    assert result['finish_time'] > 0
+
+    # 最后一层的输出全部写回 l3
+    last_receive = workload.receive_command_list[-1]
+    memory_tag = chip_list[0].l3_memory.memory_tag
+    for addr in range(last_receive.dst0,last_receive.dst0+last_receive.chunk_num):
+        assert addr in memory_tag
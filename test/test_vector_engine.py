@@ -0,0 +1,74 @@
+import pytest
+
+from Desim.Core import SimSession
+
+from NeutronSim.Chip import Chip
+from NeutronSim.Commands import ReceiveCommand
+from NeutronSim.Config import LinkConfig, MemoryConfig, AtomConfig
+from NeutronSim.Trace import CommandTrace, ReceiveCommandArray
+from NeutronSim.VectorEngine import VectorEngine, VectorEngineConfig, VectorOpConfig
+
+"""
+向量单元的占用时间, 以及 act 编码的检查
+"""
+
+
+def test_occupancy_scaling():
+    vector_engine = VectorEngine(VectorEngineConfig(lanes=64,lane_bytes=2))
+    op_config = VectorOpConfig(latency=4,throughput=1.0)
+
+    base = vector_engine.get_occupancy(op_config,128,16,2)
+    assert base == 128*16 // 64
+    # 与 chunk_size x batch_size 成正比
+    assert vector_engine.get_occupancy(op_config,256,16,2) == 2*base
+    assert vector_engine.get_occupancy(op_config,128,32,2) == 2*base
+    # fp32 占用两条 lane, int8 与 fp16 一样占用一条
+    assert vector_engine.get_occupancy(op_config,128,16,4) == 2*base
+    assert vector_engine.get_occupancy(op_config,128,16,1) == base
+    # 吞吐率减半, 占用时间翻倍
+    assert vector_engine.get_occupancy(VectorOpConfig(latency=4,throughput=0.5),128,16,2) == 2*base
+
+
+def test_unknown_act():
+    SimSession.reset()
+    SimSession.init()
+
+    chip = Chip(LinkConfig(),MemoryConfig(),MemoryConfig(),MemoryConfig(),AtomConfig())
+    receive_command_list = [
+        ReceiveCommand(opcode='RECEIVE_MONO',chunk_size=128,batch_size=16,chunk_num=4,
+                       dst0=0,dst0_type='fp16',src0=0,src0_dtype='fp32',src0_loc='reduce',redcount=1,act=7)
+    ]
+    # 在加载的时候就报错, 而不是仿真到这条指令的时候
+    with pytest.raises(ValueError,match='unknown act code 7'):
+        chip.load_command([],receive_command_list,[])
+
+
+
+class CountingReceiveArray(ReceiveCommandArray):
+    # 记录解码的次数
+    decode_num:int = 0
+
+    def decode(self,index:int):
+        CountingReceiveArray.decode_num += 1
+        return super().decode(index)
+
+
+def test_unknown_act_trace():
+    SimSession.reset()
+    SimSession.init()
+
+    chip = Chip(LinkConfig(),MemoryConfig(),MemoryConfig(),MemoryConfig(),AtomConfig())
+    act_list = [0,*chip.receive_engine_config.vector_engine_config.act_op_dict]
+    receive_command_list = [
+        ReceiveCommand(opcode='RECEIVE_MONO',chunk_size=128,batch_size=16,chunk_num=4,
+                       dst0=0,dst0_type='fp16',src0=0,src0_dtype='fp32',src0_loc='reduce',redcount=1,act=act)
+        for act in act_list+[7]
+    ]
+    # trace 在加载的时候直接检查 act 列, 不解码指令
+    CountingReceiveArray.decode_num = 0
+    valid_trace = CommandTrace.from_commands([],receive_command_list[:-1],[])
+    chip.receive_engine.load_command(CountingReceiveArray(valid_trace.receive_array))
+    invalid_trace = CommandTrace.from_commands([],receive_command_list,[])
+    with pytest.raises(ValueError,match='unknown act code 7'):
+        chip.receive_engine.load_command(CountingReceiveArray(invalid_trace.receive_array))
+    assert CountingReceiveArray.decode_num == 0